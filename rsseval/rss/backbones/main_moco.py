@@ -11,7 +11,7 @@ import builtins
 import math
 import os
 import random
-import shutil
+import sys
 import time
 import warnings
 from functools import partial
@@ -29,7 +29,7 @@ import torch.utils.data.distributed
 import torchvision.transforms as transforms
 import torchvision.datasets as datasets
 import torchvision.models as torchvision_models
-from torch.utils.tensorboard import SummaryWriter
+import wandb
 
 import moco.builder
 import moco.loader
@@ -37,6 +37,11 @@ import moco.optimizer
 
 import vits
 
+# buffered logger shared with the rsseval training loop
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.logger import AsyncLogger, NullBackend, make_backend
+from utils.checkpoint import AsyncCheckpointManager, latest_checkpoint
+
 
 torchvision_model_names = sorted(name for name in torchvision_models.__dict__
     if name.islower() and not name.startswith("__")
@@ -72,8 +77,22 @@ parser.add_argument('--wd', '--weight-decay', default=1e-6, type=float,
                     dest='weight_decay')
 parser.add_argument('-p', '--print-freq', default=10, type=int,
                     metavar='N', help='print frequency (default: 10)')
+parser.add_argument('--logger', default='tensorboard', type=str,
+                    choices=['tensorboard', 'wandb', 'jsonl', 'parquet', 'none'],
+                    help='logging backend, written by a background thread (default: tensorboard)')
+parser.add_argument('--log-dir', default='runs', type=str,
+                    help='folder of the local logs (default: runs)')
+parser.add_argument('--wandb-project', default='moco', type=str,
+                    help='wandb project of the run, with --logger wandb (default: moco)')
+parser.add_argument('--wandb-entity', default=None, type=str,
+                    help='wandb entity of the run, with --logger wandb (default: none)')
 parser.add_argument('--resume', default='', type=str, metavar='PATH',
-                    help='path to latest checkpoint (default: none)')
+                    help='path to latest checkpoint, or auto for the last written '
+                         'complete checkpoint of --checkpoint-dir (default: none)')
+parser.add_argument('--checkpoint-dir', default='.', type=str,
+                    help='folder of the checkpoints, written by a background thread (default: .)')
+parser.add_argument('--keep-checkpoints', default=1, type=int,
+                    help='number of epoch checkpoints kept besides the best one (default: 1)')
 parser.add_argument('--world-size', default=-1, type=int,
                     help='number of nodes for distributed training')
 parser.add_argument('--rank', default=-1, type=int,
@@ -117,6 +136,15 @@ parser.add_argument('--warmup-epochs', default=10, type=int, metavar='N',
                     help='number of warmup epochs')
 parser.add_argument('--crop-min', default=0.08, type=float,
                     help='minimum scale for random cropping (default: 0.08)')
+parser.add_argument('--image-store-dir', default='/dev/shm', type=str,
+                    help='folder (a tmpfs) of the decoded training images, shared '
+                         'by the loading workers and the ranks of a node; an '
+                         'empty string decodes the images from disk every epoch '
+                         '(default: /dev/shm)')
+parser.add_argument('--keep-image-store', action='store_true',
+                    help='keep the decoded images in --image-store-dir at the end '
+                         'of the training, to be reused by the next runs on the '
+                         'same data; by default they are deleted')
 
 
 def main():
@@ -158,8 +186,6 @@ def main():
 def main_worker(gpu, ngpus_per_node, args):
     args.gpu = gpu
     best_loss = float('inf')
-    prev_checkpoint = None
-    best_filename = 'model_best.pth.tar'
 
 
     # suppress printing if not first GPU on each node
@@ -236,9 +262,19 @@ def main_worker(gpu, ngpus_per_node, args):
                                 weight_decay=args.weight_decay)
         
     scaler = torch.cuda.amp.GradScaler()
-    summary_writer = SummaryWriter() if args.rank == 0 else None
+    # only the first process logs, the others enqueue into a no-op logger
+    if args.rank == 0:
+        if args.logger == 'wandb':
+            # the wandb backend logs on the current run
+            wandb.init(project=args.wandb_project, entity=args.wandb_entity,
+                       config=vars(args))
+        summary_writer = AsyncLogger(make_backend(args.logger, args.log_dir, 'moco'))
+    else:
+        summary_writer = AsyncLogger(NullBackend())
 
     # optionally resume from a checkpoint
+    if args.resume == 'auto':
+        args.resume = latest_checkpoint(args.checkpoint_dir) or ''
     if args.resume:
         if os.path.isfile(args.resume):
             print("=> loading checkpoint '{}'".format(args.resume))
@@ -252,6 +288,7 @@ def main_worker(gpu, ngpus_per_node, args):
             model.load_state_dict(checkpoint['state_dict'])
             optimizer.load_state_dict(checkpoint['optimizer'])
             scaler.load_state_dict(checkpoint['scaler'])
+            best_loss = checkpoint.get('best_loss', best_loss)
             print("=> loaded checkpoint '{}' (epoch {})"
                   .format(args.resume, checkpoint['epoch']))
         else:
@@ -294,14 +331,24 @@ def main_worker(gpu, ngpus_per_node, args):
         traindir,
         moco.loader.TwoCropsTransform(transforms.Compose(augmentation1), 
                                       transforms.Compose(augmentation2)))'''
-    train_dataset = KandinskyDataset(
-    root=traindir,
-    split_name='train',
-    transform=moco.loader.TwoCropsTransform(
-        transforms.Compose(augmentation1), 
-        transforms.Compose(augmentation2)
-        )
-    )
+    two_crops = moco.loader.TwoCropsTransform(
+        transforms.Compose(augmentation1),
+        transforms.Compose(augmentation2))
+    if args.image_store_dir:
+        # decode the split once per node, the workers and the ranks map the store
+        dataset = KandinskyDataset(root=traindir, split_name='train')
+        store_path = moco.loader.image_store_path(
+            args.image_store_dir, traindir, 'train', len(dataset))
+        local_rank = int(os.environ.get('LOCAL_RANK', args.gpu or 0))
+        if (not args.distributed or local_rank == 0) and not os.path.exists(store_path):
+            print("=> decoding '{}' in '{}'".format(traindir, store_path))
+            moco.loader.SharedImageDataset.build(dataset, store_path, args.workers)
+        if args.distributed:
+            torch.distributed.barrier()
+        train_dataset = moco.loader.SharedImageDataset(store_path, transform=two_crops)
+    else:
+        train_dataset = KandinskyDataset(
+            root=traindir, split_name='train', transform=two_crops)
 
     if args.distributed:
         train_sampler = torch.utils.data.distributed.DistributedSampler(train_dataset)
@@ -314,31 +361,48 @@ def main_worker(gpu, ngpus_per_node, args):
     
 
 
-    for epoch in range(args.start_epoch, args.epochs):
-        if args.distributed:
-            train_sampler.set_epoch(epoch)
-
-        # train for one epoch
-        loss = train(train_loader, model, optimizer, scaler, summary_writer, epoch, args)
-        is_best = loss < best_loss
-        if is_best:
-            best_loss = loss
-        checkpoint_filename = f'checkpoint_{epoch:04d}.pth.tar'
-        if not args.multiprocessing_distributed or (args.multiprocessing_distributed
-                and args.rank == 0): # only the first GPU saves checkpoint
-            save_checkpoint({
-                'epoch': epoch + 1,
-                'arch': args.arch,
-                'state_dict': model.state_dict(),
-                'optimizer' : optimizer.state_dict(),
-                'scaler': scaler.state_dict(),
-                'loss': loss,
-            }, is_best=is_best, filename=checkpoint_filename, prev_filename=prev_checkpoint, best_filename=best_filename)
-        
-        prev_checkpoint = checkpoint_filename
-
-    if args.rank == 0:
+    # only the first GPU saves checkpoint, from a background thread
+    checkpoints = None
+    if not args.multiprocessing_distributed or (args.multiprocessing_distributed
+            and args.rank == 0):
+        checkpoints = AsyncCheckpointManager(
+            args.checkpoint_dir, keep_last=args.keep_checkpoints,
+            resume=args.resume or None)
+
+    try:
+        for epoch in range(args.start_epoch, args.epochs):
+            if args.distributed:
+                train_sampler.set_epoch(epoch)
+
+            # train for one epoch
+            loss = train(train_loader, model, optimizer, scaler, summary_writer, epoch, args)
+            is_best = loss < best_loss
+            if is_best:
+                best_loss = loss
+            if checkpoints is not None:
+                # snapshot on CPU, written by the checkpoint thread
+                checkpoints.save({
+                    'epoch': epoch + 1,
+                    'arch': args.arch,
+                    'state_dict': model.state_dict(),
+                    'optimizer' : optimizer.state_dict(),
+                    'scaler': scaler.state_dict(),
+                    'loss': loss,
+                    'best_loss': best_loss,
+                }, epoch, is_best=is_best)
+    finally:
+        # the queued checkpoints are written even if the training fails
         summary_writer.close()
+        if args.rank == 0 and args.logger == 'wandb':
+            wandb.finish()
+        if checkpoints is not None:
+            checkpoints.close()
+
+    if args.image_store_dir and not args.keep_image_store:
+        if args.distributed:
+            torch.distributed.barrier()
+        if not args.distributed or local_rank == 0:
+            moco.loader.SharedImageDataset.remove(store_path)
 
 def train(train_loader, model, optimizer, scaler, summary_writer, epoch, args):
     batch_time = AverageMeter('Time', ':6.3f')
@@ -374,9 +438,9 @@ def train(train_loader, model, optimizer, scaler, summary_writer, epoch, args):
         with torch.cuda.amp.autocast(True):
             loss = model(images[0], images[1], moco_m)
 
-        losses.update(loss.item(), images[0].size(0))
-        if args.rank == 0:
-            summary_writer.add_scalar("loss", loss.item(), epoch * iters_per_epoch + i)
+        # the loss stays on device, it is read by the logging thread and at print time
+        losses.update(loss.detach(), images[0].size(0))
+        summary_writer.log({"loss": loss.detach()}, step=epoch * iters_per_epoch + i)
 
         # compute gradient and do SGD step
         optimizer.zero_grad()
@@ -391,22 +455,7 @@ def train(train_loader, model, optimizer, scaler, summary_writer, epoch, args):
         if i % args.print_freq == 0:
             progress.display(i)
         
-    return losses.avg  # return loss for logging
-
-
-def save_checkpoint(state, is_best, filename='checkpoint.pth.tar', prev_filename=None, best_filename='model_best.pth.tar'):
-    # Save current checkpoint
-    torch.save(state, filename)
-    
-    # If previous checkpoint exists and it's not the best, delete it
-    if prev_filename and os.path.exists(prev_filename):
-        if prev_filename != best_filename:  # Protect the best checkpoint
-            os.remove(prev_filename)
-
-    # If this is the best checkpoint, save a copy
-    if is_best:
-        shutil.copyfile(filename, best_filename)
-        # shutil.copyfile(filename, 'model_best.pth.tar')
+    return float(losses.avg)  # return loss for logging
 
 
 class AverageMeter(object):
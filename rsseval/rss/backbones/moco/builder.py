@@ -57,8 +57,10 @@ class MoCo(nn.Module):
     @torch.no_grad()
     def _update_momentum_encoder(self, m):
         """Momentum update of the momentum encoder"""
-        for param_b, param_m in zip(self.base_encoder.parameters(), self.momentum_encoder.parameters()):
-            param_m.data = param_m.data * m + param_b.data * (1. - m)
+        # in place and multi-tensor: param_m = param_m * m + param_b * (1 - m)
+        params_m = list(self.momentum_encoder.parameters())
+        torch._foreach_mul_(params_m, m)
+        torch._foreach_add_(params_m, list(self.base_encoder.parameters()), alpha=1. - m)
 
     def contrastive_loss(self, q, k):
         # normalize
@@ -5,8 +5,13 @@
 # LICENSE file in the root directory of this source tree.
 
 from PIL import Image, ImageFilter, ImageOps
+import hashlib
 import math
+import os
 import random
+import numpy as np
+import torch
+import torch.utils.data
 import torchvision.transforms.functional as tf
 
 
@@ -39,4 +44,113 @@ class Solarize(object):
     """Solarize augmentation from BYOL: https://arxiv.org/abs/2006.07733"""
 
     def __call__(self, x):
-        return ImageOps.solarize(x)
\ No newline at end of file
+        return ImageOps.solarize(x)
+
+
+def _files_fingerprint(root):
+    """Hash of the relative path, size and last modification of every file
+    under root, which changes if the images are added, removed or rewritten"""
+    digest = hashlib.sha1()
+    for folder, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(folder, name)
+            stat = os.stat(path)
+            digest.update("{}:{}:{}\n".format(
+                os.path.relpath(path, root), stat.st_size, stat.st_mtime_ns).encode())
+    return digest.hexdigest()
+
+
+def image_store_path(store_dir, root, split_name, length):
+    """Path of the decoded images of a split in store_dir, e.g. /dev/shm. The
+    key includes a fingerprint of the files under root, so that a store is not
+    reused once the dataset changes"""
+    key = "{}:{}:{}:{}".format(
+        os.path.abspath(root), split_name, length, _files_fingerprint(root))
+    return os.path.join(
+        store_dir, "moco_{}.npy".format(hashlib.sha1(key.encode()).hexdigest()[:16]))
+
+
+def _targets_path(path):
+    return path[:-len(".npy")] + "_targets.npy"
+
+
+def _to_uint8(image):
+    """(H, W, C) uint8 array of a PIL image, an array or a [0, 1] CHW tensor"""
+    if isinstance(image, Image.Image):
+        return np.asarray(image.convert("RGB"))
+    if isinstance(image, torch.Tensor):
+        if image.is_floating_point():
+            image = (image * 255).round()
+        return image.to(torch.uint8).permute(1, 2, 0).numpy()
+    return np.asarray(image, dtype=np.uint8)
+
+
+def _identity(sample):
+    return sample
+
+
+class SharedImageDataset(torch.utils.data.Dataset):
+    """Decoded images of a dataset, in a uint8 array file which all the
+    DataLoader workers and the ranks of a node memory-map: the images are read
+    from disk and decoded once, then the transform reads them from the page
+    cache. The file is written by build, in a tmpfs such as /dev/shm."""
+
+    def __init__(self, path, transform=None):
+        self.path = path
+        self.transform = transform
+        self._open()
+
+    def _open(self):
+        self.images = np.load(self.path, mmap_mode="r")
+        self.targets = np.load(_targets_path(self.path), allow_pickle=True)
+
+    @staticmethod
+    def build(dataset, path, num_workers=0):
+        """Decodes the (image, target) samples of a dataset without transform
+        in path, with num_workers DataLoader workers"""
+        loader = torch.utils.data.DataLoader(
+            dataset, batch_size=None, num_workers=num_workers, collate_fn=_identity)
+
+        tmp = "{}.{}.tmp.npy".format(path[:-len(".npy")], os.getpid())
+        images, targets = None, []
+        for i, (image, target) in enumerate(loader):
+            image = _to_uint8(image)
+            if images is None:
+                images = np.lib.format.open_memmap(
+                    tmp, mode="w+", dtype=np.uint8, shape=(len(dataset),) + image.shape)
+            images[i] = image
+            targets.append(target)
+        images.flush()
+        del images
+
+        # the images are renamed last, a store whose images exist is complete
+        np.save(_targets_path(path), np.asarray(targets))
+        os.replace(tmp, path)
+
+    @staticmethod
+    def remove(path):
+        """Deletes the store at path, the processes which still map it keep
+        reading it until they unmap it"""
+        for file in (path, _targets_path(path)):
+            if os.path.exists(file):
+                os.remove(file)
+
+    def __getstate__(self):
+        # the workers map the file again instead of receiving a copy
+        state = self.__dict__.copy()
+        del state["images"], state["targets"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, index):
+        image = Image.fromarray(np.array(self.images[index]))
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, self.targets[index]
@@ -10,34 +10,82 @@ import torch
 class LARS(torch.optim.Optimizer):
     """
     LARS optimizer, no rate scaling or weight decay for parameters <= 1D.
+
+    With foreach=True (default) the parameters of a group are updated with
+    in-place multi-tensor (torch._foreach_*) ops, grouped by device and dtype,
+    and the trust ratios of all the weights are computed at once; the weight
+    decay is added to the gradients of the weights, which are consumed by the
+    step. foreach=False keeps the per-parameter loop.
     """
-    def __init__(self, params, lr=0, weight_decay=0, momentum=0.9, trust_coefficient=0.001):
+    def __init__(self, params, lr=0, weight_decay=0, momentum=0.9, trust_coefficient=0.001, foreach=True):
         defaults = dict(lr=lr, weight_decay=weight_decay, momentum=momentum, trust_coefficient=trust_coefficient)
         super().__init__(params, defaults)
+        self.foreach = foreach
 
     @torch.no_grad()
     def step(self):
         for g in self.param_groups:
-            for p in g['params']:
-                dp = p.grad
-
-                if dp is None:
-                    continue
-
-                if p.ndim > 1: # if not normalization gamma/beta or bias
-                    dp = dp.add(p, alpha=g['weight_decay'])
-                    param_norm = torch.norm(p)
-                    update_norm = torch.norm(dp)
-                    one = torch.ones_like(param_norm)
-                    q = torch.where(param_norm > 0.,
-                                    torch.where(update_norm > 0,
-                                    (g['trust_coefficient'] * param_norm / update_norm), one),
-                                    one)
-                    dp = dp.mul(q)
-
-                param_state = self.state[p]
-                if 'mu' not in param_state:
-                    param_state['mu'] = torch.zeros_like(p)
-                mu = param_state['mu']
-                mu.mul_(g['momentum']).add_(dp)
-                p.add_(mu, alpha=-g['lr'])
+            if self.foreach:
+                self._foreach_step(g)
+            else:
+                self._single_tensor_step(g)
+
+    def _momentum_buffer(self, p):
+        param_state = self.state[p]
+        if 'mu' not in param_state:
+            param_state['mu'] = torch.zeros_like(p)
+        return param_state['mu']
+
+    def _single_tensor_step(self, g):
+        for p in g['params']:
+            dp = p.grad
+
+            if dp is None:
+                continue
+
+            if p.ndim > 1: # if not normalization gamma/beta or bias
+                dp = dp.add(p, alpha=g['weight_decay'])
+                param_norm = torch.norm(p)
+                update_norm = torch.norm(dp)
+                one = torch.ones_like(param_norm)
+                q = torch.where(param_norm > 0.,
+                                torch.where(update_norm > 0,
+                                (g['trust_coefficient'] * param_norm / update_norm), one),
+                                one)
+                dp = dp.mul(q)
+
+            mu = self._momentum_buffer(p)
+            mu.mul_(g['momentum']).add_(dp)
+            p.add_(mu, alpha=-g['lr'])
+
+    def _foreach_step(self, g):
+        # the norms of a device and dtype are stacked, the ops run per group
+        groups = {}
+        for p in g['params']:
+            if p.grad is not None:
+                groups.setdefault((p.device, p.dtype), []).append(p)
+
+        for params in groups.values():
+            mus = [self._momentum_buffer(p) for p in params]
+            torch._foreach_mul_(mus, g['momentum'])
+
+            # if not normalization gamma/beta or bias
+            weights = [p for p in params if p.ndim > 1]
+            others = [p for p in params if p.ndim <= 1]
+            if weights:
+                # the weight decay is added to the gradients in place
+                dps = [p.grad for p in weights]
+                torch._foreach_add_(dps, weights, alpha=g['weight_decay'])
+                param_norm = torch.stack(torch._foreach_norm(weights))
+                update_norm = torch.stack(torch._foreach_norm(dps))
+                one = torch.ones_like(param_norm)
+                q = torch.where(param_norm > 0.,
+                                torch.where(update_norm > 0,
+                                (g['trust_coefficient'] * param_norm / update_norm), one),
+                                one)
+                # mu += q * dp, with the trust ratio of each tensor
+                torch._foreach_addcmul_([self.state[p]['mu'] for p in weights], dps, q.unbind(0))
+            if others:
+                torch._foreach_add_([self.state[p]['mu'] for p in others], [p.grad for p in others])
+
+            torch._foreach_add_(params, mus, alpha=-g['lr'])
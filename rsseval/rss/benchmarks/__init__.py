@@ -0,0 +1,33 @@
+# Package which contains the micro- and macro-benchmarks of the hot paths
+#
+# Every benchmark is a function registered with `benchmark`, which builds its
+# synthetic inputs (fixed seed, CPU, no dataset download) and returns the
+# callable to time. Benchmarks whose dependencies are missing are skipped.
+# Usage, from the rss folder:
+#
+#   python -m benchmarks run --out baseline.json
+#   python -m benchmarks run --out new.json
+#   python -m benchmarks compare baseline.json new.json
+from collections import OrderedDict
+
+# name -> (setup function, group)
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name: str, group="micro"):
+    """Registers a benchmark. The decorated function builds the inputs and
+    returns a callable without arguments, which is the timed code
+
+    Args:
+        name (str): benchmark name
+        group (str, default="micro"): "micro" or "macro"
+
+    Returns:
+        decorator: registration decorator
+    """
+
+    def register(setup):
+        BENCHMARKS[name] = (setup, group)
+        return setup
+
+    return register
@@ -0,0 +1,158 @@
+# Command line of the benchmarks, run from the rss folder:
+#
+#   python -m benchmarks run [--out results.json] [--filter kanddpl] [--group micro]
+#   python -m benchmarks compare baseline.json results.json [--threshold 0.2]
+#
+# `compare` exits with status 1 when a benchmark is slower than the baseline by
+# more than the threshold, so that it can be used as a check.
+import os
+import sys
+import json
+import platform
+import argparse
+import datetime
+import traceback
+
+import torch
+
+from benchmarks import BENCHMARKS
+from benchmarks import cases  # noqa: F401, registers the benchmarks
+from benchmarks.timer import seed_everything, measure, compare
+
+
+def parse_args():
+    """Parse command line arguments
+
+    Returns:
+        args: parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of the rsseval hot paths", allow_abbrev=False
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="Run the benchmarks")
+    run.add_argument("--out", type=str, default=None, help="Output json file")
+    run.add_argument(
+        "--filter", type=str, default=None, help="Run the benchmarks containing this string"
+    )
+    run.add_argument(
+        "--group", type=str, default=None, choices=["micro", "macro"], help="Benchmark group"
+    )
+    run.add_argument("--repeat", type=int, default=10, help="Timed samples per benchmark")
+    run.add_argument("--warmup", type=int, default=2, help="Untimed calls per benchmark")
+    run.add_argument("--seed", type=int, default=0, help="Seed of the synthetic inputs")
+    run.add_argument("--threads", type=int, default=1, help="Torch CPU threads")
+
+    cmp = subparsers.add_parser("compare", help="Compare two benchmark runs")
+    cmp.add_argument("baseline", type=str, help="Reference json file")
+    cmp.add_argument("current", type=str, help="New json file")
+    cmp.add_argument(
+        "--threshold", type=float, default=0.2, help="Relative slowdown flagged as a regression"
+    )
+    return parser.parse_args()
+
+
+def run(args) -> int:
+    """Runs the selected benchmarks and writes the results
+
+    Args:
+        args: command line arguments
+
+    Returns:
+        status (int): exit status
+    """
+    # fixed number of threads, for comparable timings across machines and runs
+    torch.set_num_threads(args.threads)
+
+    results = {}
+    for name, (setup, group) in BENCHMARKS.items():
+        if args.filter is not None and args.filter not in name:
+            continue
+        if args.group is not None and group != args.group:
+            continue
+
+        seed_everything(args.seed)
+        try:
+            fn = setup()
+            min_time = 0.0 if group == "macro" else 0.05
+            stats = measure(fn, args.repeat, args.warmup, min_time)
+        except ImportError as e:
+            print(f"{name:<45} skipped ({e})")
+            results[name] = {"group": group, "skipped": str(e)}
+            continue
+        except Exception as e:
+            traceback.print_exc()
+            print(f"{name:<45} failed ({e})")
+            results[name] = {"group": group, "failed": str(e)}
+            continue
+
+        stats["group"] = group
+        results[name] = stats
+        print(
+            f"{name:<45} {1e3 * stats['median']:>10.3f} ms",
+            f"(min {1e3 * stats['min']:.3f}, std {1e3 * stats['std']:.3f}, {stats['repeat']}x{stats['number']})",
+        )
+
+    if args.out is not None:
+        if os.path.dirname(args.out):
+            os.makedirs(os.path.dirname(args.out), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(
+                {
+                    "meta": {
+                        "date": datetime.datetime.now().isoformat(),
+                        "python": platform.python_version(),
+                        "torch": torch.__version__,
+                        "machine": platform.machine(),
+                        "processor": platform.processor(),
+                        "threads": args.threads,
+                        "seed": args.seed,
+                    },
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"Results written to {args.out}")
+
+    return 1 if any("failed" in r for r in results.values()) else 0
+
+
+def compare_runs(args) -> int:
+    """Prints the comparison of two runs
+
+    Args:
+        args: command line arguments
+
+    Returns:
+        status (int): 1 if there are regressions, 0 otherwise
+    """
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    if baseline["meta"].get("torch") != current["meta"].get("torch"):
+        print(
+            f"Warning: different torch versions ({baseline['meta'].get('torch')}",
+            f"vs {current['meta'].get('torch')})",
+        )
+
+    rows, regressions = compare(baseline["results"], current["results"], args.threshold)
+    print(f"{'benchmark':<45} {'baseline [ms]':>14} {'current [ms]':>14} {'ratio':>7}")
+    for name, old, new, ratio, status in rows:
+        print(f"{name:<45} {1e3 * old:>14.3f} {1e3 * new:>14.3f} {ratio:>7.2f} {status}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}:", ", ".join(regressions))
+        return 1
+    print(f"\nNo regressions above {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "run":
+        sys.exit(run(args))
+    sys.exit(compare_runs(args))
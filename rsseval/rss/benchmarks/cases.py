@@ -0,0 +1,451 @@
+# Module which contains the benchmarks of the hot paths
+#
+# Each setup builds synthetic inputs on CPU and imports the code under test
+# lazily, so that a missing optional dependency only skips its benchmarks.
+import os
+import ast
+import tempfile
+from argparse import Namespace
+
+import numpy as np
+import torch
+
+from benchmarks import benchmark
+
+DEVICE = torch.device("cpu")
+BATCH_SIZE = 256
+
+
+def random_probs(*shape):
+    """Random distributions over the last dimension
+
+    Args:
+        shape: shape of the tensor
+
+    Returns:
+        probs (torch.tensor): probabilities summing to one over the last dimension
+    """
+    return torch.softmax(torch.randn(*shape), dim=-1)
+
+
+def kand_args(**kwargs):
+    """Command line arguments of a KandDPL run on Kandinsky patterns
+
+    Args:
+        kwargs: overridden arguments
+
+    Returns:
+        args (Namespace): arguments
+    """
+    args = Namespace(
+        dataset="kandinsky",
+        model="kanddpl",
+        task="patterns",
+        entropy=False,
+        c_sup=0,
+        w_h=1.0,
+        w_c=1.0,
+        gamma=1.0,
+        lr=1e-3,
+        batch_size=32,
+    )
+    vars(args).update(kwargs)
+    return args
+
+
+class TinyKandEncoder(torch.nn.Module):
+    """Small convolutional encoder with the output of the Kandinsky encoders:
+    3 shape and 3 color logits for each of the 3 objects of a figure"""
+
+    def __init__(self, n_concepts=18):
+        super().__init__()
+        self.net = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 8, 5, stride=4),
+            torch.nn.ReLU(),
+            torch.nn.AdaptiveAvgPool2d(4),
+            torch.nn.Flatten(),
+            torch.nn.Linear(8 * 16, n_concepts),
+        )
+
+    def forward(self, x):
+        return self.net(x), None
+
+
+def make_kanddpl(args):
+    """KandDPL with a tiny encoder, on CPU
+
+    Args:
+        args: command line arguments
+
+    Returns:
+        model (KandDPL): model
+    """
+    from models.kanddpl import KandDPL
+
+    model = KandDPL(TinyKandEncoder(), n_images=3, args=args)
+    model.device = DEVICE
+    model.to(DEVICE)
+    return model
+
+
+# --- micro-benchmarks ------------------------------------------------------
+
+
+@benchmark("outer_product/kand_worlds")
+def bench_outer_product_worlds():
+    from models.utils.ops import outer_product
+
+    # 6 concepts with 3 values each -> 3^6 worlds
+    tensors = torch.split(random_probs(BATCH_SIZE * 3, 6, 3).flatten(1), 3, dim=-1)
+    return lambda: outer_product(*tensors)
+
+
+@benchmark("outer_product/kand_figures")
+def bench_outer_product_figures():
+    from models.utils.ops import outer_product
+
+    # 3 figures with 9 predicates each -> 9^3 worlds
+    tensors = [random_probs(BATCH_SIZE, 9) for _ in range(3)]
+    return lambda: outer_product(*tensors)
+
+
+@benchmark("kanddpl/problog_inference")
+def bench_kanddpl_problog_inference():
+    model = make_kanddpl(kand_args())
+    pCs = random_probs(BATCH_SIZE * 3, 6, 3).flatten(1)
+    return torch.no_grad()(lambda: model.problog_inference(pCs))
+
+
+@benchmark("kanddpl/combine_queries")
+def bench_kanddpl_combine_queries():
+    model = make_kanddpl(kand_args())
+    preds = [random_probs(BATCH_SIZE, 9) for _ in range(3)]
+    return torch.no_grad()(lambda: model.combine_queries(preds))
+
+
+@benchmark("sddoiadpl/problog_inference")
+def bench_sddoiadpl_problog_inference():
+    from models.sddoiadpl import SDDOIADPL
+
+    args = Namespace(task="boia", boia_ood_knowledge=False)
+    model = SDDOIADPL(torch.nn.Identity(), n_facts=21, args=args)
+    model.device = DEVICE
+    model.to(DEVICE)
+
+    concepts = torch.rand(BATCH_SIZE, 21, 1)
+    pCs = model.normalize_concepts(concepts)
+    return torch.no_grad()(lambda: model.problog_inference(pCs))
+
+
+@benchmark("kandltn/sat_agg_loss")
+def bench_kandltn_sat_agg():
+    import ltn
+    from utils.kand_ltn_loss import KAND_SAT_AGG
+
+    _and = ltn.fuzzy_ops.AndProd()
+    _implies = ltn.fuzzy_ops.ImpliesReichenbach()
+    loss = KAND_SAT_AGG(
+        ltn.Connective(_and),
+        ltn.Connective(ltn.fuzzy_ops.OrProbSum()),
+        ltn.Connective(ltn.fuzzy_ops.NotStandard()),
+        ltn.Quantifier(ltn.fuzzy_ops.AggregPMeanError(p=2), quantifier="f"),
+        ltn.Connective(ltn.fuzzy_ops.Equiv(and_op=_and, implies_op=_implies)),
+    )
+    out_dict = {
+        "pCS": torch.cat([random_probs(BATCH_SIZE, 3, 3, 3)] * 2, dim=-1),
+        "LABELS": torch.randint(0, 2, (BATCH_SIZE, 4)),
+    }
+    args = kand_args(c_sup_ltn=0)
+    return torch.no_grad()(lambda: loss(out_dict, args))
+
+
+@benchmark("build_worlds_queries_matrix/addmnist")
+def bench_build_wq_addmnist():
+    from models.utils.utils_problog import build_worlds_queries_matrix
+
+    return lambda: build_worlds_queries_matrix(2, 10, "addmnist")
+
+
+@benchmark("build_worlds_queries_matrix/productmnist")
+def bench_build_wq_productmnist():
+    from models.utils.utils_problog import build_worlds_queries_matrix
+
+    return lambda: build_worlds_queries_matrix(2, 10, "productmnist")
+
+
+@benchmark("build_worlds_queries_matrix/kand_patterns")
+def bench_build_wq_kand():
+    from models.utils.utils_problog import build_worlds_queries_matrix_KAND
+
+    return lambda: build_worlds_queries_matrix_KAND(3, 6, 3, task="patterns")
+
+
+def vit_small_params(depth=12, dim=384, mlp_dim=1536):
+    """Parameters with the shapes of a ViT-small, a few hundred tensors of
+    which half are biases and normalization gammas/betas
+
+    Args:
+        depth (int, default=12): number of blocks
+        dim (int, default=384): embedding dimension
+        mlp_dim (int, default=1536): hidden dimension of the MLPs
+
+    Returns:
+        params (list): parameters with random gradients
+    """
+    shapes = [(dim, 3, 16, 16), (dim,), (1, 1, dim), (1, 197, dim)]
+    for _ in range(depth):
+        shapes += [(dim,), (dim,), (3 * dim, dim), (3 * dim,), (dim, dim), (dim,)]
+        shapes += [(dim,), (dim,), (mlp_dim, dim), (mlp_dim,), (dim, mlp_dim), (dim,)]
+    shapes += [(dim,), (dim,)]
+
+    params = [torch.nn.Parameter(torch.randn(shape) * 0.02) for shape in shapes]
+    for p in params:
+        p.grad = torch.randn_like(p) * 1e-3
+    return params
+
+
+def lars_step(foreach):
+    from backbones.moco.optimizer import LARS
+
+    params = vit_small_params()
+    optimizer = LARS(params, lr=1e-3, weight_decay=1e-6, foreach=foreach)
+    grads = [p.grad for p in params]
+    saved = [g.clone() for g in grads]
+
+    def step():
+        # fresh gradients, the foreach step consumes them
+        torch._foreach_copy_(grads, saved)
+        optimizer.step()
+
+    return step
+
+
+@benchmark("moco/lars_step_loop")
+def bench_lars_step_loop():
+    return lars_step(foreach=False)
+
+
+@benchmark("moco/lars_step_foreach")
+def bench_lars_step_foreach():
+    return lars_step(foreach=True)
+
+
+class ParamBank(torch.nn.Module):
+    """Module holding the ViT-small-like parameters, as a MoCo encoder"""
+
+    def __init__(self, num_classes=None):
+        super().__init__()
+        self.params = torch.nn.ParameterList(vit_small_params())
+
+
+@benchmark("moco/momentum_update_loop")
+def bench_momentum_update_loop():
+    from backbones.moco.builder import MoCo
+
+    model = MoCo(ParamBank)
+    params = list(zip(model.base_encoder.parameters(), model.momentum_encoder.parameters()))
+
+    @torch.no_grad()
+    def update(m=0.99):
+        # the per-parameter update replaced by the multi-tensor one
+        for param_b, param_m in params:
+            param_m.data = param_m.data * m + param_b.data * (1. - m)
+
+    return update
+
+
+@benchmark("moco/momentum_update_foreach")
+def bench_momentum_update_foreach():
+    from backbones.moco.builder import MoCo
+
+    model = MoCo(ParamBank)
+    return lambda: model._update_momentum_encoder(0.99)
+
+
+def load_evaluate_functions():
+    """Loads the metric functions of evaluate.py, which is an exported notebook
+    that runs the whole evaluation at import time: only the class and function
+    definitions are executed
+
+    Returns:
+        namespace (dict): namespace with the definitions of evaluate.py
+    """
+    from sklearn.metrics import accuracy_score, f1_score, confusion_matrix
+    from utils.train import convert_to_categories, compute_coverage
+
+    path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "evaluate.py")
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+
+    wanted = {
+        "Metrics",
+        "BOIAMetrics",
+        "KandMetrics",
+        "compute_concept_collapse",
+        "compute_metrics",
+    }
+    tree.body = [
+        node
+        for node in tree.body
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)) and node.name in wanted
+    ]
+
+    namespace = {
+        "torch": torch,
+        "np": np,
+        "accuracy_score": accuracy_score,
+        "f1_score": f1_score,
+        "confusion_matrix": confusion_matrix,
+        "convert_to_categories": convert_to_categories,
+        "compute_coverage": compute_coverage,
+    }
+    exec(compile(tree, path, "exec"), namespace)
+    return namespace
+
+
+@benchmark("evaluate/compute_metrics")
+def bench_compute_metrics():
+    compute_metrics = load_evaluate_functions()["compute_metrics"]
+
+    # single-label digits, the path without plots
+    n = 10000
+    true_labels = np.random.randint(0, 19, n)
+    predicted_labels = np.where(
+        np.random.rand(n) < 0.8, true_labels, np.random.randint(0, 19, n)
+    )
+    true_concepts = np.random.randint(0, 10, n)
+    predicted_concepts = np.where(
+        np.random.rand(n) < 0.8, true_concepts, np.random.randint(0, 10, n)
+    )
+    return lambda: compute_metrics(
+        true_labels,
+        predicted_labels,
+        true_concepts,
+        predicted_concepts,
+        0.5,
+        "mnist",
+        "mnistdpl",
+        0,
+    )
+
+
+# --- macro-benchmarks ------------------------------------------------------
+
+
+def write_kand_split(root, split="train", n=128, size=64):
+    """Writes a synthetic Kandinsky split: 3 figures side by side per image,
+    with the meta files of the generator
+
+    Args:
+        root (str): dataset folder
+        split (str, default="train"): split name
+        n (int, default=128): number of images
+        size (int, default=64): size of a figure
+
+    Returns:
+        None: This function does not return a value.
+    """
+    import joblib
+    from PIL import Image
+
+    os.makedirs(os.path.join(root, split, "images"), exist_ok=True)
+    os.makedirs(os.path.join(root, split, "meta"), exist_ok=True)
+    for i in range(n):
+        pixels = np.random.randint(0, 256, (size, 3 * size, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(
+            os.path.join(root, split, "images", f"{i:05d}.png")
+        )
+
+        meta = {"y": np.random.randint(0, 2)}
+        for j in range(3):
+            meta[f"fig{j}"] = {
+                "c": np.random.randint(0, 3, (2, 3)),
+                "y": np.random.randint(0, 3, 2),
+            }
+        joblib.dump(meta, os.path.join(root, split, "meta", f"{i:05d}.joblib"))
+
+
+@benchmark("kand_dataset/load", group="macro")
+def bench_kand_dataset_load():
+    from datasets.utils.kand_creation import KAND_Dataset
+
+    tmp = tempfile.TemporaryDirectory()
+    write_kand_split(tmp.name)
+
+    def load():
+        # the closure keeps the temporary folder alive
+        return KAND_Dataset(tmp.name, "train"), tmp
+
+    return load
+
+
+@benchmark("kand_dataset/iterate", group="macro")
+def bench_kand_dataset_iterate():
+    from datasets.utils.kand_creation import KAND_Dataset
+
+    tmp = tempfile.TemporaryDirectory()
+    write_kand_split(tmp.name)
+    dataset = KAND_Dataset(tmp.name, "train")
+    loader = torch.utils.data.DataLoader(dataset, batch_size=32, shuffle=False)
+
+    def iterate():
+        for _ in loader:
+            pass
+        return tmp
+
+    return iterate
+
+
+@benchmark("kand_dataset/iterate_device", group="macro")
+def bench_kand_dataset_iterate_device():
+    from datasets.utils.kand_creation import KAND_Dataset
+    from datasets.utils.base_dataset import DeviceLoader
+
+    tmp = tempfile.TemporaryDirectory()
+    write_kand_split(tmp.name)
+    loader = DeviceLoader(
+        KAND_Dataset(tmp.name, "train"), batch_size=32, device=DEVICE, shuffle=True
+    )
+
+    def iterate():
+        for _ in loader:
+            pass
+        return tmp
+
+    return iterate
+
+
+@benchmark("train/kanddpl_epoch", group="macro")
+def bench_train_epoch():
+    from models.kanddpl import KandDPL
+    from utils.precision import forward_step
+
+    args = kand_args()
+    model = make_kanddpl(args)
+    model.start_optim(args)
+    _loss = KandDPL.get_loss(args)
+
+    # 256 Kandinsky-like samples: 3 figures of 64x64 side by side
+    n = 256
+    images = torch.rand(n, 3, 64, 3 * 64)
+    labels = torch.cat(
+        [torch.randint(0, 9, (n, 3)), torch.randint(0, 2, (n, 1))], dim=1
+    )
+    concepts = torch.randint(0, 3, (n, 3, 6))
+    loader = torch.utils.data.DataLoader(
+        torch.utils.data.TensorDataset(images, labels, concepts),
+        batch_size=args.batch_size,
+        shuffle=True,
+    )
+
+    def epoch():
+        model.train()
+        for images, labels, concepts in loader:
+            model.opt.zero_grad(set_to_none=True)
+            loss, _, _ = forward_step(
+                model, _loss, images, labels, concepts, args, None
+            )
+            loss.backward()
+            model.opt.step()
+
+    return epoch
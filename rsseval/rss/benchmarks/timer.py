@@ -0,0 +1,104 @@
+# Module which contains the timing and the comparison of the benchmarks
+import gc
+import time
+import random
+import statistics
+
+import numpy as np
+import torch
+
+
+def seed_everything(seed: int) -> None:
+    """Fixes the seeds of python, numpy and torch
+
+    Args:
+        seed (int): seed
+
+    Returns:
+        None: This function does not return a value.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def measure(fn, repeat=10, warmup=2, min_time=0.05):
+    """Times a callable. Each sample runs fn as many times as needed to last at
+    least `min_time` seconds, so that fast functions are not dominated by the
+    timer resolution
+
+    Args:
+        fn: callable without arguments
+        repeat (int, default=10): number of samples
+        warmup (int, default=2): untimed calls before the samples
+        min_time (float, default=0.05): minimum duration of a sample in seconds
+
+    Returns:
+        stats (dict): median, mean, min and standard deviation of the time per call
+            in seconds, number of samples and calls per sample
+    """
+    for _ in range(warmup):
+        fn()
+
+    # calibrate the number of calls per sample
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            samples.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return {
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "min": min(samples),
+        "std": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "repeat": repeat,
+        "number": number,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold=0.2):
+    """Compares the median times of two benchmark runs
+
+    Args:
+        baseline (dict): results of the reference run
+        current (dict): results of the new run
+        threshold (float, default=0.2): relative slowdown flagged as a regression
+
+    Returns:
+        rows (list): (name, baseline median, current median, ratio, status) of
+            the benchmarks in both runs
+        regressions (list): names of the regressed benchmarks
+    """
+    rows, regressions = [], []
+    for name, ref in baseline.items():
+        if name not in current or "median" not in ref or "median" not in current[name]:
+            continue
+        old, new = ref["median"], current[name]["median"]
+        ratio = new / old if old > 0 else float("inf")
+        if ratio > 1 + threshold:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 / (1 + threshold):
+            status = "faster"
+        else:
+            status = "ok"
+        rows.append((name, old, new, ratio, status))
+    return rows, regressions
@@ -66,13 +66,20 @@ class Kandinsky(BaseDataset):
                 self.dataset_test, self.args.batch_size, val_test=True
             )
         else:
-            train_loader = KAND_get_loader(self.dataset_train, 1, val_test=False)
-            val_loader = KAND_get_loader(self.dataset_val, 1, val_test=True)
-            test_loader = KAND_get_loader(self.dataset_test, 1, val_test=True)
+            # batched export, samples are written back by image id
+            train_loader = KAND_get_loader(
+                self.dataset_train, self.args.batch_size, val_test=True
+            )
+            val_loader = KAND_get_loader(
+                self.dataset_val, self.args.batch_size, val_test=True
+            )
+            test_loader = KAND_get_loader(
+                self.dataset_test, self.args.batch_size, val_test=True
+            )
 
         # self.ood_loader = get_loader(dataset_ood,  self.args.batch_size, val_test=True)
 
-        return train_loader, val_loader, test_loader
+        return self.to_device_loaders(train_loader, val_loader, test_loader)
 
     def get_backbone_old(self, args=None):
         print("kand says", self.args, args)
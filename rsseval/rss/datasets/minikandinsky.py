@@ -54,7 +54,7 @@ class MiniKandinsky(BaseDataset):
             val_loader = KAND_get_loader(self.dataset_val, 1, val_test=True)
             test_loader = KAND_get_loader(self.dataset_test, 1, val_test=True)
 
-        return train_loader, val_loader, test_loader
+        return self.to_device_loaders(train_loader, val_loader, test_loader)
 
     def give_full_supervision(self):
         if not hasattr(self, "dataset_train"):
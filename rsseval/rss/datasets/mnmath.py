@@ -59,6 +59,14 @@ class MNMATH(BaseDataset):
         self.ood_loader = MNMATH_get_loader(
             self.dataset_ood, self.args.batch_size, val_test=True
         )
+        (
+            self.train_loader,
+            self.val_loader,
+            self.test_loader,
+            self.ood_loader,
+        ) = self.to_device_loaders(
+            self.train_loader, self.val_loader, self.test_loader, self.ood_loader
+        )
 
         return self.train_loader, self.val_loader, self.test_loader
 
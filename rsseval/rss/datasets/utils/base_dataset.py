@@ -7,7 +7,10 @@ from typing import Tuple, List
 from torchvision import datasets
 import numpy as np
 import torch.optim
-from torch.utils.data import WeightedRandomSampler
+from torch.utils.data import WeightedRandomSampler, RandomSampler
+from torch.utils.data.distributed import DistributedSampler
+from utils.conf import get_device
+from utils.distributed import distributed_sampler
 
 
 class BaseDataset:
@@ -53,10 +56,171 @@ class BaseDataset:
         """
         pass
 
+    def to_device_loaders(self, *loaders):
+        """
+        With --device_dataset, replaces the DataLoaders of the splits with
+        DeviceLoaders on the model device, keeping their batch size, shuffling
+        and drop_last. The preprocessing mode keeps the DataLoaders.
+        :param loaders: DataLoaders of the splits
+        :return: the loaders, in the same order
+        """
+        if not getattr(self.args, "device_dataset", False) or getattr(
+            self.args, "preprocess", False
+        ):
+            return loaders
+
+        device = get_device()
+        return tuple(
+            DeviceLoader(
+                loader.dataset,
+                loader.batch_size,
+                device,
+                shuffle=isinstance(loader.sampler, RandomSampler)
+                or (
+                    isinstance(loader.sampler, DistributedSampler)
+                    and loader.sampler.shuffle
+                ),
+                drop_last=loader.drop_last,
+                # the training loaders have a DistributedSampler, shuffled or not
+                train=isinstance(loader.sampler, DistributedSampler),
+            )
+            for loader in loaders
+        )
+
+
+class DeviceLoader:
+    """
+    Loader over a split that is entirely resident on a device. The split is
+    decoded once, the images are stored as uint8 and every epoch draws a
+    permutation of the indices on the device: a batch is a gather fused with
+    the uint8 -> float conversion, with no worker, collate or host-to-device copy.
+    In distributed mode every rank iterates over its own shard of the indices:
+    the shards of the training loaders are padded to the same length, so that
+    all the ranks run the same number of steps.
+    """
+
+    def __init__(
+        self,
+        dataset,
+        batch_size,
+        device,
+        shuffle=False,
+        drop_last=False,
+        decode_batch_size=256,
+        train=None,
+    ) -> None:
+        """
+        :param dataset: dataset returning (image, labels, concepts), images in [0, 1]
+        :param batch_size: batch size
+        :param device: device of the split
+        :param shuffle: whether to shuffle at every epoch
+        :param drop_last: whether to drop the last incomplete batch
+        :param decode_batch_size: batch size of the one-time decoding
+        :param train: training loader (padded shards), by default the shuffled ones
+        """
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.device = torch.device(device)
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+        composed = getattr(dataset, "composed_split", lambda: None)()
+        if composed is not None:
+            # index-only composite split (see virtual_mnist.py): only the indices
+            # of the digits and the shared MNIST go on the device, a batch is
+            # composed when it is drawn
+            images, labels, concepts = composed
+            self.images = images.to(self.device)
+            self.is_uint8 = True
+            self.labels = torch.as_tensor(np.asarray(labels)).to(self.device)
+            self.concepts = torch.as_tensor(np.asarray(concepts)).to(self.device)
+        else:
+            self._decode(dataset, decode_batch_size)
+
+        self.sampler = distributed_sampler(
+            range(self.labels.size(0)), shuffle, drop_last, train=train
+        )
+
+    def _decode(self, dataset, decode_batch_size):
+        images, labels, concepts = [], [], []
+        for x, y, c in DataLoader(dataset, batch_size=decode_batch_size, shuffle=False):
+            images.append(x)
+            labels.append(y)
+            concepts.append(c)
+        images = torch.cat(images)
+
+        # ToTensor images are multiples of 1/255: stored as uint8 they take a
+        # quarter of the memory. Other transforms keep the float images
+        quantized = images.mul(255).round_()
+        self.is_uint8 = bool(torch.allclose(quantized, images.mul(255), atol=1e-3))
+        if self.is_uint8:
+            images = quantized.to(torch.uint8)
+
+        self.images = images.to(self.device)
+        self.labels = torch.cat(labels).to(self.device)
+        self.concepts = torch.cat(concepts).to(self.device)
+
+    def _num_samples(self) -> int:
+        if self.sampler is not None:
+            return len(self.sampler)
+        return self.labels.size(0)
+
+    def __len__(self) -> int:
+        n = self._num_samples()
+        if self.drop_last:
+            return n // self.batch_size
+        return (n + self.batch_size - 1) // self.batch_size
+
+    def _images(self, index):
+        images = self.images[index]
+        if self.is_uint8:
+            images = images.float().div_(255)
+        return images
+
+    def __iter__(self):
+        n = self._num_samples()
+        order = None
+        if self.sampler is not None:
+            # the epoch of the DistributedSampler is set by the training loop
+            order = torch.as_tensor(list(self.sampler), device=self.device)
+        elif self.shuffle:
+            order = torch.randperm(n, device=self.device)
+        for b in range(len(self)):
+            start, end = b * self.batch_size, min((b + 1) * self.batch_size, n)
+            if order is not None:
+                index = order[start:end]
+            else:
+                index = slice(start, end)
+            yield self._images(index), self.labels[index], self.concepts[index]
+
+
+def sharded_loader(dataset, batch_size, shuffle, drop_last=False, num_workers=0):
+    """
+    DataLoader over the shard of the dataset of this rank in distributed mode
+    (see utils/distributed.py), over the whole dataset otherwise.
+    :param dataset: dataset
+    :param batch_size: batch size
+    :param shuffle: whether to shuffle at every epoch
+    :param drop_last: whether to drop the last incomplete batch
+    :param num_workers: number of workers
+    :return: the loader
+    """
+    sampler = distributed_sampler(dataset, shuffle, drop_last)
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle and sampler is None,
+        sampler=sampler,
+        drop_last=drop_last,
+        num_workers=num_workers,
+    )
+
 
 def get_loader(dataset, batch_size, num_workers=4, val_test=False, sampler=None):
 
     if val_test:
+        if sampler is None:
+            return sharded_loader(dataset, batch_size, False, num_workers=num_workers)
         return torch.utils.data.DataLoader(
             dataset,
             shuffle=False,
@@ -90,6 +254,10 @@ def get_loader(dataset, batch_size, num_workers=4, val_test=False, sampler=None)
             sampler = WeightedRandomSampler(
                 samples_weight.type("torch.DoubleTensor"), len(samples_weight)
             )
+        else:
+            # unshuffled as before, sharded in distributed mode by a padded
+            # DistributedSampler: all the ranks run the same number of steps
+            sampler = distributed_sampler(dataset, False, train=True)
 
         return DataLoader(
             dataset, batch_size=batch_size, num_workers=num_workers, sampler=sampler
@@ -99,32 +267,19 @@ def get_loader(dataset, batch_size, num_workers=4, val_test=False, sampler=None)
 def KAND_get_loader(dataset, batch_size, val_test=False, preprocess=False):
 
     if val_test:
-        return DataLoader(
-            dataset,
-            shuffle=False,
-            batch_size=batch_size,
-            drop_last=False,
-            num_workers=0,
-        )
+        return sharded_loader(dataset, batch_size, shuffle=False, num_workers=0)
     else:
-        return DataLoader(dataset, shuffle=True, batch_size=batch_size, num_workers=0)
+        return sharded_loader(dataset, batch_size, shuffle=True, num_workers=0)
 
 
 def SDDOIA_get_loader(dataset, batch_size, num_workers=4, val_test=False):
     if val_test:
-        return DataLoader(
-            dataset,
-            shuffle=False,
-            batch_size=batch_size,
-            num_workers=num_workers,
-            drop_last=False,
+        return sharded_loader(
+            dataset, batch_size, shuffle=False, num_workers=num_workers
         )
     else:
-        return DataLoader(
-            dataset,
-            shuffle=True,
-            batch_size=batch_size,
-            num_workers=num_workers,
+        return sharded_loader(
+            dataset, batch_size, shuffle=True, num_workers=num_workers
         )
 
 
@@ -136,8 +291,8 @@ def BOIA_get_loader(dataset, batch_size, val_test):
         drop_last = True
         shuffle = True
 
-    return DataLoader(
-        dataset, batch_size=batch_size, shuffle=shuffle, drop_last=drop_last
+    return sharded_loader(
+        dataset, batch_size, shuffle=shuffle, drop_last=drop_last
     )
 
 
@@ -149,8 +304,8 @@ def CLEVR_get_loader(dataset, batch_size, val_test):
         drop_last = True
         shuffle = True
 
-    return DataLoader(
-        dataset, batch_size=batch_size, shuffle=shuffle, drop_last=drop_last
+    return sharded_loader(
+        dataset, batch_size, shuffle=shuffle, drop_last=drop_last
     )
 
 
@@ -162,8 +317,8 @@ def XOR_get_loader(dataset, batch_size, val_test):
         drop_last = True
         shuffle = True
 
-    return DataLoader(
-        dataset, batch_size=batch_size, shuffle=shuffle, drop_last=drop_last
+    return sharded_loader(
+        dataset, batch_size, shuffle=shuffle, drop_last=drop_last
     )
 
 def MNMATH_get_loader(dataset, batch_size, val_test):
@@ -174,6 +329,6 @@ def MNMATH_get_loader(dataset, batch_size, val_test):
         drop_last = True
         shuffle = True
 
-    return DataLoader(
-        dataset, batch_size=batch_size, shuffle=shuffle, drop_last=drop_last
+    return sharded_loader(
+        dataset, batch_size, shuffle=shuffle, drop_last=drop_last
     )
\ No newline at end of file
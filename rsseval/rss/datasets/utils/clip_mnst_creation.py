@@ -10,6 +10,7 @@ from torch.utils.data import Dataset
 from torchvision import datasets
 from tqdm import tqdm
 import copy, itertools
+from datasets.utils.mnist_creation import check_dataset, split_paths
 
 
 def get_label(c1, c2, labels, args):
@@ -66,7 +67,8 @@ class CLIPnMNIST(Dataset):
 
         self.base_path = "data"
 
-        self.data, self.labels = self.read_data(path=data_path, split=split)
+        # the images are replaced by their CLIP embeddings, only the labels are read
+        self.labels = self.read_labels(path=data_path, split=split)
         self.transform = transforms.Compose(
             [
                 transforms.ToPILImage(),
@@ -147,21 +149,13 @@ class CLIPnMNIST(Dataset):
 
         return newimage, label, concepts
 
-    def read_data(self, path, split):
+    def read_labels(self, path, split):
         """
-        Returns images and labels
+        Returns the labels of the split, from the splits shared with nMNIST
+        (see mnist_creation.py)
         """
-        try:
-            # print("Loading data...")
-            data = load(path)
-            # print("Loaded.")
-        except:
-            print("No dataset found.")
-
-        images = data[split]["images"]
-        labels = data[split]["labels"]
-
-        return images, labels
+        _, labels_path = split_paths(path, split)
+        return np.load(labels_path)
 
     def reset_counter(self):
         self.world_counter = {
@@ -257,106 +251,6 @@ class CLIPnMNIST(Dataset):
 #     # def __copy__():
 
 
-def create_sample(X, target_sequence, digit2idx):
-    idxs = [choice(digit2idx[digit][0]) for digit in target_sequence]
-    imgs = [X[idx] for idx in idxs]
-    new_image = np.concatenate(imgs, axis=1)
-    new_label = target_sequence + (np.sum(target_sequence),)
-
-    return new_image, np.array(new_label).astype("int32"), idxs
-
-
-def create_dataset(
-    n_digit=2, sequence_len=2, samples_x_world=100, train=True, download=False
-):
-    # Download data
-    MNIST = datasets.MNIST(root="./data/raw/", train=train, download=download)
-
-    x, y = MNIST.data, MNIST.targets
-
-    # Create dictionary of indexes for each digit
-    digit2idx = {k: [] for k in range(10)}
-    for k, v in digit2idx.items():
-        v.append(np.where(y == k)[0])
-
-    # Create the list of all possible permutations with repetition of 'sequence_len' digits
-    worlds = list(product(range(n_digit), repeat=sequence_len))
-    imgs = []
-    labels = []
-
-    # Create data sample for each class
-    for c in tqdm(worlds):
-        for i in range(samples_x_world):
-            img, label, idxs = create_sample(x, c, digit2idx)
-            imgs.append(img)
-            labels.append(label)
-
-    # Create dictionary of indexes for each world
-    label2idx = {c: set() for c in worlds}
-    for k, v in tqdm(label2idx.items()):
-        for i, label in enumerate(labels):
-            if tuple(label[:2]) == k:
-                v.add(i)
-    label2idx = {k: torch.tensor(list(v)) for k, v in label2idx.items()}
-
-    return np.array(imgs).astype("int32"), np.array(labels), label2idx
-
-
-def check_dataset(n_digits, data_folder, data_file, dataset_dim):
-    """Checks whether the dataset exists, if not creates it."""
-    Path(data_folder).mkdir(parents=True, exist_ok=True)
-    data_path = os.path.join(data_folder, data_file)
-    try:
-        load(data_path)
-    except:
-        print("No dataset found.")
-        # Define dataset dimension so to have teh same number of worlds
-        n_worlds = n_digits * n_digits
-        samples_x_world = {k: int(d / n_worlds) for k, d in dataset_dim.items()}
-        dataset_dim = {k: s * n_worlds for k, s in samples_x_world.items()}
-
-        train_imgs, train_labels, train_indexes = create_dataset(
-            n_digit=n_digits,
-            sequence_len=2,
-            samples_x_world=samples_x_world["train"],
-            train=True,
-            download=True,
-        )
-
-        val_imgs, val_labels, val_indexes = create_dataset(
-            n_digit=n_digits,
-            sequence_len=2,
-            samples_x_world=samples_x_world["val"],
-            train=True,
-            download=True,
-        )
-        test_imgs, test_labels, test_indexes = create_dataset(
-            n_digit=n_digits,
-            sequence_len=2,
-            samples_x_world=samples_x_world["test"],
-            train=False,
-            download=True,
-        )
-
-        print(
-            f"Dataset dimensions: \n\t{dataset_dim['train']} train ({samples_x_world['train']} samples per world), \n\t{dataset_dim['val']} validation ({samples_x_world['val']} samples per world), \n\t{dataset_dim['test']} test ({samples_x_world['test']} samples per world)"
-        )
-
-        data = {
-            "train": {"images": train_imgs, "labels": train_labels},
-            "val": {"images": val_imgs, "labels": val_labels},
-            "test": {"images": test_imgs, "labels": test_labels},
-        }
-
-        indexes = {"train": train_indexes, "val": val_indexes, "test": test_indexes}
-
-        torch.save(data, data_path)
-        for key, value in indexes.items():
-            torch.save(value, os.path.join(data_folder, f"{key}_indexes.pt"))
-
-        print(f"Dataset saved in {data_folder}")
-
-
 def load_2MNIST(
     n_digits=10,
     dataset_dimensions={"train": 42000, "val": 12000, "test": 6000},
@@ -372,7 +266,8 @@ def load_2MNIST(
     data_folder = os.path.join(data_folder, f"2mnist_{n_digits}digits")
     data_file = f"2mnist_{n_digits}digits.pt"
 
-    # Check whether dataset exists, if not build it
+    # Check whether dataset exists, if not build it: the same splits as nMNIST,
+    # a former .pt dataset is converted
     check_dataset(n_digits, data_folder, data_file, dataset_dimensions)
     train_set, val_set, test_set = load_data(
         data_file=data_file,
@@ -393,10 +288,9 @@ def generate_r_seq(size):
 def load_data(data_file, data_folder, c_sup=1, which_c=[-1], args=None):
 
     # Prepare data
-    data_path = os.path.join(data_folder, data_file)
-    train_set = CLIPnMNIST("train", data_path=data_path, args=args)
-    val_set = CLIPnMNIST("val", data_path=data_path, args=args)
-    test_set = CLIPnMNIST("test", data_path=data_path, args=args)
+    train_set = CLIPnMNIST("train", data_path=data_folder, args=args)
+    val_set = CLIPnMNIST("val", data_path=data_folder, args=args)
+    test_set = CLIPnMNIST("test", data_path=data_folder, args=args)
 
     # r_seq = np.load("data/rn.npy")
     # Generate deterministic random sequence
@@ -0,0 +1,278 @@
+# Packed feature store for preprocessed embeddings (CLIP, ResNet)
+#
+# A store is a pair of files sharing the same prefix:
+#   <prefix>.npy  -> contiguous (N, D) float16/float32 array, memory-mapped on read
+#   <prefix>.json -> index with the name of each row and the store metadata
+import os
+import json
+import glob
+import numpy as np
+import torch
+
+
+STORE_SUFFIX = ".npy"
+INDEX_SUFFIX = ".json"
+
+
+def _strip_suffix(path: str) -> str:
+    """Removes the store suffixes from a path, so that both the prefix and the
+    file names can be used to refer to a store
+
+    Args:
+        path (str): store path
+
+    Returns:
+        prefix (str): store prefix
+    """
+    for suffix in (STORE_SUFFIX, INDEX_SUFFIX):
+        if path.endswith(suffix):
+            return path[: -len(suffix)]
+    return path
+
+
+def store_exists(path: str) -> bool:
+    """Whether a complete feature store exists at the given prefix
+
+    Args:
+        path (str): store prefix
+
+    Returns:
+        exists (bool): True if both the array and the index are on disk
+    """
+    prefix = _strip_suffix(path)
+    return os.path.exists(prefix + STORE_SUFFIX) and os.path.exists(
+        prefix + INDEX_SUFFIX
+    )
+
+
+class FeatureStoreWriter:
+    """Writes embeddings batch by batch into a preallocated memory-mapped array.
+
+    The array and the index are written to temporary files and moved in place
+    only by `close`, so that readers never observe a partially written store.
+    """
+
+    def __init__(self, path: str, n_items: int, dim: int, dtype="float32"):
+        """Initialize method
+
+        Args:
+            self: instance
+            path (str): store prefix
+            n_items (int): number of rows
+            dim (int): embedding dimension
+            dtype (str, default="float32"): storage dtype, float16 or float32
+
+        Returns:
+            None: This function does not return a value.
+        """
+        assert dtype in ["float16", "float32"], f"Unsupported dtype {dtype}"
+
+        self.prefix = _strip_suffix(path)
+        self.n_items = n_items
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+
+        save_dir = os.path.dirname(self.prefix)
+        if save_dir:
+            os.makedirs(save_dir, exist_ok=True)
+
+        self._tmp_array = self.prefix + STORE_SUFFIX + ".tmp"
+        self._tmp_index = self.prefix + INDEX_SUFFIX + ".tmp"
+        self.array = np.lib.format.open_memmap(
+            self._tmp_array, mode="w+", dtype=self.dtype, shape=(n_items, dim)
+        )
+        self.names = []
+        self.cursor = 0
+
+    def write(self, features, names=None) -> None:
+        """Appends a batch of embeddings
+
+        Args:
+            self: instance
+            features (torch.tensor or np.ndarray): (B, D) embeddings
+            names (list, default=None): name of each row, defaults to the row number
+
+        Returns:
+            None: This function does not return a value.
+        """
+        if isinstance(features, torch.Tensor):
+            features = features.detach().to("cpu", torch.float32).numpy()
+
+        features = features.reshape(features.shape[0], -1)
+        n = features.shape[0]
+
+        assert features.shape[1] == self.dim, f"Expected dim {self.dim}, got {features.shape[1]}"
+        assert self.cursor + n <= self.n_items, "Writing past the end of the store"
+
+        self.array[self.cursor : self.cursor + n] = features
+
+        if names is None:
+            names = [str(i) for i in range(self.cursor, self.cursor + n)]
+        assert len(names) == n, "One name per row is required"
+        self.names.extend(str(name) for name in names)
+
+        self.cursor += n
+
+    def close(self) -> str:
+        """Flushes the array and atomically publishes the store
+
+        Args:
+            self: instance
+
+        Returns:
+            prefix (str): prefix of the written store
+        """
+        assert self.cursor == self.n_items, f"Store incomplete: {self.cursor}/{self.n_items} rows"
+
+        self.array.flush()
+        del self.array
+
+        with open(self._tmp_index, "w") as f:
+            json.dump(
+                {
+                    "names": self.names,
+                    "shape": [self.n_items, self.dim],
+                    "dtype": self.dtype.name,
+                },
+                f,
+            )
+
+        os.replace(self._tmp_array, self.prefix + STORE_SUFFIX)
+        os.replace(self._tmp_index, self.prefix + INDEX_SUFFIX)
+
+        return self.prefix
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # drop the partial files, the previous store (if any) stays valid
+            del self.array
+            for tmp in (self._tmp_array, self._tmp_index):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        return False
+
+
+class FeatureStore:
+    """Read-only view over a packed feature store.
+
+    The array is memory-mapped copy-on-write, hence contiguous slices are
+    returned as tensors sharing memory with the mapping (no copies).
+    """
+
+    def __init__(self, path: str):
+        """Initialize method
+
+        Args:
+            self: instance
+            path (str): store prefix
+
+        Returns:
+            None: This function does not return a value.
+        """
+        self.prefix = _strip_suffix(path)
+
+        with open(self.prefix + INDEX_SUFFIX, "r") as f:
+            meta = json.load(f)
+
+        self.array = np.load(self.prefix + STORE_SUFFIX, mmap_mode="c")
+        self.names = meta["names"]
+        self.rows = {name: i for i, name in enumerate(self.names)}
+
+        assert list(self.array.shape) == meta["shape"], "Index and array do not match"
+
+    @property
+    def dim(self) -> int:
+        return self.array.shape[1]
+
+    def index_of(self, name) -> int:
+        """Row of a named item
+
+        Args:
+            self: instance
+            name (str): item name
+
+        Returns:
+            row (int): row in the store
+        """
+        return self.rows[str(name)]
+
+    def get(self, name) -> torch.Tensor:
+        """Embedding of a named item
+
+        Args:
+            self: instance
+            name (str): item name
+
+        Returns:
+            emb (torch.tensor): (D,) embedding
+        """
+        return torch.from_numpy(self.array[self.index_of(name)])
+
+    def __getitem__(self, item) -> torch.Tensor:
+        """Rows of the store: int and slices are zero-copy views, index arrays
+        are gathered in a single read
+
+        Args:
+            self: instance
+            item: int, slice or array of rows
+
+        Returns:
+            embs (torch.tensor): embeddings
+        """
+        if isinstance(item, torch.Tensor):
+            item = item.cpu().numpy()
+        return torch.from_numpy(np.asarray(self.array[item]))
+
+    def __len__(self) -> int:
+        return self.array.shape[0]
+
+
+def pack_feature_files(src_dir: str, path: str, dtype="float32", pattern="*.pt") -> str:
+    """Packs a folder of per-sample `.pt` embeddings into a single store, so
+    that data preprocessed with the old layout can be migrated without
+    recomputing the embeddings
+
+    Args:
+        src_dir (str): folder containing one `.pt` embedding per sample
+        path (str): store prefix
+        dtype (str, default="float32"): storage dtype
+        pattern (str, default="*.pt"): glob pattern of the files
+
+    Returns:
+        prefix (str): prefix of the written store
+    """
+    files = sorted(glob.glob(os.path.join(src_dir, pattern)))
+    assert len(files) > 0, f"No embeddings found in {src_dir}"
+
+    first = torch.load(files[0]).reshape(-1)
+    with FeatureStoreWriter(path, len(files), first.numel(), dtype) as writer:
+        for f in files:
+            name = os.path.splitext(os.path.basename(f))[0]
+            writer.write(torch.load(f).reshape(1, -1), [name])
+
+    return writer.prefix
+
+
+def pack_feature_tensor(src_path: str, path: str, dtype="float32") -> str:
+    """Packs a single `.pt` tensor of embeddings (one row per sample) into a
+    store, so that it is memory-mapped instead of loaded on every run
+
+    Args:
+        src_path (str): `.pt` file with the (N, ...) embeddings
+        path (str): store prefix
+        dtype (str, default="float32"): storage dtype
+
+    Returns:
+        prefix (str): prefix of the written store
+    """
+    embs = torch.load(src_path)
+    embs = embs.reshape(embs.shape[0], -1)
+    with FeatureStoreWriter(path, embs.shape[0], embs.shape[1], dtype) as writer:
+        writer.write(embs)
+
+    return writer.prefix
@@ -7,6 +7,12 @@ import itertools
 from PIL import Image
 
 from torchvision.datasets.folder import pil_loader
+from datasets.utils.feature_store import (
+    FeatureStore,
+    pack_feature_tensor,
+    store_exists,
+)
+from utils.distributed import barrier, is_main_process
 
 import re
 
@@ -161,6 +167,21 @@ class PreKAND_Dataset(torch.utils.data.Dataset):
 
         self.finetuning = finetuning
 
+        # packed layout written by utils.preprocess_resnet: one array per field
+        packed_path = os.path.join(self.base_path, self.split, "images.npy")
+        if os.path.exists(packed_path):
+            self.imgs = np.load(packed_path)
+            self.labels = np.load(
+                os.path.join(self.base_path, self.split, "labels.npy")
+            )
+            self.concepts = np.load(
+                os.path.join(self.base_path, self.split, "concepts.npy")
+            )
+            self.list_images = list(range(len(self.imgs)))
+            self.img_number = self.list_images
+            self.concept_mask = np.array([False] * len(self.list_images))
+            return
+
         self.list_images = glob.glob(
             os.path.join(self.base_path, self.split, "images", "*")
         )
@@ -442,17 +463,20 @@ class CLIP_KAND_Dataset(torch.utils.data.Dataset):
             "saved_activations",
             f"kandinsky_{self.split}_clip_ViT-B32.pt",
         )
-        self.embs = torch.load(IMG_PATH)
 
         TXT_PATH = os.path.join(
             self.base_path, "saved_activations", "kandinsky_filtered_ViT-B32.pt"
         )
         self.texts = torch.load(TXT_PATH)
 
-        self.imgs = self.embs  # .to('cuda') @ self.texts.T.to('cuda')
-        # self.imgs = self.embs.to('cuda') # @ self.texts.T.to('cuda')
-
-        self.imgs = self.imgs.to(torch.float64).detach().cpu().numpy()
+        # packed feature store next to the .pt file: memory-mapped, cast per item.
+        # The .pt activations are converted on the first run, by rank 0 alone
+        store_path = IMG_PATH[: -len(".pt")]
+        if is_main_process() and not store_exists(store_path):
+            pack_feature_tensor(IMG_PATH, store_path)
+        barrier()
+        self.store = FeatureStore(store_path)
+        self.imgs = self.store.array
 
         # print(self.imgs.shape)
         # print(self.imgs[0])
@@ -485,7 +509,7 @@ class CLIP_KAND_Dataset(torch.utils.data.Dataset):
             #     self.concepts[:, i, j][mask] = -1
 
     def __getitem__(self, item):
-        embs = self.imgs[item].reshape(-1)
+        embs = self.imgs[item].reshape(-1).astype(np.float64)
         labels = self.labels[item].reshape(-1)
         concepts = self.concepts[item].reshape(3, -1)
 
@@ -10,6 +10,7 @@ from torch.utils.data import Dataset
 from torchvision import datasets
 from tqdm import tqdm
 import copy, itertools
+from datasets.utils.virtual_mnist import ComposedImages, load_mnist_base, sample_worlds
 
 
 def get_label(c1, c2, labels, args):
@@ -88,23 +89,35 @@ class nMNIST(Dataset):
         concepts = self.concepts[idx]
 
         if self.transform is not None:
-            newimage = self.transform(image.astype("uint8"))
+            newimage = self.transform(np.asarray(image, dtype="uint8"))
 
         return newimage, label, concepts
 
+    def composed_split(self):
+        """Index-only images, targets and concepts of the split for the
+        DeviceLoader, None if the images are stored"""
+        if not isinstance(self.data, ComposedImages):
+            return None
+        return self.data, self.targets, self.concepts
+
     def read_data(self, path, split):
         """
-        Returns images and labels
+        Returns images and labels of the split: an index-only split composes its
+        images from the shared MNIST (see virtual_mnist.py), the uint8 images of
+        a converted split are memory-mapped. The labels are loaded in memory
+        since the concepts are masked in place
         """
-        try:
-            # print("Loading data...")
-            data = load(path)
-            # print("Loaded.")
-        except:
+        images_path, labels_path = split_paths(path, split)
+        digits_path = digits_index_path(path, split)
+        if os.path.exists(digits_path):
+            base, _ = load_mnist_base(train=split != "test")
+            images = ComposedImages(base, np.load(digits_path))
+        elif os.path.exists(images_path):
+            images = np.load(images_path, mmap_mode="r")
+        else:
             print("No dataset found.")
 
-        images = data[split]["images"]
-        labels = data[split]["labels"]
+        labels = np.load(labels_path)
 
         return images, labels
 
@@ -117,104 +130,107 @@ class nMNIST(Dataset):
     # def __copy__():
 
 
-def create_sample(X, target_sequence, digit2idx):
-    idxs = [choice(digit2idx[digit][0]) for digit in target_sequence]
-    imgs = [X[idx] for idx in idxs]
-    new_image = np.concatenate(imgs, axis=1)
-    new_label = target_sequence + (np.sum(target_sequence),)
+SPLITS = ("train", "val", "test")
+
+
+def split_paths(data_folder, split):
+    """Files of the images (uint8, N x 28 x 28 * sequence_len) and of the labels
+    (int32, N x (sequence_len + 1), the digits and their sum) of a split"""
+    return (
+        os.path.join(data_folder, f"{split}_images.npy"),
+        os.path.join(data_folder, f"{split}_labels.npy"),
+    )
 
-    return new_image, np.array(new_label).astype("int32"), idxs
+
+def digits_index_path(data_folder, split):
+    """File of the indices of the digits of an index-only split in the MNIST
+    train (train and val) or test set (uint16, N x sequence_len)"""
+    return os.path.join(data_folder, f"{split}_digits.npy")
 
 
 def create_dataset(
-    n_digit=2, sequence_len=2, samples_x_world=100, train=True, download=False
+    n_digit=2, sequence_len=2, samples_x_world=100, train=True, download=False, seed=0
 ):
-    # Download data
-    MNIST = datasets.MNIST(root="./data/raw/", train=train, download=download)
+    # the digits are indices in MNIST, shared by all the splits
+    _, y = load_mnist_base(train=train, download=download)
+
+    # Create the list of all possible permutations with repetition of 'sequence_len' digits
+    worlds = np.array(list(product(range(n_digit), repeat=sequence_len)))
 
-    x, y = MNIST.data, MNIST.targets
+    # samples_x_world samples for each world, in the order of the worlds, with
+    # an MNIST image of the right digit for each position of each sample
+    sequences, idxs = sample_worlds(y, worlds, samples_x_world, seed)
+    labels = np.concatenate(
+        [sequences, sequences.sum(axis=1, keepdims=True)], axis=1
+    ).astype("int32")
 
-    # Create dictionary of indexes for each digit
-    digit2idx = {k: [] for k in range(10)}
-    for k, v in digit2idx.items():
-        v.append(np.where(y == k)[0])
+    # Create dictionary of indexes for each world, which are contiguous
+    label2idx = {
+        tuple(c): torch.arange(i * samples_x_world, (i + 1) * samples_x_world)
+        for i, c in enumerate(worlds.tolist())
+    }
 
-    # Create the list of all possible permutations with repetition of 'sequence_len' digits
-    worlds = list(product(range(n_digit), repeat=sequence_len))
-    imgs = []
-    labels = []
+    return idxs, labels, label2idx
 
-    # Create data sample for each class
-    for c in tqdm(worlds):
-        for i in range(samples_x_world):
-            img, label, idxs = create_sample(x, c, digit2idx)
-            imgs.append(img)
-            labels.append(label)
 
-    # Create dictionary of indexes for each world
-    label2idx = {c: set() for c in worlds}
-    for k, v in tqdm(label2idx.items()):
-        for i, label in enumerate(labels):
-            if tuple(label[:2]) == k:
-                v.add(i)
-    label2idx = {k: torch.tensor(list(v)) for k, v in label2idx.items()}
+def save_split(data_folder, split, images, labels):
+    images_path, labels_path = split_paths(data_folder, split)
+    np.save(images_path, images.astype("uint8"))
+    np.save(labels_path, labels.astype("int32"))
 
-    return np.array(imgs).astype("int32"), np.array(labels), label2idx
+
+def save_index_only_split(data_folder, split, digits, labels):
+    _, labels_path = split_paths(data_folder, split)
+    np.save(digits_index_path(data_folder, split), digits)
+    np.save(labels_path, labels.astype("int32"))
+
+
+def split_exists(data_folder, split):
+    images_path, labels_path = split_paths(data_folder, split)
+    return os.path.exists(labels_path) and (
+        os.path.exists(digits_index_path(data_folder, split))
+        or os.path.exists(images_path)
+    )
 
 
 def check_dataset(n_digits, data_folder, data_file, dataset_dim):
-    """Checks whether the dataset exists, if not creates it."""
+    """Checks whether the dataset exists, if not creates it as index-only splits,
+    deterministically. A dataset in the former single-file format (data_file)
+    is converted to the per-split files."""
     Path(data_folder).mkdir(parents=True, exist_ok=True)
-    data_path = os.path.join(data_folder, data_file)
-    try:
-        load(data_path)
-    except:
-        print("No dataset found.")
-        # Define dataset dimension so to have teh same number of worlds
-        n_worlds = n_digits * n_digits
-        samples_x_world = {k: int(d / n_worlds) for k, d in dataset_dim.items()}
-        dataset_dim = {k: s * n_worlds for k, s in samples_x_world.items()}
-
-        train_imgs, train_labels, train_indexes = create_dataset(
-            n_digit=n_digits,
-            sequence_len=2,
-            samples_x_world=samples_x_world["train"],
-            train=True,
-            download=True,
-        )
+    if all(split_exists(data_folder, split) for split in SPLITS):
+        return
 
-        val_imgs, val_labels, val_indexes = create_dataset(
-            n_digit=n_digits,
-            sequence_len=2,
-            samples_x_world=samples_x_world["val"],
-            train=True,
-            download=True,
-        )
-        test_imgs, test_labels, test_indexes = create_dataset(
+    data_path = os.path.join(data_folder, data_file)
+    if os.path.exists(data_path):
+        print(f"Converting {data_path} to uint8 splits...")
+        data = load(data_path, weights_only=False)
+        for split in SPLITS:
+            save_split(data_folder, split, data[split]["images"], data[split]["labels"])
+        return
+
+    print("No dataset found.")
+    # Define dataset dimension so to have teh same number of worlds
+    n_worlds = n_digits * n_digits
+    samples_x_world = {k: int(d / n_worlds) for k, d in dataset_dim.items()}
+    dataset_dim = {k: s * n_worlds for k, s in samples_x_world.items()}
+
+    for i, split in enumerate(SPLITS):
+        digits, labels, indexes = create_dataset(
             n_digit=n_digits,
             sequence_len=2,
-            samples_x_world=samples_x_world["test"],
-            train=False,
+            samples_x_world=samples_x_world[split],
+            train=split != "test",
             download=True,
+            seed=i,
         )
+        save_index_only_split(data_folder, split, digits, labels)
+        torch.save(indexes, os.path.join(data_folder, f"{split}_indexes.pt"))
 
-        print(
-            f"Dataset dimensions: \n\t{dataset_dim['train']} train ({samples_x_world['train']} samples per world), \n\t{dataset_dim['val']} validation ({samples_x_world['val']} samples per world), \n\t{dataset_dim['test']} test ({samples_x_world['test']} samples per world)"
-        )
-
-        data = {
-            "train": {"images": train_imgs, "labels": train_labels},
-            "val": {"images": val_imgs, "labels": val_labels},
-            "test": {"images": test_imgs, "labels": test_labels},
-        }
-
-        indexes = {"train": train_indexes, "val": val_indexes, "test": test_indexes}
-
-        torch.save(data, data_path)
-        for key, value in indexes.items():
-            torch.save(value, os.path.join(data_folder, f"{key}_indexes.pt"))
-
-        print(f"Dataset saved in {data_folder}")
+    print(
+        f"Dataset dimensions: \n\t{dataset_dim['train']} train ({samples_x_world['train']} samples per world), \n\t{dataset_dim['val']} validation ({samples_x_world['val']} samples per world), \n\t{dataset_dim['test']} test ({samples_x_world['test']} samples per world)"
+    )
+    print(f"Dataset saved in {data_folder}")
 
 
 def load_2MNIST(
@@ -250,28 +266,21 @@ def generate_r_seq(size):
 def load_data(data_file, data_folder, c_sup=1, which_c=[-1], args=None):
 
     # Prepare data
-    data_path = os.path.join(data_folder, data_file)
-    train_set = nMNIST("train", data_path=data_path, args=args)
-    val_set = nMNIST("val", data_path=data_path, args=args)
-    test_set = nMNIST("test", data_path=data_path, args=args)
+    train_set = nMNIST("train", data_path=data_folder, args=args)
+    val_set = nMNIST("val", data_path=data_folder, args=args)
+    test_set = nMNIST("test", data_path=data_folder, args=args)
 
     r_seq = np.load("data/rn.npy")
     # Generate deterministic random sequence
     # r_seq = generate_r_seq(len(train_set))
 
-    numel = 0
-
-    for i in range(len(train_set)):
-        if r_seq[i] > c_sup:
-            train_set.concepts[i] = -1
-        elif not (which_c[0] == -1):
-            if train_set.concepts[i, 0] not in which_c:
-                train_set.concepts[i, 0] = -1
-            if train_set.concepts[i, 1] not in which_c:
-                train_set.concepts[i, 1] = -1
-        else:
-            numel += 1
-
-    # print("Giving supervision to:", numel)
+    # samples without supervision lose both concepts, the supervised ones keep
+    # only the concepts in which_c
+    concepts = train_set.concepts
+    unsupervised = r_seq[: len(train_set)] > c_sup
+    if not (which_c[0] == -1):
+        for j in range(concepts.shape[1]):
+            concepts[~unsupervised & ~np.isin(concepts[:, j], which_c), j] = -1
+    concepts[unsupervised] = -1
 
     return train_set, val_set, test_set
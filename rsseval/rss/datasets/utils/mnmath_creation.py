@@ -7,6 +7,7 @@ import re
 import matplotlib.pyplot as plt
 import joblib
 from torchvision.datasets.folder import pil_loader
+from datasets.utils.virtual_mnist import load_index_only_metas
 
 
 class MNMATHDataset(torch.utils.data.Dataset):
@@ -31,6 +32,12 @@ class MNMATHDataset(torch.utils.data.Dataset):
         self.transform = transforms.Compose([transforms.ToTensor()])
         self.labels, self.concepts = [], []
 
+        # index-only split of rssgen: the images are composed from MNIST
+        self.images = None
+        if len(self.list_images) == 0:
+            self._load_index_only()
+            return
+
         # lmao
         new_images = self.list_images.copy()
 
@@ -59,20 +66,41 @@ class MNMATHDataset(torch.utils.data.Dataset):
             # load data from joblib
             data = joblib.load(meta_scene)
 
-            # take the label
-            label = data["label"]
-            concept_values = data["meta"]["concepts"]
+            self._append_meta(data)
+
+        self.concepts = np.stack(self.concepts, axis=0)
+        self.labels = np.stack(self.labels, axis=0)
+        self.list_images = np.array(new_images)
+
+    def _append_meta(self, data):
+        # take the label
+        label = data["label"]
+        concept_values = data["meta"]["concepts"]
+
+        converted_labels = [bool(l) for l in label]
+        labels = np.array(converted_labels).astype(np.long)
+        self.labels.append(labels)
 
-            converted_labels = [bool(l) for l in label]
-            labels = np.array(converted_labels).astype(np.long)
-            self.labels.append(labels)
+        concepts = np.array(concept_values).astype(np.long)
+        self.concepts.append(concepts)
 
-            concepts = np.array(concept_values).astype(np.long)
-            self.concepts.append(concepts)
+    def _load_index_only(self):
+        metas = glob.glob(os.path.join(self.base_path, self.split, "*.joblib"))
+        metas = sorted(metas, key=lambda m: self._extract_number(os.path.basename(m)))
+        metas = [joblib.load(m) for m in metas]
+        for data in metas:
+            self._append_meta(data)
 
+        self.images = load_index_only_metas(metas)
         self.concepts = np.stack(self.concepts, axis=0)
         self.labels = np.stack(self.labels, axis=0)
-        self.list_images = np.array(new_images)
+
+    def composed_split(self):
+        """Index-only images, labels and concepts of the split for the
+        DeviceLoader, None if the images are stored as files"""
+        if self.images is None:
+            return None
+        return self.images, self.labels, self.concepts
 
     def _extract_number(self, path):
         match = re.search(r"\d+", path)
@@ -82,6 +110,9 @@ class MNMATHDataset(torch.utils.data.Dataset):
 
         labels = self.labels[item]
         concepts = self.concepts[item]
+        if self.images is not None:
+            return self.transform(self.images[item]), labels, concepts
+
         img_path = self.list_images[item]
         image = pil_loader(img_path)
 
@@ -91,7 +122,7 @@ class MNMATHDataset(torch.utils.data.Dataset):
         return self.transform(image), labels, concepts
 
     def __len__(self):
-        return len(self.list_images)
+        return len(self.labels)
 
 
 if __name__ == "__main__":
@@ -8,6 +8,7 @@ import matplotlib.pyplot as plt
 import json
 from torchvision.datasets.folder import pil_loader
 from datasets.utils.mnist_creation import generate_r_seq
+from datasets.utils.feature_store import FeatureStore, store_exists
 
 
 CONCEPTS_ORDER = {
@@ -253,12 +254,19 @@ class ClIP_SDDOIADataset(torch.utils.data.Dataset):
 
         self.split = split
 
-        # collecting images
-        self.list_images = glob.glob(
-            os.path.join(
-                "data/saved_activations/SDDOIA-preprocessed", self.split, "*"
-            )
+        # collecting images, from the packed feature store if available
+        self.store = None
+        store_path = os.path.join(
+            "data/saved_activations/SDDOIA-preprocessed", self.split
         )
+        if store_exists(store_path):
+            self.store = FeatureStore(store_path)
+            self.list_images = [
+                os.path.join(self.base_path, self.split, name + ".pt")
+                for name in self.store.names
+            ]
+        else:
+            self.list_images = glob.glob(os.path.join(store_path, "*"))
         # sort the images
         self.list_images = sorted(self.list_images, key=self._extract_number)
 
@@ -393,6 +401,10 @@ class ClIP_SDDOIADataset(torch.utils.data.Dataset):
             self.list_images = self.list_images[random_indices]
             self.names = self.names[random_indices]
 
+        # rows of the samples in the store, read a batch at a time by __getitems__
+        if self.store is not None:
+            self.rows = np.array([self.store.index_of(name) for name in self.names])
+
         # IMG_PATH = os.path.join(self.dir_path, 'saved_activations', f'sddoia_{self.split}_clip_ViT-B32.pt')
         # image_features = torch.load(IMG_PATH)
 
@@ -418,13 +430,32 @@ class ClIP_SDDOIADataset(torch.utils.data.Dataset):
         img_path = self.list_images[item]
         names = self.names[item]
         # image = self.imgs[item]
-        image = torch.load(img_path).to(torch.float64)
+        if self.store is not None:
+            image = self.store[self.rows[item]].to(torch.float64)
+        else:
+            image = torch.load(img_path).to(torch.float64)
 
         if self.return_embeddings:
             return image, labels, concepts, names
 
         return image, labels, concepts
 
+    def __getitems__(self, items):
+        """Samples of a batch of indices, called by the DataLoader in place of
+        __getitem__: the embeddings of the batch are gathered from the store in
+        a single read"""
+        if self.store is None:
+            return [self[item] for item in items]
+
+        images = self.store[self.rows[items]].to(torch.float64)
+        samples = []
+        for image, item in zip(images, items):
+            sample = (image, self.labels[item], self.concepts[item])
+            if self.return_embeddings:
+                sample = sample + (self.names[item],)
+            samples.append(sample)
+        return samples
+
     def __len__(self):
         return len(self.list_images)
 
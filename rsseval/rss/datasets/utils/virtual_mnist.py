@@ -0,0 +1,181 @@
+# Module which contains the index-only composite MNIST datasets
+#
+# A composite sample (an MNIST-addition pair, an MNMath system, an XOR sequence)
+# is a sequence of MNIST digits side by side. Instead of its pixels, a split
+# stores the indices of its digits in the MNIST train or test set, which is
+# loaded once per process and shared by all the splits and the variants built
+# on them: the images are composed when they are read, or batch-wise on the
+# device by the DeviceLoader.
+import os
+import numpy as np
+import torch
+from torchvision import datasets
+
+MNIST_ROOT = "./data/raw/"
+
+# (root, train) -> (images, labels), the shared base of the composite datasets
+_MNIST_BASE = {}
+
+
+def load_mnist_base(train=True, root=MNIST_ROOT, download=True):
+    """Loads the MNIST train or test set once per process
+
+    Args:
+        train (bool, default=True): train or test set
+        root (str, default=MNIST_ROOT): folder of the MNIST raw files
+        download (bool, default=True): download MNIST if missing
+
+    Returns:
+        images (np.ndarray): (N, 28, 28) uint8 images
+        labels (np.ndarray): (N,) digits
+    """
+    key = (os.path.abspath(root), train)
+    if key not in _MNIST_BASE:
+        mnist = datasets.MNIST(root=root, train=train, download=download)
+        _MNIST_BASE[key] = (mnist.data.numpy(), mnist.targets.numpy())
+    return _MNIST_BASE[key]
+
+
+def index_dtype(base):
+    """Smallest unsigned integer type of the indices of the base (uint16 for MNIST)
+
+    Args:
+        base (np.ndarray): base images
+
+    Returns:
+        dtype (np.dtype): index type
+    """
+    return np.min_scalar_type(max(len(base) - 1, 0))
+
+
+def sample_worlds(base_labels, worlds, samples_x_world, seed):
+    """World-balanced sampling: samples_x_world sequences of each world, in the
+    order of the worlds, each digit drawn among the base images of its value
+
+    Args:
+        base_labels (np.ndarray): (N,) digits of the base images
+        worlds (np.ndarray): (n_worlds, sequence_len) digits of the worlds
+        samples_x_world (int): number of samples of each world
+        seed: seed of the numpy generator
+
+    Returns:
+        sequences (np.ndarray): (n_worlds * samples_x_world, sequence_len) digits
+        indices (np.ndarray): indices of the digits in the base, same shape
+    """
+    rng = np.random.default_rng(seed)
+    sequences = np.repeat(np.asarray(worlds), samples_x_world, axis=0)
+
+    indices = np.empty(sequences.shape, dtype=index_dtype(base_labels))
+    for digit in np.unique(sequences):
+        where = sequences == digit
+        indices[where] = rng.choice(
+            np.flatnonzero(base_labels == digit), size=where.sum()
+        )
+    return sequences, indices
+
+
+class ComposedImages:
+    """Array-like (N, 28, 28 * sequence_len) uint8 images, stored as the
+    (N, sequence_len) indices of their digits in a shared base of images.
+
+    An integer index composes the image; slices, masks and index arrays return
+    the composite images of the selection, over the same base, so that the
+    variants filtering a split do not copy any pixel.
+    """
+
+    def __init__(self, base, indices) -> None:
+        """Initialize method
+
+        Args:
+            self: instance
+            base (np.ndarray): (M, 28, 28) uint8 images of the digits
+            indices (np.ndarray): (N, sequence_len) indices in the base
+
+        Returns:
+            None: This function does not return a value.
+        """
+        self.base = base
+        self.indices = np.asarray(indices)
+
+    @property
+    def shape(self):
+        n, sequence_len = self.indices.shape
+        h, w = self.base.shape[1:]
+        return (n, h, w * sequence_len)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            # (sequence_len, h, w) -> digits side by side (h, w * sequence_len)
+            digits = self.base[self.indices[key]]
+            return digits.transpose(1, 0, 2).reshape(self.shape[1:])
+        return ComposedImages(self.base, self.indices[key])
+
+    def __array__(self, dtype=None, copy=None):
+        n, h, w = self.shape
+        images = self.base[self.indices].transpose(0, 2, 1, 3).reshape(n, h, w)
+        return images if dtype is None else images.astype(dtype)
+
+    def __deepcopy__(self, memo):
+        # the base is shared, only the indices are copied
+        return ComposedImages(self.base, self.indices.copy())
+
+    def to(self, device):
+        """The composite images on a device, composed batch-wise
+
+        Args:
+            self: instance
+            device (torch.device): device
+
+        Returns:
+            images (DeviceComposedImages): images on the device
+        """
+        return DeviceComposedImages(
+            torch.as_tensor(np.asarray(self.base), device=device),
+            torch.as_tensor(self.indices.astype(np.int64), device=device),
+        )
+
+
+class DeviceComposedImages:
+    """Composite images of a device-resident base: a batch is a gather of its
+    digits followed by a reshape, in the layout of ToTensor (B, 1, h, w * sequence_len)"""
+
+    def __init__(self, base, indices) -> None:
+        """Initialize method
+
+        Args:
+            self: instance
+            base (torch.tensor): (M, h, w) uint8 images of the digits
+            indices (torch.tensor): (N, sequence_len) int64 indices in the base
+
+        Returns:
+            None: This function does not return a value.
+        """
+        self.base = base
+        self.indices = indices
+
+    def __getitem__(self, index):
+        digits = self.base[self.indices[index]]
+        b, sequence_len, h, w = digits.shape
+        return digits.permute(0, 2, 1, 3).reshape(b, 1, h, w * sequence_len)
+
+
+def load_index_only_metas(metas, root=MNIST_ROOT):
+    """Composite images of the metas of an index-only split of rssgen, which
+    record the indices of their digits (mnist_indices) in the MNIST split
+    (mnist_split) instead of an image file
+
+    Args:
+        metas (list): metas of the samples, in order
+        root (str, default=MNIST_ROOT): folder of the MNIST raw files
+
+    Returns:
+        images (ComposedImages): composite images
+    """
+    base, _ = load_mnist_base(train=metas[0]["meta"]["mnist_split"] == "train", root=root)
+    indices = np.array(
+        [data["meta"]["mnist_indices"] for data in metas], dtype=index_dtype(base)
+    )
+    return ComposedImages(base, indices)
@@ -10,7 +10,9 @@ import datetime
 
 from datasets import get_dataset
 from models import get_model
-from utils.train import train
+from utils.train import train, train_ensemble
+from utils.ensemble import init_models
+from utils.distributed import init_distributed, cleanup_distributed, is_main_process
 from utils.test import test
 from utils.preprocess_resnet import preprocess
 from utils.conf import *
@@ -18,6 +20,7 @@ import signal
 from utils.args import *
 from utils.checkpoint import save_model, create_load_ckpt
 from utils.probe import probe
+from utils.search import asha_search
 
 from argparse import Namespace
 import wandb
@@ -99,8 +102,6 @@ def parse_args_old():
         action="store_true",
         help="loads moco base encoder, pretrained on kanddpl",
     )
-    torch.set_num_threads(4)
-
     add_management_args(parser)
     args = parser.parse_known_args()[0]
     mod = importlib.import_module("models." + args.model)
@@ -114,6 +115,9 @@ def parse_args_old():
     add_test_args(parser)
     args = parser.parse_args()  # this is the return
 
+    # cpu threads and process group when launched with torchrun
+    init_distributed(args)
+
     # load args related to seed etc.
     set_random_seed(args.seed) if args.seed is not None else set_random_seed(42)
 
@@ -152,8 +156,6 @@ def parse_args():
         help="loads moco base encoder, pretrained on kanddpl",
     )
 
-    torch.set_num_threads(4)
-
     add_management_args(base_parser)
 
     # Parse preliminary args to load model-specific parser
@@ -177,6 +179,9 @@ def parse_args():
     # Final parsed args
     args = model_parser.parse_args()
 
+    # cpu threads and process group when launched with torchrun
+    init_distributed(args)
+
     # Set random seed
     set_random_seed(args.seed) if args.seed is not None else set_random_seed(42)
 
@@ -184,11 +189,16 @@ def parse_args():
 
 def tune(args):
     """
-    This function performs a hyper-parameter tuning of the model using a WandB sweep.
+    This function performs a hyper-parameter tuning of the model, with a local
+    ASHA search (default, see utils/search.py) or using a WandB sweep (--search wandb).
 
     Args:
         args: parsed command line arguments
     """
+    if args.search == "asha":
+        asha_search(args)
+        return
+
     sweep_conf = {
         "method": "bayes",
         "metric": {"goal": "maximize", "name": args.val_metric},
@@ -284,12 +294,33 @@ def main(args):
             probe(model, dataset, args)
         elif args.posthoc:
             test(model, dataset, args)  # test the model if post-hoc is passed
+        elif args.ensemble_seeds is not None:
+            # one copy of the model per seed, trained in a single vectorized loop
+            models = init_models(
+                lambda: get_model(
+                    args,
+                    *dataset.get_backbone(),
+                    n_images,
+                    c_split,
+                    moco=args.moco,
+                    moco_pretrained=args.moco_pretrained,
+                ),
+                args.ensemble_seeds,
+                args,
+            )
+            train_ensemble(models, dataset, loss, args)
+            if is_main_process():
+                for seed, seed_model in zip(args.ensemble_seeds, models):
+                    args.seed = seed
+                    save_model(seed_model, args)
         else:
             train(model, dataset, loss, args)  # train the model otherwise
-            save_model(model, args)  # save the model parameters
+            if is_main_process():
+                save_model(model, args)  # save the model parameters
     else:
         tune(args)
 
+    cleanup_distributed()
     print("\n ### Closing ###")
 
 
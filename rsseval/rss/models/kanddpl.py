@@ -112,7 +112,7 @@ class KandDPL(DeepProblogModel):
             return torch.stack(logits, dim=1)
 
         # Image encoding
-        cs, pCs, preds = [], [], []
+        cs = []
         xs = torch.split(x, x.size(-1) // self.n_images, dim=-1)
         # xs = torch.split(x, x.size(-1) // self.n_images, dim=-1)  # originally -1, but changed to 3 since 3 imgs are packed together
         for i in range(self.n_images):
@@ -123,22 +123,16 @@ class KandDPL(DeepProblogModel):
             else:
                 lc, _ = self.encoder(xs[i])  # sizes are ok
 
-            pc = self.normalize_concepts(lc)
+            cs.append(lc)
 
-            pred, worlds_prob = self.problog_inference(pc)
-            
+        cs = torch.stack(cs, dim=1)  # [batch_size, n_images, 24]
 
+        # normalization and inference of all the figures in a single batched call
+        pCs = self.normalize_concepts(cs)
+        preds, worlds_prob = self.problog_inference(pCs.flatten(0, 1))
+        preds = preds.view(cs.size(0), self.n_images, -1)
 
-            cs.append(lc), pCs.append(pc), preds.append(pred)
-
-        clen = len(cs[0].shape)
-
-        cs = torch.stack(cs, dim=1) if clen > 1 else torch.cat(cs, dim=1)
-        pCs = torch.stack(pCs, dim=1) if clen > 1 else torch.cat(pCs, dim=1)
-
-        py = self.combine_queries(preds)
-
-        preds = torch.stack(preds, dim=1) if clen > 1 else torch.cat(preds, dim=1)
+        py = self.combine_queries(preds.unbind(dim=1))
 
         # Problog inference to compute worlds and query probability distributions
         # py, worlds_prob = self.problog_inference(pCs)
@@ -167,12 +161,10 @@ class KandDPL(DeepProblogModel):
 
         worlds_prob = worlds_tensor.reshape(-1, 3**self.n_facts)
 
-        # Compute query probability P(q)
-        query_prob = torch.zeros(size=(len(pCs), self.n_predicates), device=pCs.device)
-
-        for i in range(self.n_predicates):
-            query = i
-            query_prob[:, i] = self.compute_query(query, worlds_prob).view(-1)
+        # Compute query probability P(q) of all the queries with one product:
+        # P(q) is the sum of the probabilities of the worlds where q is true
+        with torch.autocast(device_type=worlds_prob.device.type, enabled=False):
+            query_prob = worlds_prob @ self.w_q.to(worlds_prob.dtype)
 
         # add a small offset
         # query_prob += 1e-5
@@ -194,13 +186,8 @@ class KandDPL(DeepProblogModel):
         """
         y_worlds = outer_product(*preds).reshape(-1, 9**self.n_images)
 
-        py = torch.zeros(size=(len(preds[0]), self.nr_classes), device=preds[0].device)
-
-        for i in range(self.nr_classes):
-            and_rule = self.and_rule[:, i]
-            query_prob = torch.sum(and_rule * y_worlds, dim=1, keepdim=True)
-
-            py[:, i] = query_prob.view(-1)
+        with torch.autocast(device_type=y_worlds.device.type, enabled=False):
+            py = y_worlds @ self.and_rule.to(y_worlds.dtype)
 
         return py
 
@@ -1,10 +1,13 @@
 # DPL model for MNIST
 import torch
+import torch.nn.functional as F
 from models.utils.deepproblog_modules import DeepProblogModel
 from utils.args import *
 from utils.conf import get_device
 from models.utils.deepproblog_modules import GraphSemiring
 from models.utils.utils_problog import *
+from models.utils.ops import to_fp32
+from models.utils.arithmetic import add_distributions, apply_operation
 from utils.losses import *
 from utils.dpl_loss import ADDMNIST_DPL
 
@@ -78,15 +81,26 @@ class MnistDPL(DeepProblogModel):
             )
             self.w_q = build_worlds_queries_matrix(2, self.n_facts, "productmnist")
             self.nr_classes = 37
+            # values of the queries, the products of two digits in 0..9
+            digits = torch.arange(10)
+            self.query_values = torch.unique(digits[:, None] * digits[None, :])
         elif args.task == "multiop":
             self.n_facts = 5
             self.w_q = build_worlds_queries_matrix(2, self.n_facts, "multiopmnist")
             self.nr_classes = 3
 
+        # addition and product are evaluated by arithmetic inference, multiop
+        # through the worlds-queries matrix
+        self.task = args.task
+        self.digit_values = torch.arange(self.n_facts)
+
         # opt and device
         self.opt = None
         self.device = get_device()
         self.w_q = self.w_q.to(self.device)
+        self.digit_values = self.digit_values.to(self.device)
+        if hasattr(self, "query_values"):
+            self.query_values = self.query_values.to(self.device)
 
     def forward(self, x):
         """Forward method
@@ -129,7 +143,8 @@ class MnistDPL(DeepProblogModel):
             worlds_prob: worlds probability
         """
 
-        # Extract first and second digit probability
+        # Extract first and second digit probability (in fp32, also under autocast)
+        pCs = to_fp32(pCs)
         prob_digit1, prob_digit2 = pCs[:, 0, :], pCs[:, 1, :]
 
         # Compute worlds probability P(w) (the two digits values are independent)
@@ -141,16 +156,30 @@ class MnistDPL(DeepProblogModel):
         worlds_prob = probs.reshape(-1, self.n_facts * self.n_facts)
 
         # Compute query probability P(q)
-        query_prob = torch.zeros(
-            size=(len(probs), self.nr_classes), device=probs.device
-        )
+        if self.task == "addition":
+            # P(d1 + d2) as a convolution, padded to all the sums up to 18
+            query_prob = add_distributions(prob_digit1, prob_digit2)
+            query_prob = F.pad(query_prob, (0, self.nr_classes - query_prob.size(1)))
+        elif self.task == "product":
+            query_prob, _ = apply_operation(
+                prob_digit1,
+                self.digit_values,
+                prob_digit2,
+                self.digit_values,
+                torch.mul,
+                self.query_values,
+            )
+        else:
+            query_prob = torch.zeros(
+                size=(len(probs), self.nr_classes), device=probs.device
+            )
 
-        for i in range(self.nr_classes):
-            query = i
-            query_prob[:, i] = self.compute_query(query, worlds_prob).view(-1)
+            for i in range(self.nr_classes):
+                query = i
+                query_prob[:, i] = self.compute_query(query, worlds_prob).view(-1)
 
         # add a small offset
-        query_prob += 1e-5
+        query_prob = query_prob + 1e-5
         with torch.no_grad():
             Z = torch.sum(query_prob, dim=-1, keepdim=True)
         query_prob = query_prob / Z
@@ -246,3 +275,6 @@ class MnistDPL(DeepProblogModel):
     def to(self, device):
         super().to(device)
         self.w_q = self.w_q.to(device)
+        self.digit_values = self.digit_values.to(device)
+        if hasattr(self, "query_values"):
+            self.query_values = self.query_values.to(device)
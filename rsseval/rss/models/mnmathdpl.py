@@ -6,7 +6,7 @@ from utils.conf import get_device
 from models.utils.utils_problog import *
 from utils.losses import MNMATH_Cumulative
 from utils.dpl_loss import MNMATH_DPL
-from models.utils.ops import outer_product
+from models.utils.arithmetic import equation_prob
 
 
 def get_parser() -> ArgumentParser:
@@ -71,15 +71,11 @@ class MNMATHDPL(DeepProblogModel):
         self.args = args
         self.n_images = 8
 
-        # logic
-        logic_sum = create_mnmath_sum(n_digits=10, sequence_len=4)
-        logic_and = create_mnmath_prod(n_digits=10, sequence_len=4)
+        # logic: the equations are evaluated by arithmetic inference over the
+        # digit distributions, no worlds-queries matrix is needed
         logic_combine = create_mnist_and()
-        
-        # and, sum, combine
-        self.logic_sum = logic_sum.to(self.device)
-        self.logic_and = logic_and.to(self.device)
         self.combine = logic_combine.to(self.device)
+        self.digit_values = torch.arange(self.n_facts, device=self.device)
 
         # opt and device
         self.opt = None
@@ -130,43 +126,28 @@ class MNMATHDPL(DeepProblogModel):
             worlds_prob: worlds probability
         """
 
-        # Extract digit probability
-        prob_digit1, prob_digit2, prob_digit3, prob_digit4 = pCs[:, 0, :], pCs[:, 1, :], pCs[:, 2, :], pCs[:, 3, :]
-
-        # Extract again digit probability
-        prob_digit5, prob_digit6, prob_digit7, prob_digit8 = pCs[:, 4, :], pCs[:, 5, :], pCs[:, 6, :], pCs[:, 7, :]
-
-        # Compute worlds probability P(w) for sum
-        probs_for_sum = outer_product(prob_digit1, prob_digit2, prob_digit3, prob_digit4)
-        worlds_prob_sum = probs_for_sum.reshape(-1, int(self.n_facts ** (self.n_images / 2)))
+        # Extract digit probability, the first half is the sum equation, the
+        # second half the product one
+        digits = [pCs[:, i, :] for i in range(self.n_images)]
+        half = self.n_images // 2
 
-        probs_for_prod = outer_product(prob_digit5, prob_digit6, prob_digit7, prob_digit8)
-        worlds_prob_prod = probs_for_prod.reshape(-1, int(self.n_facts ** (self.n_images / 2)))
+        # P(d1 + d2 == d3 + d4) and P(d5 * d6 == d7 * d8), computed exactly
+        # but without enumerating the n_facts ** half worlds
+        p_sum = equation_prob(digits[:half], self.digit_values, "sum")
+        p_prod = equation_prob(digits[half:], self.digit_values, "prod")
 
         # Compute query probability P(q)
-        query_prob_sum = torch.zeros(
-            size=(len(worlds_prob_sum), self.nr_classes), device=probs_for_sum.device
-        )
-        query_prob_prod = torch.zeros(
-            size=(len(worlds_prob_prod), self.nr_classes), device=probs_for_prod.device
-        )
-
-        for i in range(self.nr_classes):
-            query = i
-            query_prob_sum[:, i] = self.compute_query_sum(query, worlds_prob_sum).view(-1)
-
-        for i in range(self.nr_classes):
-            query = i
-            query_prob_prod[:, i] = self.compute_query_prod(query, worlds_prob_prod).view(-1)
+        query_prob_sum = torch.stack((1 - p_sum, p_sum), dim=1)
+        query_prob_prod = torch.stack((1 - p_prod, p_prod), dim=1)
 
         # add a small offset
-        query_prob_prod += 1e-5
+        query_prob_prod = query_prob_prod + 1e-5
         with torch.no_grad():
             Z = torch.sum(query_prob_prod, dim=-1, keepdim=True)
         query_prob_prod = query_prob_prod / Z
 
         # add a small offset
-        query_prob_sum += 1e-5
+        query_prob_sum = query_prob_sum + 1e-5
         with torch.no_grad():
             Z = torch.sum(query_prob_sum, dim=-1, keepdim=True)
         query_prob_sum = query_prob_sum / Z
@@ -175,42 +156,6 @@ class MNMATHDPL(DeepProblogModel):
         
         return combined_tensor, None
 
-    def compute_query_sum(self, query, worlds_prob):
-        """Computes query probability given the worlds probability P(w).
-
-        Args:
-            self: instance
-            query: query
-            worlds_probs: worlds probabilities
-
-        Returns:
-            query_prob: query probabilities
-        """
-        # Select the column of w_q matrix corresponding to the current query
-        w_q = self.logic_sum[:, query]
-
-        # Compute query probability by summing the probability of all the worlds where the query is true
-        query_prob = torch.sum(w_q * worlds_prob, dim=1, keepdim=True)
-        return query_prob
-
-    def compute_query_prod(self, query, worlds_prob):
-        """Computes query probability given the worlds probability P(w).
-
-        Args:
-            self: instance
-            query: query
-            worlds_probs: worlds probabilities
-
-        Returns:
-            query_prob: query probabilities
-        """
-        # Select the column of w_q matrix corresponding to the current query
-        w_q = self.logic_and[:, query]
-
-        # Compute query probability by summing the probability of all the worlds where the query is true
-        query_prob = torch.sum(w_q * worlds_prob, dim=1, keepdim=True)
-        return query_prob
-
     def compute_query_combine(self, query, worlds_prob):
         """Computes query probability given the worlds probability P(w).
 
@@ -303,6 +248,5 @@ class MNMATHDPL(DeepProblogModel):
     # override
     def to(self, device):
         super().to(device)
-        self.logic_and = self.logic_and.to(device)
-        self.logic_sum = self.logic_sum.to(device)
+        self.digit_values = self.digit_values.to(device)
         self.combine = self.combine.to(device)
@@ -0,0 +1,127 @@
+# Exact probabilistic inference for arithmetic queries over digits
+#
+# Instead of enumerating all the worlds (N^k for k digits) and multiplying by a
+# worlds-queries matrix, the distribution of the result of each operation is
+# propagated digit by digit: sums are batched 1-D convolutions, other operations
+# a scatter-add of the pairwise joint over the table of the results. Equality
+# queries are then dot products between two distributions.
+import torch
+import torch.nn.functional as F
+
+from models.utils.ops import to_fp32
+
+
+def add_distributions(p_a, p_b):
+    """Distribution of a + b, for independent a in 0..N-1 and b in 0..M-1
+
+    Args:
+        p_a (torch.tensor): (B, N) distribution of a
+        p_b (torch.tensor): (B, M) distribution of b
+
+    Returns:
+        p_sum (torch.tensor): (B, N + M - 1) distribution of a + b
+    """
+    p_a, p_b = to_fp32(p_a), to_fp32(p_b)
+    n_b = p_b.size(1)
+
+    # one group per sample: each distribution is convolved with its own kernel
+    with torch.autocast(device_type=p_a.device.type, enabled=False):
+        p_sum = F.conv1d(
+            p_a.unsqueeze(0),
+            p_b.flip(-1).unsqueeze(1),
+            padding=n_b - 1,
+            groups=p_a.size(0),
+        )
+    return p_sum.squeeze(0)
+
+
+def apply_operation(p_a, values_a, p_b, values_b, op, out_values=None):
+    """Distribution of op(a, b), for independent a and b with arbitrary values
+
+    Args:
+        p_a (torch.tensor): (B, N) distribution of a
+        values_a (torch.tensor): (N,) values of a
+        p_b (torch.tensor): (B, M) distribution of b
+        values_b (torch.tensor): (M,) values of b
+        op: binary element-wise operation, e.g. torch.mul
+        out_values (torch.tensor, default=None): sorted values of the result,
+            which must contain all the results. Defaults to the unique results
+
+    Returns:
+        p_out (torch.tensor): (B, K) distribution of op(a, b)
+        out_values (torch.tensor): (K,) values of op(a, b)
+    """
+    p_a, p_b = to_fp32(p_a), to_fp32(p_b)
+
+    table = op(values_a[:, None], values_b[None, :]).reshape(-1)
+    if out_values is None:
+        out_values, index = torch.unique(table, return_inverse=True)
+    else:
+        index = torch.searchsorted(out_values, table)
+
+    joint = (p_a[:, :, None] * p_b[:, None, :]).reshape(p_a.size(0), -1)
+    p_out = joint.new_zeros(p_a.size(0), len(out_values)).index_add_(1, index, joint)
+    return p_out, out_values
+
+
+def reduce_distributions(ps, values, op):
+    """Distribution of op(d_1, ..., d_k), folding op left to right over the digits
+
+    Args:
+        ps (list): (B, N) distributions of the digits
+        values (torch.tensor): (N,) values of the digits
+        op (str): "sum" or "prod"
+
+    Returns:
+        p_out (torch.tensor): (B, K) distribution of the result
+        out_values (torch.tensor): (K,) values of the result
+    """
+    p_out, out_values = ps[0], values
+    for p in ps[1:]:
+        if op == "sum":
+            # digit values are 0..N-1, hence the sums are a contiguous range
+            p_out = add_distributions(p_out, p)
+            out_values = torch.arange(p_out.size(1), device=p_out.device)
+        elif op == "prod":
+            p_out, out_values = apply_operation(p_out, out_values, p, values, torch.mul)
+        else:
+            raise NotImplementedError(f"Unknown operation {op}")
+    return p_out, out_values
+
+
+def equality_prob(p_a, values_a, p_b, values_b):
+    """Probability that a == b, for independent a and b
+
+    Args:
+        p_a (torch.tensor): (B, N) distribution of a
+        values_a (torch.tensor): (N,) values of a
+        p_b (torch.tensor): (B, M) distribution of b
+        values_b (torch.tensor): (M,) values of b
+
+    Returns:
+        p_eq (torch.tensor): (B,) probability of a == b
+    """
+    p_a, p_b = to_fp32(p_a), to_fp32(p_b)
+    match = (values_a[:, None] == values_b[None, :]).to(p_a.dtype)
+    with torch.autocast(device_type=p_a.device.type, enabled=False):
+        p_eq = ((p_a @ match) * p_b).sum(dim=-1)
+    return p_eq
+
+
+def equation_prob(ps, values, op):
+    """Probability that the equation op(first half) == op(second half) holds,
+    e.g. d1 + d2 == d3 + d4
+
+    Args:
+        ps (list): (B, N) distributions of the digits, an even number
+        values (torch.tensor): (N,) values of the digits
+        op (str): "sum" or "prod"
+
+    Returns:
+        p_true (torch.tensor): (B,) probability of the equation being true
+    """
+    assert len(ps) % 2 == 0, "The two sides must have the same number of digits"
+    half = len(ps) // 2
+    p_lhs, v_lhs = reduce_distributions(ps[:half], values, op)
+    p_rhs, v_rhs = reduce_distributions(ps[half:], values, op)
+    return equality_prob(p_lhs, v_lhs, p_rhs, v_rhs)
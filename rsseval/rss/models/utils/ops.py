@@ -1,6 +1,20 @@
 import torch
 
 
+def to_fp32(tensor):
+    """Upcasts half-precision tensors (fp16/bf16) to fp32, leaves the others untouched
+
+    Args:
+        tensor (torch.tensor): input tensor
+
+    Returns:
+        tensor (torch.tensor): tensor in at least fp32 precision
+    """
+    if tensor.dtype in (torch.float16, torch.bfloat16):
+        return tensor.float()
+    return tensor
+
+
 def outer_product(*tensors):
     # Check if the number of tensors is at least 2
     if len(tensors) < 2:
@@ -16,10 +30,15 @@ def outer_product(*tensors):
     # Create the einsum string dynamically based on the number of tensors
     einsum_string = ",".join(f"z{chr(97 + i)}" for i in range(len(tensors)))
 
+    # Worlds probabilities are products of many concept probabilities and
+    # underflow in fp16/bf16: under autocast the einsum is kept in fp32
+    tensors = [to_fp32(tensor) for tensor in tensors]
+
     # Calculate the outer product
-    result = torch.einsum(
-        einsum_string + "->z" + "".join(chr(97 + i) for i in range(len(tensors))),
-        *tensors,
-    )
+    with torch.autocast(device_type=tensors[0].device.type, enabled=False):
+        result = torch.einsum(
+            einsum_string + "->z" + "".join(chr(97 + i) for i in range(len(tensors))),
+            *tensors,
+        )
 
     return result
@@ -3,6 +3,7 @@ import math
 import torch
 import preprocessing.clip as clip
 import preprocessing.data_utils as data_utils
+from datasets.utils.feature_store import FeatureStoreWriter
 
 import numpy as np
 
@@ -93,24 +94,21 @@ def save_clip_image_features(
     mnist=True,
     n_images=1,
     d_probe="dataset_train",
+    dtype="float32",
 ):
+    """
+    Encodes the dataset once per batch and packs the embeddings of the split in a
+    single feature store at {save_dir}/SDDOIA-preprocessed/{split}.npy (+ .json index)
+    """
     _make_save_dir(save_name)
-    all_features = []
-    # if os.path.exists(save_name):
-    #     return
-    save_dir = save_name[: save_name.rfind("/")]
-    if not os.path.exists(save_dir):
-        os.makedirs(save_dir)
 
     split = extract_after_underscore(d_probe)
-
-    os.makedirs(
-        os.path.join(save_name[: save_name.rfind("/")], "SDDOIA-preprocessed", split),
-        exist_ok=True,
+    store_path = os.path.join(
+        save_name[: save_name.rfind("/")], "SDDOIA-preprocessed", split
     )
-    with torch.no_grad():
-        save_paths = []
 
+    writer = None
+    with torch.no_grad():
         for images, labels in tqdm(
             DataLoader(
                 dataset, batch_size, num_workers=8, pin_memory=True, shuffle=False
@@ -118,39 +116,21 @@ def save_clip_image_features(
         ):
             features = model.encode_image(images.to(device))
 
-            features = model.encode_image(images.to(device))
-
-            for i, label in enumerate(labels):
-
-                # print(extract_numbers_from_path(label))
-                # print(label)
-
-                save_path = os.path.join(
-                    save_name[: save_name.rfind("/")],
-                    "SDDOIA-preprocessed",
-                    split,
-                    extract_numbers_from_path(label) + ".pt",
+            if writer is None:
+                writer = FeatureStoreWriter(
+                    store_path, len(dataset), features.shape[-1], dtype=dtype
                 )
 
-                save_paths.append(save_path)
-
-                if list(features[i, :].shape) != [512]:
-                    print(features[i].shape)
-
-                torch.save(features[i].detach().cpu().to(torch.float32), save_path)
-            all_features.append(features.cpu())
+            names = [extract_numbers_from_path(label) for label in labels]
+            writer.write(features, names)
 
-        print(
-            "Len comparison",
-            len(np.unique(np.array(save_paths))),
-            len(torch.cat(all_features)),
-        )
-
-        # all_features.append(features.cpu())
+    if writer is None:
+        print("No images in", d_probe, "nothing saved")
+    else:
+        prefix = writer.close()
+        print("Saved", len(writer.names), "embeddings to", prefix)
 
-    # torch.save(torch.cat(all_features), save_name)
     # free memory
-    del all_features
     torch.cuda.empty_cache()
     return
 
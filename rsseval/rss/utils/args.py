@@ -134,6 +134,27 @@ def add_experiment_args(parser: ArgumentParser) -> None:
         "--n_epochs", type=int, default=50, help="Number of epochs per task."
     )
     parser.add_argument("--batch_size", type=int, default=64, help="Batch size.")
+    parser.add_argument(
+        "--amp",
+        type=str,
+        default=None,
+        choices=["bf16", "fp16"],
+        help="Train with mixed precision (fp16 uses a grad scaler and is GPU only).",
+    )
+    parser.add_argument(
+        "--compile",
+        default=False,
+        action="store_true",
+        help="Wrap the model forward and the loss with torch.compile (torch>=2.0).",
+    )
+    parser.add_argument(
+        "--device_dataset",
+        default=False,
+        action="store_true",
+        help="Decode the splits once and keep them on the device as uint8 tensors, "
+        "batches are sampled on the device without DataLoader "
+        "(kandinsky, minikandinsky, xor, mnmath).",
+    )
 
     # deep ensembles
     parser.add_argument(
@@ -171,6 +192,43 @@ def add_experiment_args(parser: ArgumentParser) -> None:
         action="store_true",
         help="Whether to perform tuning of the specified model.",
     )
+    parser.add_argument(
+        "--search",
+        default="asha",
+        choices=["asha", "wandb"],
+        type=str,
+        help="Tuning with a local ASHA search (resumable, offline) or a wandb sweep.",
+    )
+    parser.add_argument(
+        "--search_dir",
+        default="search",
+        type=str,
+        help="Folder of the ASHA searches: trial database, checkpoints and summary.",
+    )
+    parser.add_argument(
+        "--search_name",
+        default=None,
+        type=str,
+        help="Name of the ASHA search, <dataset>_<model> by default. Rerun to resume it.",
+    )
+    parser.add_argument(
+        "--search_workers",
+        default=1,
+        type=int,
+        help="Number of trials trained in parallel by the ASHA search.",
+    )
+    parser.add_argument(
+        "--min_epochs",
+        default=1,
+        type=int,
+        help="Epochs of the first rung of the ASHA search (the last one has --n_epochs).",
+    )
+    parser.add_argument(
+        "--eta",
+        default=3,
+        type=int,
+        help="Reduction factor of the ASHA search: the best 1/eta of a rung is promoted.",
+    )
     parser.add_argument(
         "--proj_name",
         default="",
@@ -202,9 +260,44 @@ def add_management_args(parser: ArgumentParser) -> None:
     """
     # random seed
     parser.add_argument("--seed", type=int, default=None, help="The random seed.")
+    parser.add_argument(
+        "--ensemble_seeds",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Train one copy of the model per seed in a single vectorized loop "
+        "(torch>=2.0), saving the best checkpoint of each seed.",
+    )
+    # distributed training, launched with torchrun
+    parser.add_argument(
+        "--dist_backend",
+        type=str,
+        default="gloo",
+        choices=["gloo", "nccl"],
+        help="Backend of the process group when launched with torchrun (gloo runs on CPU).",
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=None,
+        help="Torch CPU threads per process, defaults to 4 or to the cores split "
+        "among the processes of the node when launched with torchrun.",
+    )
     # verbosity
     parser.add_argument("--notes", type=str, default=None, help="Notes for this run.")
     parser.add_argument("--non_verbose", action="store_true")
+    parser.add_argument(
+        "--log_every",
+        type=int,
+        default=10,
+        help="Steps between two fetches of the training losses from the device.",
+    )
+    parser.add_argument(
+        "--debug_checks",
+        action="store_true",
+        default=False,
+        help="Run the checks on the loss values (they synchronize at every step).",
+    )
     # logging
     parser.add_argument(
         "--wandb",
@@ -212,6 +305,44 @@ def add_management_args(parser: ArgumentParser) -> None:
         default=None,
         help="Enable wandb logging -- set name of project",
     )
+    parser.add_argument(
+        "--logger",
+        type=str,
+        default=None,
+        choices=["wandb", "jsonl", "parquet", "none"],
+        help="Logging backend, defaults to wandb if enabled and to none otherwise",
+    )
+    parser.add_argument(
+        "--log_dir",
+        type=str,
+        default="logs",
+        help="Folder of the jsonl/parquet logs",
+    )
+    parser.add_argument(
+        "--log_interval",
+        type=float,
+        default=5.0,
+        help="Seconds between two writes of the buffered logs",
+    )
+    # profiling
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=False,
+        help="Time the phases of the training steps and print a summary at the end",
+    )
+    parser.add_argument(
+        "--profile_trace_steps",
+        type=int,
+        default=0,
+        help="With --profile, record a torch.profiler trace over this many steps",
+    )
+    parser.add_argument(
+        "--profile_dir",
+        type=str,
+        default="profile",
+        help="Output folder of the profile summary and traces",
+    )
     # checkpoints
     parser.add_argument(
         "--checkin",
@@ -238,6 +369,12 @@ def add_management_args(parser: ArgumentParser) -> None:
         default=False,
         help="Used to non-linear probe the model",
     )
+    parser.add_argument(
+        "--probe_batch_size",
+        type=int,
+        default=1024,
+        help="Batch size of the probe, trained on the cached representations",
+    )
     parser.add_argument(
         "--validate",
         action="store_true",
@@ -251,6 +388,12 @@ def add_management_args(parser: ArgumentParser) -> None:
         default=False,
         help="Used to preprocess dataset",
     )
+    parser.add_argument(
+        "--preprocess_amp",
+        action="store_true",
+        default=False,
+        help="Run the preprocessing encoder in mixed precision (bf16 on CPU, fp16 on GPU)",
+    )
 
 
 def add_test_args(parser: ArgumentParser) -> None:
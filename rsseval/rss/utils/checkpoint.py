@@ -1,6 +1,11 @@
 # Checkpoint module
 import torch
 import os
+import re
+import queue
+import shutil
+import threading
+import zipfile
 from utils.conf import create_path
 
 
@@ -109,3 +114,206 @@ def load_checkpoint(model, args, checkin=None):
     model.load_state_dict(torch.load(PATH))
 
     return model
+
+
+def _to_cpu(obj):
+    """Copy of a (nested) state on CPU, which the training can keep updating
+
+    Args:
+        obj: tensor, or dict, list, tuple of states
+
+    Returns:
+        obj: the state with its tensors copied on CPU
+    """
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, _to_cpu(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+def _checkpoint_pattern(prefix):
+    return re.compile(rf"^{re.escape(prefix)}_(\d+)\.pth\.tar$")
+
+
+def find_checkpoints(directory, prefix="checkpoint"):
+    """Complete epoch checkpoints of a folder, by epoch
+
+    Args:
+        directory (str): folder of the checkpoints
+        prefix (str, default="checkpoint"): checkpoints are <prefix>_<epoch>.pth.tar
+
+    Returns:
+        checkpoints (list): (epoch, path) of the checkpoints
+    """
+    if not os.path.isdir(directory):
+        return []
+    pattern = _checkpoint_pattern(prefix)
+    found = []
+    for name in os.listdir(directory):
+        match = pattern.match(name)
+        path = os.path.join(directory, name)
+        # torch.save writes a zip file, complete if its directory is there
+        if match and zipfile.is_zipfile(path):
+            found.append((int(match.group(1)), path))
+    return sorted(found)
+
+
+def latest_checkpoint(directory, prefix="checkpoint"):
+    """Last written complete checkpoint of a folder, None if there is none. The
+    modification time is used rather than the epoch, so that the checkpoints
+    left in the folder by an older and longer run are not picked up
+
+    Args:
+        directory (str): folder of the checkpoints
+        prefix (str, default="checkpoint"): checkpoints are <prefix>_<epoch>.pth.tar
+
+    Returns:
+        path (str): path of the checkpoint
+    """
+    checkpoints = find_checkpoints(directory, prefix)
+    if not checkpoints:
+        return None
+    return max(checkpoints, key=lambda c: (os.path.getmtime(c[1]), c[0]))[1]
+
+
+class AsyncCheckpointManager:
+    """Writes the checkpoints from a background thread: save snapshots the
+    state on CPU and returns, the thread writes it to a temporary file renamed
+    into place, so that a checkpoint file is always complete. The last
+    keep_last epoch checkpoints written by the manager (starting from the
+    resumed one) are kept, plus the best one, which is a hard link to its
+    epoch checkpoint when possible. Other files of the folder are never removed."""
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        directory=".",
+        prefix="checkpoint",
+        keep_last=1,
+        best_filename="model_best.pth.tar",
+        max_pending=2,
+        resume=None,
+    ):
+        """Initialize method
+
+        Args:
+            self: instance
+            directory (str, default="."): folder of the checkpoints
+            prefix (str, default="checkpoint"): checkpoints are <prefix>_<epoch>.pth.tar
+            keep_last (int, default=1): number of epoch checkpoints kept
+            best_filename (str, default="model_best.pth.tar"): name of the best checkpoint
+            max_pending (int, default=2): snapshots waiting for the writer before
+                save blocks, which bounds the memory of the snapshots
+            resume (str, default=None): checkpoint the run resumes from, rotated
+                out as the newer ones are written if it is one of this folder
+
+        Returns:
+            None: This function does not return a value.
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.keep_last = keep_last
+        self.best_path = os.path.join(directory, best_filename)
+        self.error = None
+
+        # checkpoints of this run, from the oldest to the newest
+        self.written = []
+        if resume and any(
+            os.path.samefile(resume, path)
+            for _, path in find_checkpoints(directory, prefix)
+        ):
+            self.written.append(resume)
+
+        os.makedirs(directory, exist_ok=True)
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def path(self, epoch) -> str:
+        """Path of the checkpoint of an epoch"""
+        return os.path.join(self.directory, f"{self.prefix}_{epoch:04d}.pth.tar")
+
+    def checkpoints(self):
+        """Complete checkpoints of the folder, see find_checkpoints"""
+        return find_checkpoints(self.directory, self.prefix)
+
+    def latest(self):
+        """Last written complete checkpoint of the folder, see latest_checkpoint"""
+        return latest_checkpoint(self.directory, self.prefix)
+
+    def save(self, state, epoch, is_best=False) -> None:
+        """Snapshots the state on CPU and queues it for writing
+
+        Args:
+            self: instance
+            state (dict): checkpoint, e.g. model, optimizer and scaler states
+            epoch (int): epoch of the checkpoint
+            is_best (bool, default=False): whether it is the best checkpoint
+
+        Returns:
+            None: This function does not return a value.
+        """
+        if self.error is not None:
+            return
+        self.queue.put((_to_cpu(state), epoch, is_best))
+
+    def _write(self, state, epoch, is_best) -> None:
+        path = self.path(epoch)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            torch.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+        if is_best:
+            tmp = self.best_path + ".tmp"
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            try:
+                os.link(path, tmp)
+            except OSError:
+                shutil.copyfile(path, tmp)
+            os.replace(tmp, self.best_path)
+
+        # rotation of the checkpoints of this run, the best one is a separate file
+        if path in self.written:
+            self.written.remove(path)
+        self.written.append(path)
+        while len(self.written) > self.keep_last:
+            old = self.written.pop(0)
+            if os.path.exists(old):
+                os.remove(old)
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is self._STOP:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self._write(*item)
+            except Exception as e:
+                # the training goes on, close raises the error
+                self.error = e
+                print(f"Checkpoint writer failed, checkpointing disabled: {e}")
+
+    def close(self) -> None:
+        """Writes the pending checkpoints and stops the writing thread
+
+        Args:
+            self: instance
+
+        Returns:
+            None: This function does not return a value.
+        """
+        if self.thread.is_alive():
+            self.queue.put(self._STOP)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
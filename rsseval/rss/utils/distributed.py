@@ -0,0 +1,304 @@
+# Module which contains the data-parallel training helpers
+#
+# main.py runs in distributed mode when launched by torchrun with more than one
+# process (WORLD_SIZE > 1), e.g. on a single box with 4 processes:
+#
+#   torchrun --standalone --nproc_per_node 4 main.py --dataset kandinsky ...
+#
+# The gloo backend works on CPU-only machines. The training batches are sharded
+# with a DistributedSampler, the gradients are averaged by DistributedDataParallel
+# and the evaluation metrics are reduced over the ranks. Only rank 0 prints,
+# logs and writes checkpoints.
+import os
+import math
+import builtins
+
+import torch
+import torch.distributed as dist
+from torch.utils.data import DataLoader, Sampler
+from torch.utils.data.distributed import DistributedSampler
+
+
+def is_distributed() -> bool:
+    """Whether the process group is initialized with more than one process
+
+    Returns:
+        distributed (bool): distributed mode
+    """
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+
+def get_rank() -> int:
+    """Rank of the process, 0 when not distributed
+
+    Returns:
+        rank (int): rank
+    """
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    """Number of processes, 1 when not distributed
+
+    Returns:
+        world_size (int): world size
+    """
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process() -> bool:
+    """Whether the process is rank 0, which prints, logs and saves
+
+    Returns:
+        main (bool): rank 0
+    """
+    return get_rank() == 0
+
+
+def barrier() -> None:
+    """Waits for all the ranks, no-op when not distributed
+
+    Returns:
+        None: This function does not return a value.
+    """
+    if is_distributed():
+        dist.barrier()
+
+
+def init_distributed(args) -> None:
+    """Initializes the process group from the torchrun environment variables and
+    sets the number of CPU threads of the process. Without torchrun (or with a
+    single process) nothing is initialized
+
+    Args:
+        args: command line arguments
+
+    Returns:
+        None: This function does not return a value.
+    """
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+
+    if args.num_threads is not None:
+        threads = args.num_threads
+    elif world_size > 1:
+        # the cores of the box are split among its processes
+        threads = max(1, (os.cpu_count() or 1) // local_world_size)
+    else:
+        threads = 4
+    torch.set_num_threads(threads)
+
+    if world_size <= 1:
+        return
+
+    local_rank = int(os.environ.get("LOCAL_RANK", 0))
+    if torch.cuda.is_available():
+        # the models pick up the current device with get_device
+        torch.cuda.set_device(local_rank % torch.cuda.device_count())
+    dist.init_process_group(backend=args.dist_backend, init_method="env://")
+
+    # suppress printing if not rank 0
+    if dist.get_rank() != 0:
+
+        def print_pass(*args, **kwargs):
+            pass
+
+        builtins.print = print_pass
+
+
+def cleanup_distributed() -> None:
+    """Destroys the process group, if any
+
+    Returns:
+        None: This function does not return a value.
+    """
+    if is_distributed():
+        dist.barrier()
+        dist.destroy_process_group()
+
+
+class ShardSampler(Sampler):
+    """Contiguous and unpadded shard of the indices of a dataset: each sample is
+    seen by exactly one rank and gathering the shards in rank order restores the
+    order of the dataset. Used for the evaluation loaders"""
+
+    def __init__(self, dataset, num_replicas=None, rank=None):
+        """Initialize method
+
+        Args:
+            self: instance
+            dataset: dataset
+            num_replicas (int, default=None): number of shards, the world size by default
+            rank (int, default=None): shard of this process, the rank by default
+
+        Returns:
+            None: This function does not return a value.
+        """
+        num_replicas = get_world_size() if num_replicas is None else num_replicas
+        rank = get_rank() if rank is None else rank
+        n = len(dataset)
+        per_rank = math.ceil(n / num_replicas)
+        self.start = min(rank * per_rank, n)
+        self.end = min(self.start + per_rank, n)
+
+    def __iter__(self):
+        return iter(range(self.start, self.end))
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+
+def distributed_sampler(dataset, shuffle, drop_last=False, train=None):
+    """Sampler of the shard of this rank: training loaders get a DistributedSampler,
+    whose shards have the same length on all the ranks, evaluation loaders get a
+    ShardSampler
+
+    Args:
+        dataset: dataset
+        shuffle (bool): whether the loader shuffles
+        drop_last (bool, default=False): whether the loader drops the last batch
+        train (bool, default=None): training loader, by default the shuffled ones
+
+    Returns:
+        sampler: sampler, None when not distributed
+    """
+    if not is_distributed():
+        return None
+    if train is None:
+        train = shuffle
+    if train:
+        return DistributedSampler(dataset, shuffle=shuffle, drop_last=drop_last)
+    return ShardSampler(dataset)
+
+
+def set_sampler_epoch(loader, epoch) -> None:
+    """Reseeds the shuffling of the distributed sampler of a loader
+
+    Args:
+        loader: data loader
+        epoch (int): epoch
+
+    Returns:
+        None: This function does not return a value.
+    """
+    sampler = getattr(loader, "sampler", None)
+    if hasattr(sampler, "set_epoch"):
+        sampler.set_epoch(epoch)
+
+
+def full_loader(loader):
+    """Unsharded, ordered loader over the dataset of a loader, for the outputs
+    written by rank 0 alone (e.g. the csv of the predictions)
+
+    Args:
+        loader: data loader
+
+    Returns:
+        loader: the loader itself when not distributed
+    """
+    if not is_distributed():
+        return loader
+    return DataLoader(loader.dataset, batch_size=loader.batch_size, shuffle=False)
+
+
+def wrap_model(model, args):
+    """Forward of the model wrapped with DistributedDataParallel, which averages
+    the gradients over the ranks during backward. The model itself is left
+    untouched, so that its attributes, optimizer and state dict keys are the same
+
+    Args:
+        model: network
+        args: command line arguments
+
+    Returns:
+        forward: forward function of the model
+    """
+    if not is_distributed():
+        return model
+    device_ids = None
+    if torch.device(model.device).type == "cuda":
+        device_ids = [torch.cuda.current_device()]
+    # the models often leave heads of the backbones unused (e.g. the logvar of the encoders)
+    return torch.nn.parallel.DistributedDataParallel(
+        model, device_ids=device_ids, find_unused_parameters=True
+    )
+
+
+def _comm_device():
+    return torch.device("cuda") if dist.get_backend() == "nccl" else torch.device("cpu")
+
+
+def all_reduce_sum(values):
+    """Sums python numbers over the ranks
+
+    Args:
+        values (list): numbers
+
+    Returns:
+        values (list): sums over the ranks, the values themselves when not distributed
+    """
+    if not is_distributed():
+        return values
+    t = torch.tensor([float(v) for v in values], dtype=torch.float64, device=_comm_device())
+    dist.all_reduce(t, op=dist.ReduceOp.SUM)
+    return t.tolist()
+
+
+@torch.no_grad()
+def all_reduce_grads(params) -> None:
+    """Averages the gradients of the parameters over the ranks, in place. Used
+    where the model is not wrapped in DistributedDataParallel (e.g. the stacked
+    parameters of the ensembles)
+
+    Args:
+        params: tensors whose .grad is averaged
+
+    Returns:
+        None: This function does not return a value.
+    """
+    if not is_distributed():
+        return
+    world_size = get_world_size()
+    for p in params:
+        if p.grad is not None:
+            dist.all_reduce(p.grad, op=dist.ReduceOp.SUM)
+            p.grad.div_(world_size)
+
+
+@torch.no_grad()
+def broadcast_tensors(tensors, src=0) -> None:
+    """Copies the tensors of rank src to all the ranks, in place, as
+    DistributedDataParallel does with the buffers
+
+    Args:
+        tensors: tensors to broadcast
+        src (int, default=0): source rank
+
+    Returns:
+        None: This function does not return a value.
+    """
+    if not is_distributed():
+        return
+    for t in tensors:
+        dist.broadcast(t, src=src)
+
+
+def gather_arrays(*arrays):
+    """Concatenates the arrays of all the ranks along the first axis, in rank order
+
+    Args:
+        arrays: numpy arrays of this rank
+
+    Returns:
+        arrays (list): concatenated arrays, the arrays themselves when not distributed
+    """
+    import numpy as np
+
+    if not is_distributed():
+        return list(arrays)
+    gathered = [None] * get_world_size()
+    dist.all_gather_object(gathered, list(arrays))
+    return [
+        np.concatenate([g[i] for g in gathered if len(g[i]) > 0], axis=0)
+        for i in range(len(arrays))
+    ]
@@ -0,0 +1,132 @@
+# Module which contains the vectorized multi-seed training helpers (--ensemble_seeds)
+#
+# The copies of a model, each initialised with its own seed, are trained in a
+# single process: their parameters and buffers are stacked along a new leading
+# dimension and the forward and the loss of all the copies run as one vmap-ed
+# call on the shared batches. An element-wise optimizer (Adam, SGD, ...) over
+# the stacked parameters keeps an independent state for each seed.
+import copy
+import torch
+
+from utils import fprint
+
+
+def _func():
+    """torch.func, which requires torch>=2.0
+
+    Returns:
+        func: the torch.func module
+    """
+    try:
+        import torch.func as func
+    except ImportError:
+        raise RuntimeError("Ensemble training requires torch>=2.0 (torch.func)")
+    return func
+
+
+def stack_models(models, device):
+    """Stacks the parameters and the buffers of the copies of a model
+
+    Args:
+        models (list): copies of the same network
+        device: device of the stacked tensors
+
+    Returns:
+        params (dict): name -> (n_models, ...) leaf parameters
+        buffers (dict): name -> (n_models, ...) buffers
+    """
+    params, buffers = _func().stack_module_state(models)
+    params = {
+        k: v.detach().to(device).requires_grad_(True) for k, v in params.items()
+    }
+    buffers = {k: v.to(device) for k, v in buffers.items()}
+    return params, buffers
+
+
+@torch.no_grad()
+def unstack_models(models, params, buffers) -> None:
+    """Copies the stacked parameters and buffers back into the copies
+
+    Args:
+        models (list): copies of the network
+        params (dict): stacked parameters
+        buffers (dict): stacked buffers
+
+    Returns:
+        None: This function does not return a value.
+    """
+    for i, model in enumerate(models):
+        for name, tensor in model.named_parameters():
+            tensor.copy_(params[name][i])
+        for name, tensor in model.named_buffers():
+            if name in buffers:
+                tensor.copy_(buffers[name][i])
+
+
+def ensemble_optimizer(model, params):
+    """Optimizer of the stacked parameters, with the class and the
+    hyper-parameters of the optimizer of the model. The state is independent
+    for each seed only for element-wise optimizers
+
+    Args:
+        model: network with its optimizer (model.opt)
+        params (dict): stacked parameters
+
+    Returns:
+        opt (torch.optim.Optimizer): optimizer
+    """
+    return type(model.opt)(list(params.values()), **model.opt.defaults)
+
+
+def ensemble_step(base, params, buffers, _loss, images, labels, concepts, args):
+    """Forward and loss of all the copies on a shared batch
+
+    Args:
+        base: one of the copies, whose parameters are replaced by the stacked ones
+        params (dict): stacked parameters
+        buffers (dict): stacked buffers
+        _loss: loss function
+        images (torch.tensor): inputs
+        labels (torch.tensor): labels
+        concepts (torch.tensor): concepts
+        args: command line arguments
+
+    Returns:
+        loss (torch.tensor): (n_models,) loss of each copy
+        ys (torch.tensor): (n_models, batch_size, ...) predictions of each copy
+    """
+    func = _func()
+
+    def member(p, b):
+        out_dict = func.functional_call(base, (p, b), (images,))
+        out_dict.update({"LABELS": labels, "CONCEPTS": concepts})
+        loss, _ = _loss(out_dict, args)
+        return loss, out_dict["YS"]
+
+    # dropout masks are drawn independently for each copy
+    return func.vmap(member, randomness="different")(params, buffers)
+
+
+def init_models(build, seeds, args):
+    """Builds one copy of a model per seed, with its optimizer
+
+    Args:
+        build: function without arguments returning a new model
+        seeds (list): seeds of the copies
+        args: command line arguments
+
+    Returns:
+        models (list): copies, initialised with their seed
+    """
+    from utils.conf import set_random_seed
+
+    models = []
+    for seed in seeds:
+        set_random_seed(seed)
+        # the copy separates the modules that the backbones may share
+        # between instances (e.g. the MoCo encoder of Kandinsky)
+        model = copy.deepcopy(build())
+        model.start_optim(args)
+        models.append(model)
+    fprint(f"Initialised {len(models)} copies for the seeds {list(seeds)}")
+    return models
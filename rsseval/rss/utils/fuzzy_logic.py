@@ -0,0 +1,103 @@
+# Module which contains the tensor evaluator of the LTN formulas
+#
+# The LTN losses are fixed formulas over the concept probabilities: instead of
+# building ltn.Variable/Predicate objects and grounding them at every call, the
+# rules are written once as tensor programs over the whole batch. The fuzzy
+# operators (t-norms, implications, p-mean quantifiers) are the ones of the
+# ltn.Connective and ltn.Quantifier objects built by the models, called on
+# plain tensors, so that the truth values are the same of the LTN grounding.
+import torch
+
+
+class FuzzyLogic:
+    """Tensor versions of the LTN connectives and quantifiers given by the
+    model (any of them can be None, when the formula does not use it)"""
+
+    def __init__(
+        self, And=None, Or=None, Not=None, Implies=None, Equiv=None, Forall=None, Exists=None
+    ) -> None:
+        """Initialize method
+
+        Args:
+            self: instance
+            And (ltn.Connective, default=None): conjunction
+            Or (ltn.Connective, default=None): disjunction
+            Not (ltn.Connective, default=None): negation
+            Implies (ltn.Connective, default=None): implication
+            Equiv (ltn.Connective, default=None): equivalence
+            Forall (ltn.Quantifier, default=None): universal quantifier
+            Exists (ltn.Quantifier, default=None): existential quantifier
+
+        Returns:
+            None: This function does not return a value.
+        """
+        op = lambda c: None if c is None else c.connective_op
+        self.and_ = op(And)
+        self.or_ = op(Or)
+        self.not_ = op(Not)
+        self.implies = op(Implies)
+        self.equiv = op(Equiv)
+        self.forall_op = None if Forall is None else Forall.agg_op
+        self.exists_op = None if Exists is None else Exists.agg_op
+
+    def all(self, *xs):
+        """Right-nested conjunction And(x0, And(x1, ...)), as written in the rules
+
+        Args:
+            self: instance
+            xs: truth values
+
+        Returns:
+            value (torch.tensor): truth value
+        """
+        value = xs[-1]
+        for x in reversed(xs[:-1]):
+            value = self.and_(x, value)
+        return value
+
+    def any(self, *xs):
+        """Right-nested disjunction Or(x0, Or(x1, ...)), as written in the rules
+
+        Args:
+            self: instance
+            xs: truth values
+
+        Returns:
+            value (torch.tensor): truth value
+        """
+        value = xs[-1]
+        for x in reversed(xs[:-1]):
+            value = self.or_(x, value)
+        return value
+
+    def forall(self, x, p=None):
+        """Universal quantification over the batch (first) dimension
+
+        Args:
+            self: instance
+            x (torch.tensor): truth values of the samples
+            p (int, default=None): grade of the p-mean, the one of the quantifier by default
+
+        Returns:
+            value (torch.tensor): truth value
+        """
+        kwargs = {} if p is None else {"p": p}
+        return self.forall_op(x, dim=(0,), **kwargs)
+
+    def exists(self, x, dim, mask, p=None):
+        """Guarded existential quantification: the p-mean over the entries of
+        dim where the mask holds, false if it never holds (as in LTN)
+
+        Args:
+            self: instance
+            x (torch.tensor): truth values
+            dim (tuple): quantified dimensions
+            mask (torch.tensor): guard, with the shape of x
+            p (int, default=None): grade of the p-mean, the one of the quantifier by default
+
+        Returns:
+            value (torch.tensor): truth values, in double precision as in LTN
+        """
+        kwargs = {} if p is None else {"p": p}
+        value = self.exists_op(x, dim, mask=mask, **kwargs)
+        return torch.where(torch.isnan(value), 0.0, value.double())
@@ -2,6 +2,13 @@
 import ltn
 import torch
 
+from utils.fuzzy_logic import FuzzyLogic
+
+# values of the concept of the 3 objects of a figure in the conjunctions of the
+# rules: all the same value (SAME) or all different values (DIFF)
+SAME_TERMS = [[0, 0, 0], [1, 1, 1], [2, 2, 2]]
+DIFF_TERMS = [[0, 1, 2], [0, 2, 1], [1, 0, 2], [1, 2, 0], [2, 1, 0], [2, 0, 1]]
+
 
 class KAND_SAT_AGG(torch.nn.Module):
     def __init__(self, And, Or, Not, Forall, Equiv) -> None:
@@ -13,6 +20,9 @@ class KAND_SAT_AGG(torch.nn.Module):
         self.Forall = Forall
         self.Equiv = Equiv
         self.SatAgg = ltn.fuzzy_ops.SatAgg()
+        self.logic = FuzzyLogic(And=And, Or=Or, Not=Not, Equiv=Equiv, Forall=Forall)
+        self.register_buffer("same_terms", torch.tensor(SAME_TERMS), persistent=False)
+        self.register_buffer("diff_terms", torch.tensor(DIFF_TERMS), persistent=False)
 
     def forward(self, out_dict, args, b_idx=None):
         # load from dict
@@ -29,172 +39,62 @@ class KAND_SAT_AGG(torch.nn.Module):
 
         return sat_loss
 
-    def KANDsat_agg_loss(self, shapes, colors, conc_preds, labels, args, b_idx):
-        args.print = False
-        f1_s = ltn.Variable("f1_s", shapes[:, 0])
-        f2_s = ltn.Variable("f2_s", shapes[:, 1])
-        f3_s = ltn.Variable("f3_s", shapes[:, 2])
-        f1_c = ltn.Variable("f1_c", colors[:, 0])
-        f2_c = ltn.Variable("f2_c", colors[:, 1])
-        f3_c = ltn.Variable("f3_c", colors[:, 2])
-        l0 = ltn.Constant(torch.tensor(0))
-        l1 = ltn.Constant(torch.tensor(1))
-        l2 = ltn.Constant(torch.tensor(2))
-        res = ltn.Variable("res", labels, add_batch_dim=False)
-
-        get_obj = ltn.Function(func=lambda fig, o_idx: fig[:, o_idx[0]])
-        get_conc = ltn.Predicate(func=lambda obj, c_idx: obj[:, c_idx[0]])
+    def conjunctions(self, figs, terms):
+        """Truth values of the conjunctions And(And(o0 = v0, o1 = v1), o2 = v2)
+        of the objects of the figures, for each row (v0, v1, v2) of terms
 
-        if args.c_sup_ltn:
-            square = ltn.Variable("square", conc_preds[0][:, :3])
-            not_square = ltn.Variable("not_square", conc_preds[1][:, :3])
-            red = ltn.Variable("red", conc_preds[2][:, 3:])
-            not_red = ltn.Variable("not_red", conc_preds[3][:, 3:])
-            phi1 = self.Forall(square, get_conc(square, l0), p=2)
-            phi2 = self.Forall(red, get_conc(red, l0), p=2)
-            phi3 = self.Forall(not_square, self.Not(get_conc(not_square, l0)), p=2)
-            phi4 = self.Forall(not_red, self.Not(get_conc(not_red, l0)), p=2)
-
-        # SAME concept
-
-        and_0 = lambda f: self.And(
-            self.And(get_conc(get_obj(f, l0), l0), get_conc(get_obj(f, l1), l0)),
-            get_conc(get_obj(f, l2), l0),
-        )
-
-        and_1 = lambda f: self.And(
-            self.And(get_conc(get_obj(f, l0), l1), get_conc(get_obj(f, l1), l1)),
-            get_conc(get_obj(f, l2), l1),
-        )
-
-        and_2 = lambda f: self.And(
-            self.And(get_conc(get_obj(f, l0), l2), get_conc(get_obj(f, l1), l2)),
-            get_conc(get_obj(f, l2), l2),
-        )
-
-        def same(f, concept_type):
-            value = self.Or(self.Or(and_0(f), and_1(f)), and_2(f))
-            if args.print:
-                print("same for %s: " % (concept_type,) + str(value))
-            return value
-
-        # DIFF concept
-
-        _and_0 = lambda f: self.And(
-            self.And(get_conc(get_obj(f, l0), l0), get_conc(get_obj(f, l1), l1)),
-            get_conc(get_obj(f, l2), l2),
-        )
-
-        _and_1 = lambda f: self.And(
-            self.And(get_conc(get_obj(f, l0), l0), get_conc(get_obj(f, l1), l2)),
-            get_conc(get_obj(f, l2), l1),
-        )
-
-        _and_2 = lambda f: self.And(
-            self.And(get_conc(get_obj(f, l0), l1), get_conc(get_obj(f, l1), l0)),
-            get_conc(get_obj(f, l2), l2),
-        )
-
-        _and_3 = lambda f: self.And(
-            self.And(get_conc(get_obj(f, l0), l1), get_conc(get_obj(f, l1), l2)),
-            get_conc(get_obj(f, l2), l0),
-        )
-
-        _and_4 = lambda f: self.And(
-            self.And(get_conc(get_obj(f, l0), l2), get_conc(get_obj(f, l1), l1)),
-            get_conc(get_obj(f, l2), l0),
-        )
-
-        _and_5 = lambda f: self.And(
-            self.And(get_conc(get_obj(f, l0), l2), get_conc(get_obj(f, l1), l0)),
-            get_conc(get_obj(f, l2), l1),
-        )
-
-        def diff(f, concept_type):
-            value = self.Or(
-                _and_0(f),
-                self.Or(
-                    _and_1(f),
-                    self.Or(
-                        _and_2(f), self.Or(_and_3(f), self.Or(_and_4(f), _and_5(f)))
-                    ),
-                ),
-            )
-            if args.print:
-                print("diff for %s: " % (concept_type,) + str(value))
-            return value
+        Args:
+            self: instance
+            figs (torch.tensor): (..., 3 objects, 3 values) concept probabilities
+            terms (torch.tensor): (n_terms, 3) values of the objects
 
-        # PAIR concept
+        Returns:
+            values (torch.tensor): (..., n_terms) truth values
+        """
+        objs = [figs[..., o, :][..., terms[:, o].to(figs.device)] for o in range(3)]
+        return self.logic.and_(self.logic.and_(objs[0], objs[1]), objs[2])
 
-        def pair(f, concept_type):
-            value = self.And(
-                self.Not(same(f, concept_type)), self.Not(diff(f, concept_type))
-            )
-            if args.print:
-                print("pair for %s: " % (concept_type,) + str(value))
-            return value
+    def KANDsat_agg_loss(self, shapes, colors, conc_preds, labels, args, b_idx):
+        logic = self.logic
 
-        # final formulas
+        if args.c_sup_ltn:
+            square = conc_preds[0][:, 0]
+            red = conc_preds[2][:, 3]
+            not_square = conc_preds[1][:, 0]
+            not_red = conc_preds[3][:, 3]
+            phi1 = logic.forall(square, p=2)
+            phi2 = logic.forall(red, p=2)
+            phi3 = logic.forall(logic.not_(not_square), p=2)
+            phi4 = logic.forall(logic.not_(not_red), p=2)
+
+        # (batch, shape/color, figure, object, value), all the figures at once
+        figs = torch.stack([shapes, colors], dim=1)
+
+        # SAME concept: Or(Or(and_0, and_1), and_2)
+        s = self.conjunctions(figs, self.same_terms)
+        same = logic.or_(logic.or_(s[..., 0], s[..., 1]), s[..., 2])
+
+        # DIFF concept: Or(_and_0, Or(_and_1, ...))
+        d = self.conjunctions(figs, self.diff_terms)
+        diff = logic.any(*d.unbind(-1))
 
-        # inner formula
+        # PAIR concept
+        pair = logic.and_(logic.not_(same), logic.not_(diff))
 
-        def and_same(f1, f2, f3, concept_type):
-            value = self.And(
-                same(f1, concept_type),
-                self.And(same(f2, concept_type), same(f3, concept_type)),
-            )
-            if args.print:
-                print("and_same for %s: " % (concept_type,) + str(value))
-            return value
-
-        def and_pair(f1, f2, f3, concept_type):
-            value = self.And(
-                pair(f1, concept_type),
-                self.And(pair(f2, concept_type), pair(f3, concept_type)),
-            )
-            if args.print:
-                print("and_pair for %s: " % (concept_type,) + str(value))
-            return value
-
-        def and_diff(f1, f2, f3, concept_type):
-            value = self.And(
-                diff(f1, concept_type),
-                self.And(diff(f2, concept_type), diff(f3, concept_type)),
-            )
-            if args.print:
-                print("and_diff for %s: " % (concept_type,) + str(value))
-            return value
-
-        def or_formula(f1, f2, f3, concept_type):
-            value = self.Or(
-                and_same(f1, f2, f3, concept_type),
-                self.Or(
-                    and_pair(f1, f2, f3, concept_type),
-                    and_diff(f1, f2, f3, concept_type),
-                ),
-            )
-            if args.print:
-                print("or_formula for %s: " % (concept_type,) + str(value))
-            return value
-
-        def final_formula(f1_s, f2_s, f3_s, f1_c, f2_c, f3_c):
-            value = self.Or(
-                or_formula(f1_s, f2_s, f3_s, "shape"),
-                or_formula(f1_c, f2_c, f3_c, "color"),
-            )
-            if args.print:
-                print("final_formula: " + str(value))
-            return value
+        # final formulas: And(f1, And(f2, f3)) over the figures, Or over the patterns,
+        # Or over shape and color
+        and_same = logic.all(*same.unbind(-1))
+        and_pair = logic.all(*pair.unbind(-1))
+        and_diff = logic.all(*diff.unbind(-1))
+        or_formula = logic.any(and_same, and_pair, and_diff)
+        final_formula = logic.or_(or_formula[:, 0], or_formula[:, 1])
 
-        phi5 = self.Forall(
-            ltn.diag(f1_s, f2_s, f3_s, f1_c, f2_c, f3_c, res),
-            self.Equiv(final_formula(f1_s, f2_s, f3_s, f1_c, f2_c, f3_c), res),
-        )
+        phi5 = logic.forall(logic.equiv(final_formula, labels))
 
         if args.c_sup_ltn:
             sat_agg = self.SatAgg(phi1, phi2, phi3, phi4, phi5)
         else:
-            sat_agg = phi5.value
+            sat_agg = phi5
 
         if b_idx == 0 and args.c_sup_ltn:
             print("Square: " + str(phi1))
@@ -204,7 +104,4 @@ class KAND_SAT_AGG(torch.nn.Module):
             print("Formula: " + str(phi5))
             print("\n")
 
-        if args.print:
-            print("sat agg value: " + str(sat_agg))
-
         return 1 - sat_agg, None
@@ -0,0 +1,354 @@
+# Module which contains the buffered, asynchronous experiment logger
+#
+# The training thread only enqueues the metrics: a background thread batches
+# them and writes them to the selected backend (wandb, local JSONL/Parquet
+# files or nothing) every `flush_interval` seconds. A slow or failing backend
+# never blocks the training loop, at worst metrics are dropped.
+import os
+import json
+import time
+import queue
+import threading
+
+from utils.distributed import is_main_process
+
+
+class LoggerBackend:
+    """Interface of the logging backends: receives batches of records, each a
+    dictionary of metrics, in logging order"""
+
+    def write(self, records) -> None:
+        """Writes a batch of records
+
+        Args:
+            self: instance
+            records (list): list of dictionaries of metrics
+
+        Returns:
+            None: This function does not return a value.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Releases the resources of the backend
+
+        Args:
+            self: instance
+
+        Returns:
+            None: This function does not return a value.
+        """
+        pass
+
+
+class NullBackend(LoggerBackend):
+    """Discards everything"""
+
+    def write(self, records) -> None:
+        pass
+
+
+class WandbBackend(LoggerBackend):
+    """Logs on the current wandb run, consecutive records with the same step
+    are merged into a single wandb.log call"""
+
+    def __init__(self):
+        import wandb
+
+        self.wandb = wandb
+
+    def write(self, records) -> None:
+        merged = []
+        for record in records:
+            step = record.get("step")
+            if merged and step is not None and merged[-1].get("step") == step:
+                merged[-1].update(record)
+            else:
+                merged.append(dict(record))
+        for record in merged:
+            self.wandb.log(record)
+
+
+class JSONLBackend(LoggerBackend):
+    """Appends one json line per record to a local file"""
+
+    def __init__(self, path: str):
+        """Initialize method
+
+        Args:
+            self: instance
+            path (str): path of the jsonl file
+
+        Returns:
+            None: This function does not return a value.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.file = open(path, "a")
+
+    def write(self, records) -> None:
+        for record in records:
+            self.file.write(json.dumps(record, default=str) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetBackend(LoggerBackend):
+    """Writes each batch of records as a parquet part file in a folder
+    (requires pandas and pyarrow)"""
+
+    def __init__(self, path: str):
+        """Initialize method
+
+        Args:
+            self: instance
+            path (str): folder of the part files
+
+        Returns:
+            None: This function does not return a value.
+        """
+        import pandas as pd
+        import pyarrow  # noqa: F401, fail early if the engine is missing
+
+        os.makedirs(path, exist_ok=True)
+        self.pd = pd
+        self.path = path
+        self.part = len([f for f in os.listdir(path) if f.endswith(".parquet")])
+
+    def write(self, records) -> None:
+        scalars = [
+            {k: v for k, v in r.items() if isinstance(v, (int, float, str, bool))}
+            for r in records
+        ]
+        self.pd.DataFrame(scalars).to_parquet(
+            os.path.join(self.path, f"part-{self.part:05d}.parquet")
+        )
+        self.part += 1
+
+
+class TensorBoardBackend(LoggerBackend):
+    """Writes the scalars of each record as TensorBoard summaries, at the
+    global step given by the "step" entry of the record"""
+
+    def __init__(self, log_dir=None):
+        """Initialize method
+
+        Args:
+            self: instance
+            log_dir (str, default=None): TensorBoard folder, defaults to runs/
+
+        Returns:
+            None: This function does not return a value.
+        """
+        from torch.utils.tensorboard import SummaryWriter
+
+        self.writer = SummaryWriter(log_dir)
+
+    def write(self, records) -> None:
+        for record in records:
+            step = record.get("step")
+            for k, v in record.items():
+                if k != "step" and isinstance(v, (int, float)):
+                    self.writer.add_scalar(k, v, step)
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def _to_python(value):
+    """Converts tensors and numpy scalars to python numbers. Runs in the logging
+    thread, so that the training thread never waits for the device
+
+    Args:
+        value: metric value
+
+    Returns:
+        value: python value
+    """
+    if hasattr(value, "item") and getattr(value, "ndim", 1) == 0:
+        return value.item()
+    return value
+
+
+class AsyncLogger:
+    """Buffers the metrics and writes them to a backend from a background thread"""
+
+    _STOP = object()
+
+    def __init__(self, backend: LoggerBackend, flush_interval=5.0, max_queue=100000):
+        """Initialize method
+
+        Args:
+            self: instance
+            backend (LoggerBackend): where to write the metrics
+            flush_interval (float, default=5.0): seconds between two writes
+            max_queue (int, default=100000): records kept before dropping new ones
+
+        Returns:
+            None: This function does not return a value.
+        """
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.failed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def log(self, metrics: dict, step=None) -> None:
+        """Enqueues a record, never blocks
+
+        Args:
+            self: instance
+            metrics (dict): metrics, values can be python numbers or tensors
+            step (int, default=None): step of the record
+
+        Returns:
+            None: This function does not return a value.
+        """
+        record = dict(metrics)
+        if step is not None:
+            record["step"] = step
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self, records) -> None:
+        if len(records) == 0 or self.failed:
+            return
+        try:
+            self.backend.write(
+                [{k: _to_python(v) for k, v in r.items()} for r in records]
+            )
+        except Exception as e:
+            # an unavailable backend must not stop the training
+            self.failed = True
+            print(f"Logger backend {type(self.backend).__name__} failed, logging disabled: {e}")
+
+    def _run(self) -> None:
+        buffer, last_flush = [], time.time()
+        while True:
+            timeout = max(self.flush_interval - (time.time() - last_flush), 0.01)
+            try:
+                record = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                record = None
+
+            if record is self._STOP:
+                self._write(buffer)
+                return
+            if record is not None:
+                buffer.append(record)
+
+            if time.time() - last_flush >= self.flush_interval:
+                self._write(buffer)
+                buffer, last_flush = [], time.time()
+
+    def close(self) -> None:
+        """Writes the pending records and stops the logging thread
+
+        Args:
+            self: instance
+
+        Returns:
+            None: This function does not return a value.
+        """
+        if not self.thread.is_alive():
+            return
+        self.queue.put(self._STOP)
+        self.thread.join()
+        self.backend.close()
+        if self.dropped > 0:
+            print(f"Logger queue full, {self.dropped} records dropped")
+
+
+def make_backend(name: str, log_dir="logs", run_name="run") -> LoggerBackend:
+    """Builds a backend by name
+
+    Args:
+        name (str): "wandb", "jsonl", "parquet", "tensorboard" or "none"
+        log_dir (str, default="logs"): folder of the local sinks
+        run_name (str, default="run"): name of the local files
+
+    Returns:
+        backend (LoggerBackend): backend
+    """
+    if name == "wandb":
+        return WandbBackend()
+    elif name == "jsonl":
+        return JSONLBackend(os.path.join(log_dir, run_name + ".jsonl"))
+    elif name == "parquet":
+        return ParquetBackend(os.path.join(log_dir, run_name))
+    elif name == "tensorboard":
+        return TensorBoardBackend(os.path.join(log_dir, run_name))
+    elif name == "none":
+        return NullBackend()
+    raise NotImplementedError(f"Unknown logger backend {name}")
+
+
+def logger_from_args(args, run_name="run") -> AsyncLogger:
+    """Builds the logger of a run from the command line arguments. Without
+    --logger, wandb is used when enabled (--wandb, or tuning) and nothing otherwise.
+    In distributed mode only rank 0 logs
+
+    Args:
+        args: command line arguments
+        run_name (str, default="run"): name of the local files
+
+    Returns:
+        logger (AsyncLogger): logger
+    """
+    if not is_main_process():
+        return AsyncLogger(NullBackend())
+    name = args.logger
+    if name is None:
+        name = "wandb" if args.tuning or args.wandb is not None else "none"
+    return AsyncLogger(make_backend(name, args.log_dir, run_name), args.log_interval)
+
+
+# logger of the current run, used by the helpers of utils.wandb_logger
+_LOGGER = None
+
+
+def get_logger() -> AsyncLogger:
+    """Logger of the current run, a no-op logger if none was set
+
+    Returns:
+        logger (AsyncLogger): current logger
+    """
+    global _LOGGER
+    if _LOGGER is None:
+        _LOGGER = AsyncLogger(NullBackend())
+    return _LOGGER
+
+
+def set_logger(logger: AsyncLogger) -> AsyncLogger:
+    """Sets the logger of the current run, closing the previous one
+
+    Args:
+        logger (AsyncLogger): new logger
+
+    Returns:
+        logger (AsyncLogger): the new logger
+    """
+    global _LOGGER
+    if _LOGGER is not None:
+        _LOGGER.close()
+    _LOGGER = logger
+    return logger
+
+
+def close_logger() -> None:
+    """Flushes and closes the logger of the current run
+
+    Returns:
+        None: This function does not return a value.
+    """
+    global _LOGGER
+    if _LOGGER is not None:
+        _LOGGER.close()
+    _LOGGER = None
@@ -4,6 +4,69 @@ import numpy as np
 import torch.nn.functional as F
 
 
+# Checks on the loss values (and the related prints) force a device->host
+# synchronization at every step, hence they only run when enabled (--debug_checks)
+DEBUG_CHECKS = False
+
+
+def set_debug_checks(enabled: bool) -> None:
+    """Enables or disables the debug checks of the losses
+
+    Args:
+        enabled (bool): whether to run the checks
+
+    Returns:
+        None: This function does not return a value.
+    """
+    global DEBUG_CHECKS
+    DEBUG_CHECKS = enabled
+
+
+def masked_mean(values, mask):
+    """Mean of the values selected by the mask, 0 if the mask is empty.
+    Equivalent to values[mask].mean() guarded by mask.sum() > 0, without syncs
+
+    Args:
+        values (torch.tensor): per-sample values
+        mask (torch.tensor): boolean mask, same shape as values
+
+    Returns:
+        mean: masked mean
+    """
+    mask = mask.to(values.dtype)
+    return (values * mask).sum() / mask.sum().clamp_min(1)
+
+
+def masked_cross_entropy(logits, target, ignore_index=-1):
+    """Cross entropy over the targets different from ignore_index, 0 if there are none
+
+    Args:
+        logits (torch.tensor): (N, C) logits
+        target (torch.tensor): (N,) targets
+        ignore_index (int, default=-1): target to ignore
+
+    Returns:
+        loss: mean cross entropy
+    """
+    values = F.cross_entropy(logits, target, ignore_index=ignore_index, reduction="none")
+    return masked_mean(values, target != ignore_index)
+
+
+def masked_nll(log_probs, target, ignore_index=-1):
+    """Negative log-likelihood over the targets different from ignore_index, 0 if there are none
+
+    Args:
+        log_probs (torch.tensor): (N, C) log-probabilities
+        target (torch.tensor): (N,) targets
+        ignore_index (int, default=-1): target to ignore
+
+    Returns:
+        loss: mean negative log-likelihood
+    """
+    values = F.nll_loss(log_probs, target, ignore_index=ignore_index, reduction="none")
+    return masked_mean(values, target != ignore_index)
+
+
 def ADDMNIST_Classification(out_dict: dict, args):
     """Addmnist classification loss
 
@@ -36,9 +99,10 @@ def ADDMNIST_Classification(out_dict: dict, args):
     else:
         loss = torch.tensor(1e-5)
 
-    assert loss > 0, loss
+    if DEBUG_CHECKS:
+        assert loss > 0, loss
 
-    losses = {"y-loss": loss.item()}
+    losses = {"y-loss": loss.detach()}
 
     return loss, losses
 
@@ -63,14 +127,11 @@ def ADDMNIST_Concept_Match(out_dict: dict, args):
     assert len(objs) == len(g_objs), f"{len(objs)}-{len(g_objs)}"
 
     for j in range(len(objs)):
-        mask = g_objs[j] != -1
-        if mask.sum() > 0:
-            loss += torch.nn.CrossEntropyLoss()(
-                objs[j][mask].squeeze(1), g_objs[j][mask].view(-1)
-            )
-    losses = {"c-loss": loss.item()}
+        loss += masked_cross_entropy(objs[j].squeeze(1), g_objs[j].view(-1))
+    losses = {"c-loss": loss.detach()}
 
-    print(loss.item() / len(objs))
+    if DEBUG_CHECKS:
+        print(loss.item() / len(objs))
 
     return loss / len(objs), losses
 
@@ -100,7 +161,7 @@ def ADDMNIST_Concept_CLIP(out_dict: dict, args):
         targt_prob = g_objs[j].squeeze(1)
 
         loss += F.kl_div(input_prob.log(), targt_prob)
-    losses = {"clip-loss": loss.item()}
+    losses = {"clip-loss": loss.detach()}
 
     return loss / len(objs), losses
 
@@ -130,7 +191,7 @@ def ADDMNIST_REC_Match(out_dict: dict, args):
     recon = F.binary_cross_entropy(recs.view(L, -1), inputs.view(L, -1))
     kld = (-0.5 * (1 + logvars - mus**2 - logvars.exp()).sum(1).mean() - 1).abs()
 
-    losses = {"recon-loss": recon.item(), "kld": kld.item()}
+    losses = {"recon-loss": recon.detach(), "kld": kld.detach()}
 
     return recon + args.beta * kld, losses
 
@@ -161,9 +222,10 @@ def ADDMNIST_Entropy(out_dict, args):
     for i in range(p_mean.size(0)):
         loss -= torch.sum(p_mean[i] * p_mean[i].log()) / np.log(10) / p_mean.size(0)
 
-    losses = {"H-loss": 1 - loss}
+    losses = {"H-loss": (1 - loss).detach()}
 
-    assert (1 - loss) > -0.00001, loss
+    if DEBUG_CHECKS:
+        assert (1 - loss) > -0.00001, loss
 
     return 1 - loss, losses
 
@@ -285,9 +347,10 @@ def KAND_Classification(out_dict: dict, args):
     else:
         loss = torch.tensor(1e-5)
 
-    assert loss > 0, f"{loss}, {out}, {final_labels}"
+    if DEBUG_CHECKS:
+        assert loss > 0, f"{loss}, {out}, {final_labels}"
 
-    losses = {"y-loss": loss.item()}
+    losses = {"y-loss": loss.detach()}
 
     return loss, losses
 
@@ -323,16 +386,11 @@ def KAND_Concept_Match(out_dict: dict):
         assert len(cs) == len(gs), f"{len(cs)}-{len(gs)}"
 
         for k in range(len(gs)):
-            target = gs[k].view(-1)
-            mask = target != -1
-            if mask.sum() > 0:
-                loss += torch.nn.CrossEntropyLoss()(
-                    cs[k][mask].squeeze(1), target[mask].view(-1)
-                )
+            loss += masked_cross_entropy(cs[k].squeeze(1), gs[k].view(-1))
 
     loss /= len(g_objs) * len(gs)
 
-    losses = {"c-loss": loss.item()}
+    losses = {"c-loss": loss.detach()}
 
     return loss, losses
 
@@ -365,9 +423,10 @@ def KAND_Entropy(out_dict, args):
     for i in range(p_mean.size(0)):
         loss -= torch.sum(p_mean[i] * p_mean[i].log()) / np.log(10) / p_mean.size(0)
 
-    losses = {"H-loss": 1 - loss}
+    losses = {"H-loss": (1 - loss).detach()}
 
-    assert (1 - loss) > 0, loss
+    if DEBUG_CHECKS:
+        assert (1 - loss) > 0, loss
 
     return 1 - loss, losses
 
@@ -449,9 +508,10 @@ def SDDOIA_Entropy(out_dict, args):
 
     loss = -torch.sum(p_mean * p_mean.log()) / np.log(10) / p_mean.size(0)
 
-    losses = {"H-loss": 1 - loss}
+    losses = {"H-loss": (1 - loss).detach()}
 
-    assert (1 - loss) > -0.00001, loss
+    if DEBUG_CHECKS:
+        assert (1 - loss) > -0.00001, loss
 
     return 1 - loss, losses
 
@@ -475,17 +535,14 @@ def SDDOIA_Concept_Match(out_dict: dict, args):
     probs_list = torch.split(reprs, 2, dim=1)
 
     for i, rep in enumerate(probs_list):
-        # Create a mask to filter out concepts with -1
-        mask = concepts[:, i] != -1
-        if mask.sum() > 0:  # Proceed only if there are valid entries
-            # Apply the mask
-            filtered_rep = rep[mask]
-            filtered_concepts = concepts[mask, i]
-            loss += torch.nn.NLLLoss()(filtered_rep.log(), filtered_concepts)
+        # concepts with -1 are not supervised; the log is taken on all the rows,
+        # clamped so that zero probabilities of masked rows give no NaN gradients
+        loss += masked_nll(rep.clamp_min(1e-12).log(), concepts[:, i])
 
-    print("Concept supervision loss", loss.item())
+    if DEBUG_CHECKS:
+        print("Concept supervision loss", loss.item())
 
-    losses = {"c-loss": loss.item()}
+    losses = {"c-loss": loss.detach()}
 
     return loss, losses
 
@@ -540,9 +597,10 @@ def SDDOIA_BCE(out_dict: dict, args):
 
     loss = BCE_forloop(out, labels)
 
-    assert loss > 0, loss
+    if DEBUG_CHECKS:
+        assert loss > 0, loss
 
-    losses = {"y-loss": loss.item()}
+    losses = {"y-loss": loss.detach()}
 
     return loss, losses
 
@@ -576,13 +634,15 @@ def SDDOIA_CE(out_dict: dict, args):
                 Z = torch.sum(pred, dim=0, keepdim=True)
             pred = pred / Z
 
-            assert torch.max(pred) < 1, pred
-            assert torch.min(pred) > 0, pred
+            if DEBUG_CHECKS:
+                assert torch.max(pred) < 1, pred
+                assert torch.min(pred) > 0, pred
 
             loss_i = F.nll_loss(pred.log(), true.to(torch.long))
             loss += loss_i / 4
 
-            assert loss_i > 0, pred.log()
+            if DEBUG_CHECKS:
+                assert loss_i > 0, pred.log()
 
         return loss
 
@@ -591,9 +651,10 @@ def SDDOIA_CE(out_dict: dict, args):
 
     loss = CE_forloop(out, labels)
 
-    assert loss > 0, loss
+    if DEBUG_CHECKS:
+        assert loss > 0, loss
 
-    losses = {"y-loss": loss.item()}
+    losses = {"y-loss": loss.detach()}
 
     return loss, losses
 
@@ -623,9 +684,10 @@ def XOR_Classification(out_dict: dict, args):
     else:
         loss = torch.tensor(1e-5)
 
-    assert loss > 0, loss
+    if DEBUG_CHECKS:
+        assert loss > 0, loss
 
-    losses = {"y-loss": loss.item()}
+    losses = {"y-loss": loss.detach()}
 
     return loss, losses
 
@@ -653,9 +715,10 @@ def XOR_Entropy(out_dict, args):
 
     loss = -torch.sum(p_mean * p_mean.log()) / np.log(10) / p_mean.size(0)
 
-    losses = {"H-loss": 1 - loss}
+    losses = {"H-loss": (1 - loss).detach()}
 
-    assert (1 - loss) > -0.00001, loss
+    if DEBUG_CHECKS:
+        assert (1 - loss) > -0.00001, loss
 
     return 1 - loss, losses
 
@@ -682,9 +745,10 @@ def XOR_Concept_Match(out_dict: dict, args):
         filtered_concepts = concepts[:, i]
         loss += torch.nn.NLLLoss()(filtered_rep.log(), filtered_concepts)
 
-    print("Concept supervision loss", loss.item())
+    if DEBUG_CHECKS:
+        print("Concept supervision loss", loss.item())
 
-    losses = {"c-loss": loss.item()}
+    losses = {"c-loss": loss.detach()}
 
     return loss, losses
 
@@ -739,9 +803,10 @@ def MNMATH_Classification(out_dict: dict, args):
     else:
         loss = torch.tensor(1e-5)
 
-    assert loss > 0, loss
+    if DEBUG_CHECKS:
+        assert loss > 0, loss
 
-    losses = {"y-loss": loss.item()}
+    losses = {"y-loss": loss.detach()}
 
     return loss, losses
 
@@ -769,9 +834,10 @@ def MNMATH_Entropy(out_dict, args):
 
     loss = -torch.sum(p_mean * p_mean.log()) / np.log(10) / p_mean.size(0)
 
-    losses = {"H-loss": 1 - loss}
+    losses = {"H-loss": (1 - loss).detach()}
 
-    assert (1 - loss) > -0.00001, loss
+    if DEBUG_CHECKS:
+        assert (1 - loss) > -0.00001, loss
 
     return 1 - loss, losses
 
@@ -801,16 +867,14 @@ def MNMATH_Concept_Match(out_dict: dict, args):
         specific_concepts = [0, 5, 9]
         mask = torch.isin(filtered_concepts, torch.tensor(specific_concepts).to(filtered_concepts.device)).to(filtered_concepts.device)
 
-        filtered_concepts = filtered_concepts[mask]
-        filtered_predictions = filtered_rep[mask]
-
-        if filtered_concepts.size(0) > 0:
-            criterion = torch.nn.CrossEntropyLoss()
-            loss = criterion(filtered_predictions, filtered_concepts)
+        # the loss of the last digit with supervised concepts is kept
+        values = F.cross_entropy(filtered_rep, filtered_concepts, reduction="none")
+        loss = torch.where(mask.any(), masked_mean(values, mask), loss)
 
-    print("Concept supervision loss", loss.item())
+    if DEBUG_CHECKS:
+        print("Concept supervision loss", loss.item())
 
-    losses = {"c-loss": loss.item()}
+    losses = {"c-loss": loss.detach()}
 
     return loss, losses
 
@@ -10,6 +10,7 @@ import torch
 import torch.nn.functional as F
 from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
 from scipy.special import softmax
+from utils.distributed import all_reduce_sum, gather_arrays
 
 
 def accuracy(output, target, topk=(1,)):
@@ -94,7 +95,9 @@ def evaluate_metrics(
     apply_softmax=False,
     cf1=False,
 ):
-    """Evaluate metrics of the frequentist model
+    """Evaluate metrics of the frequentist model. In distributed mode the loader
+    holds the shard of the rank: the metrics are averaged over the batches of
+    all the ranks and the outputs of last are gathered in the order of the dataset
 
     Args:
         model (nn.Module): network
@@ -202,6 +205,15 @@ def evaluate_metrics(
             yacc += acc
             f1sc += f1
 
+    if last:
+        y_true, c_true, y_pred, c_pred, pc_pred = gather_arrays(
+            y_true, c_true, y_pred, c_pred, pc_pred
+        )
+    else:
+        tloss, cacc, yacc, f1sc, fcf1, L = all_reduce_sum(
+            [tloss, cacc, yacc, f1sc, fcf1, L]
+        )
+
     if apply_softmax:
         y_pred = softmax(y_pred, axis=1)
 
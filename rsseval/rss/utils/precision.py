@@ -0,0 +1,175 @@
+# Module which contains the mixed-precision and compilation helpers of the training loop
+import torch
+from contextlib import nullcontext
+
+from models.utils.ops import to_fp32
+from utils import fprint
+
+
+# tolerances of the parity check against fp32, on the loss (relative) and on YS (absolute)
+PARITY_TOL = {
+    None: (1e-4, 1e-4),
+    torch.bfloat16: (5e-2, 5e-2),
+    torch.float16: (1e-2, 1e-2),
+}
+
+
+def amp_dtype(device, amp):
+    """Autocast dtype of the given mode on the given device
+
+    Args:
+        device: model device
+        amp (str): None, "bf16" or "fp16"
+
+    Returns:
+        dtype (torch.dtype): autocast dtype, None if autocast is disabled
+    """
+    if amp is None:
+        return None
+    if amp == "fp16" and torch.device(device).type != "cuda":
+        # CPU autocast supports bf16 only
+        fprint("fp16 autocast is only available on GPU, falling back to bf16")
+        return torch.bfloat16
+    return torch.float16 if amp == "fp16" else torch.bfloat16
+
+
+def autocast(device, dtype):
+    """Autocast context of the forward pass
+
+    Args:
+        device: model device
+        dtype (torch.dtype): autocast dtype, None to disable
+
+    Returns:
+        ctx: autocast context manager (or a null context)
+    """
+    if dtype is None:
+        return nullcontext()
+    return torch.autocast(device_type=torch.device(device).type, dtype=dtype)
+
+
+def make_grad_scaler(device, dtype):
+    """Gradient scaler, enabled only for fp16 on GPU (bf16 has the fp32 range)
+
+    Args:
+        device: model device
+        dtype (torch.dtype): autocast dtype
+
+    Returns:
+        scaler (GradScaler): gradient scaler, a no-op when disabled
+    """
+    enabled = dtype == torch.float16 and torch.device(device).type == "cuda"
+    return torch.cuda.amp.GradScaler(enabled=enabled)
+
+
+def outputs_to_fp32(out_dict):
+    """Casts the half-precision outputs to fp32, so that the losses (logs of the
+    query and world probabilities) are always computed in full precision
+
+    Args:
+        out_dict: output dictionary of the model
+
+    Returns:
+        out_dict: output dictionary in fp32
+    """
+    return {
+        k: to_fp32(v) if isinstance(v, torch.Tensor) else v
+        for k, v in out_dict.items()
+    }
+
+
+def maybe_compile(model, _loss, compile):
+    """Wraps the forward of the model and the loss with torch.compile.
+    The modules themselves are left untouched, so that the checkpoints keep
+    the same state dict keys
+
+    Args:
+        model: network
+        _loss: loss function
+        compile (bool): whether to compile
+
+    Returns:
+        forward: forward function of the model
+        loss_fn: loss function
+    """
+    if not compile:
+        return model, _loss
+    if not hasattr(torch, "compile"):
+        fprint("torch.compile requires torch>=2.0, running eagerly")
+        return model, _loss
+    return torch.compile(model), torch.compile(_loss)
+
+
+def forward_step(forward, loss_fn, images, labels, concepts, args, dtype, extra=None):
+    """Forward and loss of a training step: the forward runs under autocast, the
+    loss is computed in fp32
+
+    Args:
+        forward: forward function of the model
+        loss_fn: loss function
+        images (torch.tensor): inputs
+        labels (torch.tensor): labels
+        concepts (torch.tensor): concepts
+        args: command line arguments
+        dtype (torch.dtype): autocast dtype, None to disable
+        extra (dict, default=None): additional entries of the output dictionary
+
+    Returns:
+        loss: loss value
+        losses: losses dictionary
+        out_dict: output dictionary
+    """
+    with autocast(images.device, dtype):
+        out_dict = forward(images)
+    out_dict = outputs_to_fp32(out_dict)
+    out_dict.update({"LABELS": labels, "CONCEPTS": concepts})
+    if extra is not None:
+        out_dict.update(extra)
+
+    loss, losses = loss_fn(out_dict, args)
+    return loss, losses, out_dict
+
+
+@torch.no_grad()
+def check_parity(model, _loss, forward, loss_fn, batch, args, dtype, extra=None):
+    """Compares one step of the mixed-precision/compiled mode with the fp32 eager
+    one, on the same batch and in eval mode (no dropout, frozen batch norm)
+
+    Args:
+        model: network
+        _loss: loss function
+        forward: forward function of the fast mode
+        loss_fn: loss function of the fast mode
+        batch: (images, labels, concepts) on the model device
+        args: command line arguments
+        dtype (torch.dtype): autocast dtype of the fast mode, selects the tolerances
+        extra (dict, default=None): additional entries of the output dictionary
+
+    Returns:
+        ok (bool): whether the fast mode is within tolerance
+    """
+    images, labels, concepts = batch
+    was_training = model.training
+    model.eval()
+
+    ref_loss, _, ref_out = forward_step(
+        model, _loss, images, labels, concepts, args, None, extra
+    )
+    loss, _, out = forward_step(
+        forward, loss_fn, images, labels, concepts, args, dtype, extra
+    )
+
+    if was_training:
+        model.train()
+
+    loss_tol, ys_tol = PARITY_TOL[dtype]
+    loss_err = abs(loss.item() - ref_loss.item()) / max(abs(ref_loss.item()), 1e-8)
+    ys_err = (out["YS"] - ref_out["YS"]).abs().max().item()
+
+    ok = loss_err <= loss_tol and ys_err <= ys_tol
+    fprint(
+        f"Parity check against fp32: loss rel. err {loss_err:.2e} (tol {loss_tol:.0e}),",
+        f"YS max abs. err {ys_err:.2e} (tol {ys_tol:.0e})",
+        "OK" if ok else "-- WARNING: outside tolerance",
+    )
+    return ok
@@ -1,8 +1,11 @@
 # This module contains the preoprocessing operation for Kandisnky using a ResNet
 
 import numpy as np
+import torch
 
 import os
+import shutil
+from contextlib import nullcontext
 
 from utils.wandb_logger import *
 from utils.status import progress_bar
@@ -13,116 +16,132 @@ from utils.dpl_loss import ADDMNIST_DPL
 from utils import fprint
 
 
-def preprocess(model: MnistDPL, dataset: BaseDataset, args):
-    """Preprocess Kandinksy images
-    Args:
-        model: network
-        dataset: dataset
-        args: command line arguments
+PREPROCESS_PATH = "data/kand-preprocess"
 
-    Returns:
-        None: This function does not return a value.
-    """
-    # Default Setting for Training
-    model.to(model.device)
-    train_loader, val_loader, test_loader = dataset.get_data_loaders()
+# one array per field, loaded by PreKAND_Dataset in a single call each
+FIELDS = ["images", "labels", "concepts"]
 
-    fprint("\n--- Start of Preprocessing ---\n")
-
-    model.eval()
-
-    print("Doing training")
-
-    os.makedirs("data/kand-preprocess/train/images/", exist_ok=True)
-    os.makedirs("data/kand-preprocess/train/labels/", exist_ok=True)
-    os.makedirs("data/kand-preprocess/train/concepts/", exist_ok=True)
-
-    for i, data in enumerate(train_loader):
-        id, images, labels, concepts = data
-        images, labels, concepts = (
-            images.to(model.device),
-            labels.to(model.device),
-            concepts.to(model.device),
-        )
 
-        out_dict = model(images)
+def _autocast(device, enabled):
+    """Autocast context for the export: bf16 on CPU, fp16 on GPU
 
-        emb = out_dict["EMBS"]
-
-        id = id.item()
-        emb = emb.detach().cpu().numpy()
-        y = labels.detach().cpu().numpy()
-        g = concepts.detach().cpu().numpy()
+    Args:
+        device: model device
+        enabled (bool): whether to use mixed precision
 
-        np.save(f"data/kand-preprocess/train/images/{str(id).zfill(5)}", emb)
-        np.save(f"data/kand-preprocess/train/labels/{str(id).zfill(5)}", y)
-        np.save(f"data/kand-preprocess/train/concepts/{str(id).zfill(5)}", g)
+    Returns:
+        ctx: autocast context manager (or a null context)
+    """
+    if not enabled:
+        return nullcontext()
+    device_type = torch.device(device).type
+    dtype = torch.float16 if device_type == "cuda" else torch.bfloat16
+    return torch.autocast(device_type=device_type, dtype=dtype)
 
-        if i % 10 == 0:
-            progress_bar(i, len(train_loader) - 9, 0, 0)
 
-    print("Doing validation")
+def _finalize(tmp_dir, split_dir):
+    """Atomically publishes an exported split: the old folder (including the
+    legacy one-file-per-sample layout) is moved aside before the rename
 
-    os.makedirs("data/kand-preprocess/val/images/", exist_ok=True)
-    os.makedirs("data/kand-preprocess/val/labels/", exist_ok=True)
-    os.makedirs("data/kand-preprocess/val/concepts/", exist_ok=True)
+    Args:
+        tmp_dir (str): folder containing the exported arrays
+        split_dir (str): final folder of the split
 
-    for i, data in enumerate(val_loader):
-        id, images, labels, concepts = data
-        images, labels, concepts = (
-            images.to(model.device),
-            labels.to(model.device),
-            concepts.to(model.device),
-        )
+    Returns:
+        None: This function does not return a value.
+    """
+    old_dir = split_dir + ".old"
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+    if os.path.exists(split_dir):
+        os.replace(split_dir, old_dir)
+    os.replace(tmp_dir, split_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
 
-        out_dict = model(images)
 
-        emb = out_dict["EMBS"]
+@torch.no_grad()
+def export_split(model, loader, split, amp=False, base_path=PREPROCESS_PATH):
+    """Encodes a whole split in batches and writes one array per field
 
-        id = id.item()
-        emb = emb.detach().cpu().numpy()
-        y = labels.detach().cpu().numpy()
-        g = concepts.detach().cpu().numpy()
+    Args:
+        model: network returning the embeddings in out_dict["EMBS"]
+        loader: data loader returning (ids, images, labels, concepts)
+        split (str): name of the split
+        amp (bool, default=False): encode under autocast
+        base_path (str, default=PREPROCESS_PATH): output folder
 
-        np.save(f"data/kand-preprocess/val/images/{str(id).zfill(5)}", emb)
-        np.save(f"data/kand-preprocess/val/labels/{str(id).zfill(5)}", y)
-        np.save(f"data/kand-preprocess/val/concepts/{str(id).zfill(5)}", g)
+    Returns:
+        None: This function does not return a value.
+    """
+    split_dir = os.path.join(base_path, split)
+    tmp_dir = split_dir + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    n_items = len(loader.dataset)
+    arrays = None
+
+    for i, data in enumerate(loader):
+        ids, images, labels, concepts = data
+        images = images.to(model.device)
+
+        with _autocast(model.device, amp):
+            out_dict = model(images)
+
+        emb = out_dict["EMBS"].float().cpu().numpy()
+        batch = {"images": emb, "labels": labels.numpy(), "concepts": concepts.numpy()}
+
+        # allocate the arrays once the shapes are known
+        if arrays is None:
+            arrays = {
+                field: np.lib.format.open_memmap(
+                    os.path.join(tmp_dir, field + ".npy"),
+                    mode="w+",
+                    dtype=batch[field].dtype,
+                    shape=(n_items,) + batch[field].shape[1:],
+                )
+                for field in FIELDS
+            }
+
+        # rows are indexed by image id, so the loader order does not matter
+        ids = ids.numpy()
+        for field in FIELDS:
+            arrays[field][ids] = batch[field]
 
         if i % 10 == 0:
-            progress_bar(i, len(val_loader) - 9, 0, 0)
+            progress_bar(i, len(loader), 0, 0)
 
-    print("Doing testing")
+    for field in FIELDS:
+        arrays[field].flush()
+    del arrays
 
-    os.makedirs("data/kand-preprocess/test/images/", exist_ok=True)
-    os.makedirs("data/kand-preprocess/test/labels/", exist_ok=True)
-    os.makedirs("data/kand-preprocess/test/concepts/", exist_ok=True)
+    _finalize(tmp_dir, split_dir)
 
-    for i, data in enumerate(test_loader):
-        id, images, labels, concepts = data
-        images, labels, concepts = (
-            images.to(model.device),
-            labels.to(model.device),
-            concepts.to(model.device),
-        )
 
-        out_dict = model(images)
+def preprocess(model: MnistDPL, dataset: BaseDataset, args):
+    """Preprocess Kandinksy images
+    Args:
+        model: network
+        dataset: dataset
+        args: command line arguments
 
-        emb = out_dict["EMBS"]
+    Returns:
+        None: This function does not return a value.
+    """
+    # Default Setting for Training
+    model.to(model.device)
+    train_loader, val_loader, test_loader = dataset.get_data_loaders()
 
-        id = id.item()
-        emb = emb.detach().cpu().numpy()
-        y = labels.detach().cpu().numpy()
-        g = concepts.detach().cpu().numpy()
+    fprint("\n--- Start of Preprocessing ---\n")
 
-        np.save(f"data/kand-preprocess/test/images/{str(id).zfill(5)}", emb)
-        np.save(f"data/kand-preprocess/test/labels/{str(id).zfill(5)}", y)
-        np.save(f"data/kand-preprocess/test/concepts/{str(id).zfill(5)}", g)
+    model.eval()
 
-        if i % 10 == 0:
-            progress_bar(i, len(test_loader) - 9, 0, 0)
-    # ids  = np.concatenate(ids,  dim=0).detach().cpu().numpy()
-    # embs = np.concatenate(embs, dim=0).detach().cpu().numpy()
-    # ys   = np.concatenate(ys,   dim=0).detach().cpu().numpy()
-    # gs   = np.concatenate(gs,   dim=0).detach().cpu().numpy(
+    for loader, split in zip(
+        [train_loader, val_loader, test_loader], ["train", "val", "test"]
+    ):
+        print("Doing", split)
+        export_split(model, loader, split, amp=args.preprocess_amp)
 
     return
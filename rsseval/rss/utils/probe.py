@@ -2,10 +2,13 @@ from utils.wandb_logger import *
 from datasets.utils.base_dataset import BaseDataset
 from models.mnistdpl import MnistDPL
 
+import os
+import hashlib
 import torch
 import torch.nn as nn
 import numpy as np
 import joblib
+from torch.utils.data import DataLoader, TensorDataset
 
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -16,22 +19,137 @@ from sklearn.metrics import accuracy_score
 from sklearn.tree import export_graphviz
 import graphviz
 
+PROBE_CACHE_DIR = "data/probe-cache"
+
+# frozen representations already computed in this process, keyed by checkpoint and split
+_REPRESENTATIONS = {}
+
+# fields extracted in the single pass over a split
+FIELDS = ["reps", "concepts", "c_pred", "y_pred"]
+
+
 class NonLinearProbe(nn.Module):
-    def __init__(self, input_dim, hidden_dim, output_dim):
+    def __init__(self, input_dim, hidden_dim, output_dim, n_targets=1):
         super(NonLinearProbe, self).__init__()
+        self.output_dim = output_dim
+        self.n_targets = n_targets
         self.hidden_layer = nn.Sequential(
             nn.Linear(input_dim, hidden_dim),
             nn.ReLU(),
             nn.Linear(hidden_dim, hidden_dim),
             nn.ReLU()
         )
-        self.output_layer = nn.Linear(hidden_dim, output_dim)
+        # one head per concept target, sharing the hidden layers
+        self.output_layer = nn.Linear(hidden_dim, output_dim * n_targets)
 
     def forward(self, h_L):
         x = self.hidden_layer(h_L)
         out = self.output_layer(x)
+        if self.n_targets > 1:
+            out = out.view(-1, self.n_targets, self.output_dim)
         return out
 
+
+def _cache_key(ckpt_path, split):
+    """Key of the representation cache: the checkpoint path and its last
+    modification, so that retraining a model invalidates the cache
+
+    Args:
+        ckpt_path (str): path of the probed checkpoint
+        split (str): name of the split
+
+    Returns:
+        key (str): cache key
+    """
+    stat = os.stat(ckpt_path)
+    ckpt_id = f"{os.path.abspath(ckpt_path)}:{stat.st_mtime_ns}:{stat.st_size}"
+    return f"{hashlib.sha1(ckpt_id.encode()).hexdigest()[:16]}_{split}"
+
+
+@torch.no_grad()
+def extract_representations(model, loader):
+    """Single batched pass of the frozen model over a split
+
+    Args:
+        model: network implementing get_layer_representation
+        loader: data loader of the split
+
+    Returns:
+        data (dict): layer representations, concept targets (one row per
+            representation), predicted concepts and predicted labels
+    """
+    model.eval()
+    data = {field: [] for field in FIELDS}
+
+    for images, labels, concepts in loader:
+        images = images.to(model.device)
+
+        reps = model.get_layer_representation(images)
+        out_dict = model(images)
+
+        data["reps"].append(reps.float().cpu())
+        data["concepts"].append(concepts.reshape(reps.shape[0], -1).to(torch.long))
+        data["c_pred"].append(torch.argmax(out_dict["pCS"], dim=-1).cpu())
+        data["y_pred"].append(torch.argmax(out_dict["YS"], dim=-1).cpu())
+
+    return {field: torch.cat(data[field], dim=0) for field in FIELDS}
+
+
+def get_representations(model, loader, ckpt_path, split, cache_dir=PROBE_CACHE_DIR):
+    """Frozen representations of a split, computed once per checkpoint: looked
+    up in memory, then in the on-disk cache (memory-mapped), and extracted
+    otherwise
+
+    Args:
+        model: network
+        loader: data loader of the split
+        ckpt_path (str): path of the probed checkpoint
+        split (str): name of the split
+        cache_dir (str, default=PROBE_CACHE_DIR): on-disk cache folder
+
+    Returns:
+        data (dict): output of extract_representations
+    """
+    key = _cache_key(ckpt_path, split)
+    if key in _REPRESENTATIONS:
+        return _REPRESENTATIONS[key]
+
+    folder = os.path.join(cache_dir, key)
+    if all(os.path.exists(os.path.join(folder, f + ".npy")) for f in FIELDS):
+        print("Loaded cached representations", folder)
+        data = {
+            f: torch.from_numpy(np.load(os.path.join(folder, f + ".npy"), mmap_mode="c"))
+            for f in FIELDS
+        }
+    else:
+        data = extract_representations(model, loader)
+
+        os.makedirs(folder, exist_ok=True)
+        for f in FIELDS:
+            tmp = os.path.join(folder, f + ".tmp.npy")
+            np.save(tmp, data[f].numpy())
+            os.replace(tmp, os.path.join(folder, f + ".npy"))
+
+    _REPRESENTATIONS[key] = data
+    return data
+
+
+def _n_concept_classes(dataset, targets):
+    """Number of classes per concept target
+
+    Args:
+        dataset: dataset
+        targets (torch.tensor): concept targets, one column per target
+
+    Returns:
+        n_classes (int): number of classes of each probe head
+    """
+    concept_labels = dataset.get_concept_labels()
+    if targets.shape[1] == 1 and isinstance(concept_labels, list):
+        return len(concept_labels)
+    return max(int(targets.max()) + 1, 2)
+
+
 def probe(model: MnistDPL, dataset: BaseDataset, args):
     """TRAINING
 
@@ -56,52 +174,46 @@ def probe(model: MnistDPL, dataset: BaseDataset, args):
     model.eval()
     _, val_loader, test_loader = dataset.get_data_loaders()
 
-    probe_dim = None
     max_depth = 10
 
-    # Get the dimension of the probe
-    for data in val_loader:
-        images, _, _ = data
-        images = images.to(model.device)
-
-        layer_output = model.get_layer_representation(images)
-        probe_dim = layer_output.size(1)
+    # The model is frozen: representations are computed once per split
+    val_data = get_representations(model, val_loader, current_model_path, "val")
+    test_data = get_representations(model, test_loader, current_model_path, "test")
 
-        break
+    # Get the dimension of the probe and of its targets
+    probe_dim = val_data["reps"].size(1)
+    n_targets = val_data["concepts"].size(1)
+    n_classes = _n_concept_classes(
+        dataset, torch.cat([val_data["concepts"], test_data["concepts"]], dim=0)
+    )
 
     # Define the Non-linear Probe using the captured dimension
-    probe = NonLinearProbe(input_dim=probe_dim, hidden_dim=128, output_dim=len(dataset.get_concept_labels()))
+    probe = NonLinearProbe(
+        input_dim=probe_dim, hidden_dim=128, output_dim=n_classes, n_targets=n_targets
+    )
     probe = probe.to(model.device)
 
-    criterion = nn.CrossEntropyLoss()
+    # masked concepts (-1) do not contribute to the loss
+    criterion = nn.CrossEntropyLoss(ignore_index=-1)
     optimizer = torch.optim.Adam(probe.parameters(), lr=0.001)
 
+    train_set = TensorDataset(
+        val_data["reps"].to(model.device), val_data["concepts"].to(model.device)
+    )
+    train_loader = DataLoader(train_set, batch_size=args.probe_batch_size, shuffle=True)
+
     print("\n--- Start of Probe training ---\n")
 
     # Training loop
     for epoch in range(args.n_epochs):
         probe.train()
         total_loss = 0
-        for data in val_loader:
-            images, labels, concepts = data
-            images, labels, concepts = (
-                images.to(model.device),
-                labels.to(model.device),
-                concepts.to(model.device),
-            )
-
-            if 'mnist' in args.dataset:
-                concepts = concepts.view(-1)
-
-            # Forward pass through the model to get the layer output
-            with torch.no_grad():
-                layer_output = model.get_layer_representation(images)
-
+        for layer_output, concepts in train_loader:
             # Forward pass through the probe
             outputs = probe(layer_output)
 
-            # Compute the loss
-            loss = criterion(outputs, concepts.to(torch.long))
+            # Compute the loss, jointly over all the concept targets
+            loss = criterion(outputs.reshape(-1, n_classes), concepts.reshape(-1))
             total_loss += loss.item()
 
             # Backward pass and optimization
@@ -109,41 +221,32 @@ def probe(model: MnistDPL, dataset: BaseDataset, args):
             loss.backward()
             optimizer.step()
 
-        print(f"Epoch [{epoch+1}/{args.n_epochs}], Loss: {total_loss/len(test_loader):.4f}")
+        print(f"Epoch [{epoch+1}/{args.n_epochs}], Loss: {total_loss/len(train_loader):.4f}")
 
     # Evaluation loop
     probe.eval()
-    correct = 0
-    total = 0
-    all_predictions = []
-    all_targets = []
 
     print("\n--- Start of Probe evaluation ---\n")
 
     with torch.no_grad():
-        for data in test_loader:
-            images, labels, concepts = data
-            images, labels, concepts = (
-                images.to(model.device),
-                labels.to(model.device),
-                concepts.to(model.device),
-            )
-
-            if 'mnist' in args.dataset:
-                concepts = concepts.view(-1)
-
-            layer_output = model.get_layer_representation(images)
-            outputs = probe(layer_output)
-
+        probe_prediction = []
+        for (layer_output,) in DataLoader(
+            TensorDataset(test_data["reps"]), batch_size=args.probe_batch_size
+        ):
+            outputs = probe(layer_output.to(model.device))
             # Get predictions
-            _, predicted = torch.max(outputs.data, 1)
+            probe_prediction.append(torch.argmax(outputs, dim=-1).view(-1, n_targets).cpu())
+        probe_prediction = torch.cat(probe_prediction, dim=0)
+
+    concepts = test_data["concepts"]
+    supervised = concepts != -1
 
-            # Calculate accuracy
-            total += concepts.size(0)
-            correct += (predicted == concepts).sum().item()
+    # Calculate accuracy
+    total = supervised.sum().item()
+    correct = ((probe_prediction == concepts) & supervised).sum().item()
 
-            all_predictions.extend(predicted.cpu().numpy())
-            all_targets.extend(concepts.cpu().numpy())
+    all_predictions = probe_prediction[supervised].numpy()
+    all_targets = concepts[supervised].numpy()
 
     accuracy = 100 * correct / total
     print(f"Accuracy of the probe on the test set: {accuracy:.2f}%")
@@ -166,46 +269,19 @@ def probe(model: MnistDPL, dataset: BaseDataset, args):
 
     print("\n--- Start of the concepts evaluation ---\n")
 
-    correct_concepts = 0
-    all_predictions = []
-    all_targets = []
-    all_probe_predictions = []
-    all_y_predictions = []
-    all_c_predictions = []
+    # model predictions were collected in the same pass as the representations
+    c_predicted = test_data["c_pred"]
+    predicted = c_predicted.reshape(concepts.shape)
 
-    with torch.no_grad():
-        for data in test_loader:
-            images, labels, concepts = data
-            images, labels, concepts = (
-                images.to(model.device),
-                labels.to(model.device),
-                concepts.to(model.device),
-            )
-
-            out_dict = model(images)
-
-            if 'mnist' in args.dataset:
-                concepts = concepts.view(-1)
-                predicted = torch.argmax(out_dict["pCS"], dim=-1)
-                c_predicted = torch.argmax(out_dict["pCS"], dim=-1)
-                predicted = predicted.view(-1)
-
-            predicted_labels = torch.argmax(out_dict["YS"], dim=-1)
-            correct_concepts += (predicted == concepts).sum().item()
-
-            layer_output = model.get_layer_representation(images)
-            outputs = probe(layer_output)
-            _, probe_prediction = torch.max(outputs.data, 1)
-
-            if 'mnist' in args.dataset:
-                probe_prediction = probe_prediction.view(int(outputs.shape[0] / 2), 2)
-                assert c_predicted.shape == probe_prediction.shape, f"Different shape: {c_predicted.shape} vs {probe_prediction.shape}"
-            
-            all_predictions.extend(predicted.cpu().numpy())
-            all_targets.extend(concepts.cpu().numpy())
-            all_y_predictions.extend(predicted_labels.cpu().numpy())
-            all_c_predictions.extend(c_predicted.cpu().numpy()) # should be of 2 for being input of the decision tree training
-            all_probe_predictions.extend(probe_prediction.cpu().numpy())
+    correct_concepts = ((predicted == concepts) & supervised).sum().item()
+
+    all_predictions = predicted[supervised].numpy()
+    all_targets = concepts[supervised].numpy()
+    all_y_predictions = test_data["y_pred"].numpy()
+    all_c_predictions = c_predicted.reshape(len(all_y_predictions), -1).numpy()
+    all_probe_predictions = probe_prediction.reshape(len(all_y_predictions), -1).numpy()
+
+    assert all_c_predictions.shape == all_probe_predictions.shape, f"Different shape: {all_c_predictions.shape} vs {all_probe_predictions.shape}"
 
     accuracy = 100 * correct_concepts / total
     print(f"Accuracy of the concept prediction on the test set: {accuracy:.2f}%")
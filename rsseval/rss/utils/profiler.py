@@ -0,0 +1,244 @@
+# Module which contains the step profiler of the training loop (--profile)
+#
+# The phases of a step (data loading, encoder, inference, loss, backward, ...)
+# are timed with wall-clock timers and reported in a summary table and in a
+# Chrome trace (chrome://tracing, https://ui.perfetto.dev). An optional
+# torch.profiler trace can be recorded over a window of steps. When profiling
+# is disabled every hook is a shared null context.
+import os
+import json
+import time
+import functools
+from contextlib import contextmanager, nullcontext
+
+import torch
+
+from utils import fprint
+
+
+_NULL = nullcontext()
+
+# methods of the models wrapped by `instrument`, when they exist
+MODEL_PHASES = ["problog_inference", "combine_queries"]
+
+
+class StepProfiler:
+    """Times the phases of the training steps"""
+
+    def __init__(self, enabled=False, sync_cuda=True):
+        """Initialize method
+
+        Args:
+            self: instance
+            enabled (bool, default=False): whether to time the phases
+            sync_cuda (bool, default=True): synchronize the GPU at the phase
+                boundaries, so that the kernels are accounted to their phase
+
+        Returns:
+            None: This function does not return a value.
+        """
+        self.enabled = enabled
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.stats = {}
+        self.events = []
+        self.stack = []
+        self.t0 = time.perf_counter()
+        self.torch_profiler = None
+
+    def _sync(self) -> None:
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+
+    @contextmanager
+    def _timed(self, name):
+        self._sync()
+        self.stack.append(name)
+        path = "/".join(self.stack)
+        start = time.perf_counter()
+        try:
+            with torch.profiler.record_function(name):
+                yield
+        finally:
+            self._sync()
+            end = time.perf_counter()
+            self.stack.pop()
+
+            calls, total = self.stats.get(path, (0, 0.0))
+            self.stats[path] = (calls + 1, total + end - start)
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": path,
+                    "ph": "X",
+                    "ts": (start - self.t0) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": 0,
+                }
+            )
+
+    def phase(self, name):
+        """Context manager timing a phase, nested phases are reported as parent/child
+
+        Args:
+            self: instance
+            name (str): phase name
+
+        Returns:
+            ctx: context manager
+        """
+        if not self.enabled:
+            return _NULL
+        return self._timed(name)
+
+    def iterate(self, loader, name="data"):
+        """Iterates over a loader, timing the fetch of each batch
+
+        Args:
+            self: instance
+            loader: iterable
+            name (str, default="data"): phase name
+
+        Returns:
+            iterator: the batches of the loader
+        """
+        if not self.enabled:
+            yield from loader
+            return
+        it = iter(loader)
+        while True:
+            with self.phase(name):
+                try:
+                    batch = next(it)
+                except StopIteration:
+                    return
+            yield batch
+
+    def wrap(self, fn, name):
+        """Wraps a callable so that each call is timed as a phase
+
+        Args:
+            self: instance
+            fn: callable
+            name (str): phase name
+
+        Returns:
+            fn: the wrapped callable, fn itself when disabled
+        """
+        if not self.enabled:
+            return fn
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            with self.phase(name):
+                return fn(*args, **kwargs)
+
+        return timed
+
+    def instrument(self, model) -> None:
+        """Times the encoder and the reasoning layer of a model, by wrapping the
+        methods of the instance (the class is not modified)
+
+        Args:
+            self: instance
+            model: network
+
+        Returns:
+            None: This function does not return a value.
+        """
+        if not self.enabled:
+            return
+        if hasattr(model, "encoder"):
+            model.encoder.forward = self.wrap(model.encoder.forward, "encoder")
+        for method in MODEL_PHASES:
+            if hasattr(model, method):
+                setattr(model, method, self.wrap(getattr(model, method), method))
+
+    def start_trace(self, steps, out_dir, wait=5, warmup=2) -> None:
+        """Records a torch.profiler trace over `steps` steps, after `wait` + `warmup`
+
+        Args:
+            self: instance
+            steps (int): number of recorded steps, 0 to disable
+            out_dir (str): output folder of the trace
+            wait (int, default=5): steps skipped at the beginning
+            warmup (int, default=2): profiled steps that are not recorded
+
+        Returns:
+            None: This function does not return a value.
+        """
+        if not self.enabled or steps <= 0:
+            return
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.torch_profiler = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(
+                wait=wait, warmup=warmup, active=steps, repeat=1
+            ),
+            on_trace_ready=torch.profiler.tensorboard_trace_handler(out_dir),
+            record_shapes=True,
+        )
+        self.torch_profiler.start()
+
+    def step(self) -> None:
+        """Marks the end of a training step
+
+        Args:
+            self: instance
+
+        Returns:
+            None: This function does not return a value.
+        """
+        if self.torch_profiler is not None:
+            self.torch_profiler.step()
+
+    def summary(self) -> str:
+        """Per-phase summary table
+
+        Args:
+            self: instance
+
+        Returns:
+            table (str): calls, total and mean time and share of the wall time of each phase
+        """
+        wall = time.perf_counter() - self.t0
+        rows = [f"{'phase':<40} {'calls':>8} {'total [s]':>10} {'mean [ms]':>10} {'%':>6}"]
+        for path, (calls, total) in sorted(self.stats.items()):
+            depth = path.count("/")
+            name = "  " * depth + path.split("/")[-1]
+            rows.append(
+                f"{name:<40} {calls:>8d} {total:>10.3f} {1e3 * total / calls:>10.3f} {100 * total / wall:>6.1f}"
+            )
+        rows.append(f"{'wall time':<40} {'':>8} {wall:>10.3f}")
+        return "\n".join(rows)
+
+    def finish(self, out_dir) -> None:
+        """Stops the trace, prints the summary and writes the Chrome trace of the phases
+
+        Args:
+            self: instance
+            out_dir (str): output folder
+
+        Returns:
+            None: This function does not return a value.
+        """
+        if not self.enabled:
+            return
+        if self.torch_profiler is not None:
+            self.torch_profiler.stop()
+            self.torch_profiler = None
+
+        os.makedirs(out_dir, exist_ok=True)
+        trace_path = os.path.join(out_dir, "phases_trace.json")
+        with open(trace_path, "w") as f:
+            json.dump({"traceEvents": self.events}, f)
+
+        table = self.summary()
+        with open(os.path.join(out_dir, "phases_summary.txt"), "w") as f:
+            f.write(table + "\n")
+
+        fprint("\n--- Profile (nested phases are included in their parent) ---\n")
+        fprint(table)
+        fprint(f"\nChrome trace of the phases: {trace_path}")
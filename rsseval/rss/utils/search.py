@@ -0,0 +1,476 @@
+# Module which contains the local hyper-parameter search (ASHA)
+#
+# Asynchronous successive halving: every trial starts with a small budget of
+# epochs (the first rung) and only the best 1/eta of the trials of a rung are
+# promoted to the next one, where they resume from their checkpoint with eta
+# times the budget, up to --n_epochs. A free worker either promotes a trial
+# or starts a new one, so workers never wait for a rung to be complete.
+#
+# The trials, their configurations and their validation metrics are stored in
+# a SQLite database in --search_dir: an interrupted search resumes from it.
+import os
+import copy
+import json
+import time
+import random
+import sqlite3
+import multiprocessing
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import torch
+
+from utils import fprint
+
+
+def search_space(args):
+    """Values of the hyper-parameters tried by the search, the same of the
+    wandb sweep
+
+    Args:
+        args: command line arguments
+
+    Returns:
+        space (dict): name -> list of values
+    """
+    space = {
+        "batch_size": [32, 64, 128, 256, 512],
+        "lr": [0.0001, 0.001, 0.01],
+        "weight_decay": [0.0, 0.0001, 0.001, 0.01, 0.1],
+    }
+
+    if "ltn" in args.model:
+        space["p"] = [2, 4, 6, 8, 10]
+        space["and_op"] = ["Godel", "Prod"]
+        space["or_op"] = ["Godel", "Prod"]
+        space["imp_op"] = ["Godel", "Prod"]
+
+    if args.c_sup > 0:
+        space["w_c"] = [1, 2, 5]
+
+    if args.entropy > 0:
+        space["w_h"] = [1, 2, 5, 8, 10]
+
+    return space
+
+
+def rung_epochs(min_epochs, max_epochs, eta):
+    """Epoch budgets of the rungs: min_epochs * eta^k, the last one being max_epochs
+
+    Args:
+        min_epochs (int): budget of the first rung
+        max_epochs (int): budget of the last rung
+        eta (int): reduction factor
+
+    Returns:
+        rungs (list): increasing epoch budgets
+    """
+    rungs = []
+    epochs = max(1, min_epochs)
+    while epochs < max_epochs:
+        rungs.append(epochs)
+        epochs *= eta
+    rungs.append(max_epochs)
+    return rungs
+
+
+class TrialStore:
+    """SQLite store of the trials of a search and of their results at each rung"""
+
+    def __init__(self, path: str):
+        """Initialize method
+
+        Args:
+            self: instance
+            path (str): database file
+
+        Returns:
+            None: This function does not return a value.
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS trials (
+                trial_id INTEGER PRIMARY KEY,
+                config TEXT NOT NULL,
+                status TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                trial_id INTEGER NOT NULL,
+                rung INTEGER NOT NULL,
+                epochs INTEGER NOT NULL,
+                metric REAL NOT NULL,
+                metrics TEXT NOT NULL,
+                time REAL NOT NULL,
+                PRIMARY KEY (trial_id, rung)
+            );
+            """
+        )
+        self.conn.commit()
+
+    def check_meta(self, meta: dict) -> None:
+        """Stores the settings of the search, or checks that a resumed search
+        has the same ones
+
+        Args:
+            self: instance
+            meta (dict): settings of the search
+
+        Returns:
+            None: This function does not return a value.
+        """
+        stored = dict(self.conn.execute("SELECT key, value FROM meta").fetchall())
+        if not stored:
+            self.conn.executemany(
+                "INSERT INTO meta VALUES (?, ?)",
+                [(k, json.dumps(v)) for k, v in meta.items()],
+            )
+            self.conn.commit()
+            return
+        for k, v in meta.items():
+            if k in stored and json.loads(stored[k]) != v:
+                raise ValueError(
+                    f"The search in {self.path} was started with {k}={json.loads(stored[k])}, "
+                    f"not {v}: use another --search_dir"
+                )
+
+    def add_trial(self, config: dict) -> int:
+        cur = self.conn.execute(
+            "INSERT INTO trials (config, status) VALUES (?, ?)",
+            (json.dumps(config), "running"),
+        )
+        self.conn.commit()
+        return cur.lastrowid
+
+    def set_status(self, trial_id: int, status: str) -> None:
+        self.conn.execute(
+            "UPDATE trials SET status = ? WHERE trial_id = ?", (status, trial_id)
+        )
+        self.conn.commit()
+
+    def add_result(self, trial_id, rung, epochs, metric, metrics) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+            (trial_id, rung, epochs, metric, json.dumps(metrics), time.time()),
+        )
+        self.conn.commit()
+
+    def trials(self) -> dict:
+        """All the trials
+
+        Args:
+            self: instance
+
+        Returns:
+            trials (dict): trial_id -> {"config", "status", "results": {rung: metric}}
+        """
+        trials = {}
+        for trial_id, config, status in self.conn.execute(
+            "SELECT trial_id, config, status FROM trials ORDER BY trial_id"
+        ):
+            trials[trial_id] = {
+                "config": json.loads(config),
+                "status": status,
+                "results": {},
+            }
+        for trial_id, rung, metric in self.conn.execute(
+            "SELECT trial_id, rung, metric FROM results"
+        ):
+            trials[trial_id]["results"][rung] = metric
+        return trials
+
+    def recover(self) -> None:
+        """Trials left running by an interrupted search go back to the pool:
+        the ones with results can be promoted again, the others restart
+
+        Args:
+            self: instance
+
+        Returns:
+            None: This function does not return a value.
+        """
+        self.conn.execute(
+            """UPDATE trials SET status = 'paused' WHERE status = 'running'
+            AND trial_id IN (SELECT trial_id FROM results)"""
+        )
+        self.conn.execute(
+            "UPDATE trials SET status = 'pending' WHERE status = 'running'"
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class ASHAScheduler:
+    """Decides the next job of a free worker, see the module comment"""
+
+    def __init__(self, store: TrialStore, space: dict, rungs: list, eta: int, count: int, seed=0):
+        """Initialize method
+
+        Args:
+            self: instance
+            store (TrialStore): trials
+            space (dict): search space
+            rungs (list): epoch budgets of the rungs
+            eta (int): reduction factor
+            count (int): number of trials
+            seed (int, default=0): seed of the sampling of the configurations
+
+        Returns:
+            None: This function does not return a value.
+        """
+        self.store = store
+        self.space = space
+        self.rungs = rungs
+        self.eta = eta
+        self.count = count
+        self.seed = seed
+
+    def sample(self, index: int) -> dict:
+        # each trial index has its own generator: a resumed search samples the same configurations
+        rng = random.Random(f"{self.seed}-{index}")
+        return {name: rng.choice(values) for name, values in self.space.items()}
+
+    def next_job(self):
+        """Next job: the promotion of a trial to the next rung if any, a pending
+        or a new trial otherwise
+
+        Args:
+            self: instance
+
+        Returns:
+            job (tuple): (trial_id, config, rung), None if there is nothing to run now
+        """
+        trials = self.store.trials()
+
+        # promotions, from the highest rung
+        for rung in reversed(range(len(self.rungs) - 1)):
+            reached = [
+                (t["results"][rung], trial_id)
+                for trial_id, t in trials.items()
+                if rung in t["results"]
+            ]
+            n_top = len(reached) // self.eta
+            top = sorted(reached, reverse=True)[:n_top]
+            for _, trial_id in top:
+                t = trials[trial_id]
+                if t["status"] == "paused" and rung + 1 not in t["results"]:
+                    return trial_id, t["config"], rung + 1
+
+        # trials of an interrupted search that never finished their first rung
+        for trial_id, t in trials.items():
+            if t["status"] == "pending":
+                return trial_id, t["config"], 0
+
+        if len(trials) < self.count:
+            config = self.sample(len(trials))
+            return self.store.add_trial(config), config, 0
+
+        return None
+
+
+def checkpoint_path(search_dir, trial_id):
+    return os.path.join(search_dir, f"trial_{trial_id}.pt")
+
+
+def run_trial(args_dict, config, ckpt_path, start_epoch, end_epoch, num_threads):
+    """Trains a configuration from start_epoch to end_epoch, resuming from its
+    checkpoint, and evaluates it on the validation set. Runs in a worker process
+
+    Args:
+        args_dict (dict): command line arguments
+        config (dict): hyper-parameters of the trial
+        ckpt_path (str): checkpoint of the trial
+        start_epoch (int): epochs already trained
+        end_epoch (int): epochs at the end of the job
+        num_threads (int): torch CPU threads of the worker
+
+    Returns:
+        metrics (dict): validation metrics
+    """
+    from datasets import get_dataset
+    from models import get_model
+    from utils.conf import set_random_seed
+    from utils.metrics import evaluate_metrics
+    from utils.train import prepare_training, train_epoch
+    from utils.logger import set_logger, close_logger, AsyncLogger, NullBackend
+    from warmup_scheduler import GradualWarmupScheduler
+
+    torch.set_num_threads(num_threads)
+    args = Namespace(**args_dict)
+    vars(args).update(config)
+    set_random_seed(args.seed if args.seed is not None else 42)
+    set_logger(AsyncLogger(NullBackend()))
+
+    dataset = get_dataset(args)
+    encoder, decoder = dataset.get_backbone()
+    n_images, c_split = dataset.get_split()
+    model = get_model(
+        args,
+        encoder,
+        decoder,
+        n_images,
+        c_split,
+        moco=args.moco,
+        moco_pretrained=args.moco_pretrained,
+    )
+    _loss = model.get_loss(args)
+    model.start_optim(args)
+    model.to(model.device)
+
+    train_loader, val_loader, _ = dataset.get_data_loaders()
+    scheduler = torch.optim.lr_scheduler.ExponentialLR(model.opt, args.exp_decay)
+    w_scheduler = None
+    if args.warmup_steps > 0:
+        w_scheduler = GradualWarmupScheduler(model.opt, 1.0, args.warmup_steps)
+
+    # the same steps as utils.train.train, the warm-up step at the first job only
+    step = prepare_training(model, dataset, _loss, args, warmup=start_epoch == 0)
+
+    if start_epoch > 0:
+        state = torch.load(ckpt_path, map_location=model.device)
+        model.load_state_dict(state["model"])
+        model.opt.load_state_dict(state["opt"])
+        scheduler.load_state_dict(state["scheduler"])
+        if w_scheduler is not None:
+            w_scheduler.load_state_dict(state["w_scheduler"])
+        step.scaler.load_state_dict(state["scaler"])
+        torch.set_rng_state(state["rng"])
+
+    for epoch in range(start_epoch, end_epoch):
+        train_epoch(model, train_loader, _loss, step, args, epoch)
+
+        # update at end of the epoch
+        if epoch < args.warmup_steps:
+            w_scheduler.step()
+        else:
+            scheduler.step()
+            if hasattr(_loss, "grade"):
+                _loss.update_grade(epoch)
+
+    model.eval()
+    tloss, cacc, yacc, f1 = evaluate_metrics(model, val_loader, args)
+
+    torch.save(
+        {
+            "model": model.state_dict(),
+            "opt": model.opt.state_dict(),
+            "scheduler": scheduler.state_dict(),
+            "w_scheduler": None if w_scheduler is None else w_scheduler.state_dict(),
+            "scaler": step.scaler.state_dict(),
+            "rng": torch.get_rng_state(),
+        },
+        ckpt_path,
+    )
+    close_logger()
+    return {"accuracy": yacc, "f1": f1, "cacc": cacc, "tloss": tloss}
+
+
+def summarize(store: TrialStore, rungs: list, path: str):
+    """Writes the trials of the search to a json file, from the best
+
+    Args:
+        store (TrialStore): trials
+        rungs (list): epoch budgets of the rungs
+        path (str): json file
+
+    Returns:
+        best (dict): best trial, the one with the best metric on the highest rung
+    """
+    trials = [
+        {"trial_id": trial_id, **t, "rung": max(t["results"], default=-1)}
+        for trial_id, t in store.trials().items()
+    ]
+    trials.sort(
+        key=lambda t: (t["rung"], t["results"].get(t["rung"], float("-inf"))),
+        reverse=True,
+    )
+    for t in trials:
+        t["epochs"] = rungs[t["rung"]] if t["rung"] >= 0 else 0
+        t["metric"] = t["results"].get(t["rung"])
+    with open(path, "w") as f:
+        json.dump({"rungs": rungs, "trials": trials}, f, indent=2)
+    return trials[0] if trials else None
+
+
+def asha_search(args):
+    """Local hyper-parameter search with ASHA over a process pool, maximizing
+    --val_metric on the validation set
+
+    Args:
+        args: command line arguments
+
+    Returns:
+        best (dict): best trial
+    """
+    name = args.search_name or f"{args.dataset}_{args.model}"
+    search_dir = os.path.join(args.search_dir, name)
+    os.makedirs(search_dir, exist_ok=True)
+
+    rungs = rung_epochs(args.min_epochs, args.n_epochs, args.eta)
+    space = search_space(args)
+    store = TrialStore(os.path.join(search_dir, "trials.db"))
+    store.check_meta({"rungs": rungs, "eta": args.eta, "space": space})
+    store.recover()
+    scheduler = ASHAScheduler(store, space, rungs, args.eta, args.count, args.seed or 0)
+
+    # the trials neither log nor save the final models
+    args_dict = copy.deepcopy(vars(args))
+    args_dict.update(tuning=True, wandb=None, logger="none")
+    workers = max(1, args.search_workers)
+    num_threads = args.num_threads or max(1, (os.cpu_count() or 1) // workers)
+
+    fprint(f"\n--- ASHA search in {search_dir}: {args.count} trials, rungs {rungs} epochs ---\n")
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        running = {}
+        while True:
+            while len(running) < workers:
+                job = scheduler.next_job()
+                if job is None:
+                    break
+                trial_id, config, rung = job
+                store.set_status(trial_id, "running")
+                start = rungs[rung - 1] if rung > 0 else 0
+                future = pool.submit(
+                    run_trial,
+                    args_dict,
+                    config,
+                    checkpoint_path(search_dir, trial_id),
+                    start,
+                    rungs[rung],
+                    num_threads,
+                )
+                running[future] = job
+                fprint(f"Trial {trial_id}, rung {rung} ({start} -> {rungs[rung]} epochs): {config}")
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                trial_id, config, rung = running.pop(future)
+                try:
+                    metrics = future.result()
+                except Exception as e:
+                    fprint(f"Trial {trial_id} failed: {e!r}")
+                    store.set_status(trial_id, "failed")
+                    continue
+                metric = metrics[args.val_metric]
+                store.add_result(trial_id, rung, rungs[rung], metric, metrics)
+                last = rung == len(rungs) - 1
+                store.set_status(trial_id, "done" if last else "paused")
+                fprint(f"Trial {trial_id}, rung {rung}: {args.val_metric} {metric:.4f}")
+
+    best = summarize(store, rungs, os.path.join(search_dir, "summary.json"))
+    store.close()
+    if best is not None:
+        fprint(
+            f"\nBest trial {best['trial_id']} ({args.val_metric} {best['metric']},",
+            f"{best['epochs']} epochs): {best['config']}",
+        )
+    return best
@@ -7,7 +7,8 @@ from datetime import datetime
 import sys
 import os
 from utils.conf import base_path
-from typing import Any, Dict, Union
+from typing import Any, Dict, List, Union
+import torch
 from torch import nn
 from argparse import Namespace
 
@@ -86,3 +87,105 @@ def progress_bar(i: int, max_iter: int, epoch: Union[int, str], loss: float) ->
         end="",
         flush=True,
     )
+
+
+class StepMetrics:
+    """Accumulates the loss and the loss diagnostics of the training steps on the
+    device, so that the training step never waits for the host.
+
+    The averages are copied to the host asynchronously by `flush`, and read one
+    flush later, when the copy has completed.
+    """
+
+    def __init__(self):
+        """Initialize method
+
+        Args:
+            self: instance
+
+        Returns:
+            None: This function does not return a value.
+        """
+        self.sums = {}
+        self.n_steps = 0
+        self.pending = None
+
+    def update(self, loss, losses=None) -> None:
+        """Adds the values of a step
+
+        Args:
+            self: instance
+            loss (torch.tensor): loss value
+            losses (dict, default=None): additional loss values, tensors or floats
+
+        Returns:
+            None: This function does not return a value.
+        """
+        values = {"loss": loss}
+        if losses is not None:
+            values.update(losses)
+
+        for key, value in values.items():
+            value = torch.as_tensor(value, device=loss.device).detach().float()
+            self.sums[key] = value if key not in self.sums else self.sums[key] + value
+        self.n_steps += 1
+
+    def _collect(self) -> Union[Dict[str, float], None]:
+        """Reads the averages of the previous flush
+
+        Args:
+            self: instance
+
+        Returns:
+            averages (dict): averages, None if there are none
+        """
+        if self.pending is None:
+            return None
+        keys, host, event = self.pending
+        self.pending = None
+        if event is not None:
+            event.synchronize()
+        return dict(zip(keys, host.tolist()))
+
+    def flush(self) -> Union[Dict[str, float], None]:
+        """Starts the copy of the averages accumulated since the last flush and
+        returns the ones of the previous flush
+
+        Args:
+            self: instance
+
+        Returns:
+            averages (dict): averages of the previous flush, None if there are none
+        """
+        ready = self._collect()
+
+        if self.n_steps > 0:
+            keys = list(self.sums.keys())
+            means = torch.stack([self.sums[k] for k in keys]) / self.n_steps
+
+            event = None
+            if means.is_cuda:
+                host = torch.empty(means.shape, dtype=means.dtype, pin_memory=True)
+                host.copy_(means, non_blocking=True)
+                event = torch.cuda.Event()
+                event.record()
+            else:
+                host = means
+            self.pending = (keys, host, event)
+
+        self.sums = {}
+        self.n_steps = 0
+        return ready
+
+    def finish(self) -> List[Dict[str, float]]:
+        """Flushes and waits for all the remaining averages
+
+        Args:
+            self: instance
+
+        Returns:
+            averages (list): averages not returned yet, oldest first
+        """
+        ready = self.flush()
+        last = self._collect()
+        return [a for a in (ready, last) if a is not None]
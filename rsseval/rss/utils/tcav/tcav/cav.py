@@ -27,11 +27,13 @@ def flatten_activations_and_get_labels(concepts, layer_name, activations):
 
 
 class CAV(object):
-    def __init__(self, concepts, layer_name, lr, model_type):
+    def __init__(self, concepts, layer_name, lr, model_type, n_jobs=None):
         self.concepts = concepts
         self.layer_name = layer_name
         self.lr = lr
         self.model_type = model_type
+        # workers for the One-Vs-All binary problems (-1: all cores)
+        self.n_jobs = n_jobs
 
     def train(self, activations):
         data, labels = flatten_activations_and_get_labels(
@@ -41,9 +43,9 @@ class CAV(object):
         # default setting is One-Vs-All
         assert self.model_type in ["linear", "logistic"]
         if self.model_type == "linear":
-            model = SGDClassifier(alpha=self.lr)
+            model = SGDClassifier(alpha=self.lr, n_jobs=self.n_jobs)
         else:
-            model = LogisticRegression()
+            model = LogisticRegression(n_jobs=self.n_jobs)
 
         x_train, x_test, y_train, y_test = train_test_split(
             data, labels, test_size=0.5, stratify=labels
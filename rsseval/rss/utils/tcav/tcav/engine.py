@@ -0,0 +1,236 @@
+import numpy as np
+from cav import CAV
+import os
+import hashlib
+import h5py
+import torch
+from tqdm import tqdm
+from torch.utils.data import ConcatDataset, DataLoader, Subset
+
+
+use_gpu = torch.cuda.is_available()
+if use_gpu:
+    device = torch.device("cuda")
+else:
+    device = torch.device("cpu")
+
+
+def binary_outputs_to_integer(outputs):
+    """Vectorized version of tcav.binary_list_to_integer over the argmax of
+    each pair of outputs (BOIA-like multilabel heads)
+
+    :param outputs: (batch, 2 * n_labels) model outputs
+    :return: (batch,) integer code of the predicted labels
+    """
+    bits = torch.argmax(outputs.view(outputs.size(0), -1, 2), dim=-1)
+    powers = 2 ** torch.arange(bits.size(1) - 1, -1, -1, device=bits.device)
+    return (bits * powers).sum(dim=1)
+
+
+def activation_cache_path(ckpt_path, dataset_name, model_name, seed, add=""):
+    """
+    Path of the h5 activation cache of a checkpoint. The name includes a hash
+    of the checkpoint path, last modification and size, so that retraining a
+    model does not reuse the activations of the previous one.
+    :param ckpt_path: path of the probed checkpoint
+    :param dataset_name: dataset name
+    :param model_name: model name
+    :param seed: seed of the model
+    :param add: suffix of the outputs
+    :return: h5 cache path
+    """
+    stat = os.stat(ckpt_path)
+    ckpt_id = f"{os.path.abspath(ckpt_path)}:{stat.st_mtime_ns}:{stat.st_size}"
+    ckpt_hash = hashlib.sha1(ckpt_id.encode()).hexdigest()[:16]
+    return f"output/activations_{dataset_name}_{model_name}_{seed}{add}_{ckpt_hash}.h5"
+
+
+def cache_activations(
+    model, path, concept_dataloaders, layer_names, max_samples, batch_size=256
+):
+    """
+    Computes the activations of all the concepts for all the layers in a single
+    batched pass and stores them in one chunked h5 file, as /<layer>/<concept>.
+    Concepts and layers already in the file are not recomputed.
+    :param model: ModelWrapper
+    :param path: h5 cache path
+    :param concept_dataloaders: OrderedDict concept -> dataloader
+    :param layer_names: layers to record
+    :param max_samples: max number of samples per concept
+    :param batch_size: batch size of the pass
+    :return:
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    with h5py.File(path, "a") as f:
+        missing = [
+            c
+            for c in concept_dataloaders
+            if any(f"{l}/{c}" not in f for l in layer_names)
+        ]
+    if len(missing) == 0:
+        return
+
+    # one dataset over all the (truncated) concept folders
+    subsets = []
+    for c in missing:
+        dataset = concept_dataloaders[c].dataset
+        subsets.append(Subset(dataset, range(min(len(dataset), max_samples))))
+    offsets = np.cumsum([0] + [len(s) for s in subsets])
+
+    model.eval()
+    activations = {l: [] for l in layer_names}
+    with torch.no_grad():
+        for data in tqdm(
+            DataLoader(ConcatDataset(subsets), batch_size=batch_size, shuffle=False),
+            desc="Caching concept activations",
+        ):
+            _ = model(data[0].to(device))
+            for l in layer_names:
+                activations[l].append(
+                    model.intermediate_activations[l].cpu().numpy()
+                )
+
+    with h5py.File(path, "a") as f:
+        for l in layer_names:
+            layer_acts = np.concatenate(activations[l], axis=0)
+            for i, c in enumerate(missing):
+                key = f"{l}/{c}"
+                if key in f:
+                    del f[key]
+                f.create_dataset(
+                    key, data=layer_acts[offsets[i] : offsets[i + 1]], chunks=True
+                )
+
+
+def load_cached_activations(path, concepts, layer_names):
+    """
+    :param path: h5 cache path
+    :param concepts: concept names
+    :param layer_names: layers to load
+    :return: concept -> layer -> activations, as expected by CAV
+    """
+    activations = {c: {} for c in concepts}
+    with h5py.File(path, "r") as f:
+        for l in layer_names:
+            for c in concepts:
+                activations[c][l] = np.array(f[f"{l}/{c}"])
+    return activations
+
+
+class TCAVEngine(object):
+    """
+    Batched counterpart of tcav.TCAV: activations for all concepts and layers
+    are computed in one pass into a shared h5 cache, the CAVs of all concepts
+    are fitted together and the directional derivatives w.r.t. all CAVs are
+    obtained from one vector-Jacobian product per input batch.
+    """
+
+    def __init__(
+        self,
+        model,
+        input_dataloader,
+        concept_dataloaders,
+        class_list,
+        max_samples,
+        is_boia,
+        cache_path,
+        batch_size=256,
+    ):
+        self.model = model
+        self.input_dataloader = input_dataloader
+        self.concept_dataloaders = concept_dataloaders
+        self.concepts = list(concept_dataloaders.keys())
+        self.cache_path = cache_path
+        self.max_samples = max_samples
+        self.batch_size = batch_size
+        self.lr = 1e-3
+        self.model_type = "linear"
+        self.class_list = list(class_list)
+        self.is_boia = is_boia
+        self._derivatives = {}
+
+    def generate_activations(self, layer_names):
+        cache_activations(
+            self.model,
+            self.cache_path,
+            self.concept_dataloaders,
+            layer_names,
+            self.max_samples,
+            self.batch_size,
+        )
+        self.layer_names = layer_names
+
+    def load_activations(self):
+        self.activations = load_cached_activations(
+            self.cache_path, self.concepts, self.layer_names
+        )
+
+    def generate_cavs(self, layer_name):
+        # one-vs-all over the concepts, the binary problems are fitted in parallel
+        cav_trainer = CAV(
+            self.concepts, layer_name, self.lr, self.model_type, n_jobs=-1
+        )
+        cav_trainer.train(self.activations)
+        self.cavs = cav_trainer.get_cav()
+
+    def directional_derivatives(self, layer_name):
+        """
+        Dot products between the output gradients at the layer and every CAV,
+        for all the input samples.
+        :param layer_name: layer of the CAVs
+        :return: (dots [n_samples, n_cavs], predicted classes, true concepts)
+        """
+        if layer_name in self._derivatives:
+            return self._derivatives[layer_name]
+
+        cavs = torch.as_tensor(self.cavs, dtype=torch.float32, device=device)
+
+        dots, classes, true_concepts = [], [], []
+        self.model.eval()
+        for x, _, c in tqdm(
+            DataLoader(
+                self.input_dataloader.dataset,
+                batch_size=self.batch_size,
+                shuffle=False,
+            ),
+            desc="Calculating directional derivatives",
+        ):
+            x = x.to(device)
+            outputs = self.model(x)
+
+            if self.is_boia:
+                k = binary_outputs_to_integer(outputs)
+            else:
+                k = torch.argmax(outputs, dim=1)
+
+            gradients = self.model.generate_batch_gradients(k, layer_name)
+            gradients = gradients.reshape(gradients.size(0), -1).to(torch.float32)
+
+            dots.append((gradients @ cavs.T).cpu().numpy())
+            classes.append(k.cpu().numpy())
+            true_concepts.append(np.asarray(c))
+
+        self._derivatives[layer_name] = (
+            np.concatenate(dots, axis=0),
+            np.concatenate(classes, axis=0),
+            np.concatenate(true_concepts, axis=0),
+        )
+        return self._derivatives[layer_name]
+
+    def calculate_tcav_score(self, layer_name, output_path):
+        dots, classes, _ = self.directional_derivatives(layer_name)
+
+        self.scores = np.zeros((self.cavs.shape[0], len(self.class_list)))
+        for i, k in enumerate(self.class_list):
+            mask = classes == k
+            if mask.sum() > 0:
+                self.scores[:, i] = (dots[mask] < 0).mean(axis=0)
+        np.save(output_path, self.scores)
+
+    def calculate_concept_presence(self, layer_name, output_path):
+        dots, _, _ = self.directional_derivatives(layer_name)
+
+        # same as tcav.directional_derivative_with_grad, for all CAVs at once
+        self.presence = np.where(dots < 0, np.abs(dots), 0)
+        np.save(output_path, self.presence)
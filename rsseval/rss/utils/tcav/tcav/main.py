@@ -1,5 +1,5 @@
 from torchvision import transforms
-from tcav import TCAV
+from engine import TCAVEngine, activation_cache_path
 import torch
 from model_wrapper import ModelWrapper
 from mydata import MyDataset
@@ -64,7 +64,15 @@ def data_loader(base_path, dataset_name):
 
 
 def validate(
-    model, dataset_name, validloader, concept_dict, class_dict, seed, model_name, add=""
+    model,
+    dataset_name,
+    validloader,
+    concept_dict,
+    class_dict,
+    seed,
+    model_name,
+    ckpt_path,
+    add="",
 ):
     extract_layer = None
     is_boia = True
@@ -83,8 +91,13 @@ def validate(
     if dataset_name in ["mnmath"]:
         extract_layer = "fc2"
 
+    # activations of all the concepts are cached per checkpoint
+    cache_path = activation_cache_path(ckpt_path, dataset_name, model_name, seed, add)
+
     model = ModelWrapper(model, [extract_layer], is_boia)
-    scorer = TCAV(model, validloader, concept_dict, class_dict.values(), 150, is_boia)
+    scorer = TCAVEngine(
+        model, validloader, concept_dict, class_dict.values(), 150, is_boia, cache_path
+    )
 
     print("Generating concepts...")
     scorer.generate_activations([extract_layer])
@@ -571,10 +584,27 @@ if __name__ == "__main__":
     sddoia_full = ""
     to_add = ""  # "_padd_random"
 
-    for i, seed in enumerate(seeds):
-        # get everything
-        args, dataset, model = setup()
+    is_clip = False
+    if "clip" in args.dataset:
+        is_clip = True
+
+    # data and concept folders do not depend on the seed: load them once
+    if args.dataset in ["shortmnist", "clipshortmnist"]:
+        validloader, class_dict, concept_dict = mnist_tcav_setup()
+    elif args.dataset in ["boia", "clipboia"]:
+        validloader, class_dict, concept_dict = boia_tcav_setup()
+    elif args.dataset in ["xor"]:
+        validloader, class_dict, concept_dict = xor_tcav_setup()
+    elif args.dataset in ["mnmath"]:
+        validloader, class_dict, concept_dict = mnmath_tcav_setup()
+    elif args.dataset in ["kandinsky", "minikandinsky", "clipkandinsky"]:
+        validloader, class_dict, concept_dict = kand_tcav_setup(is_clip)
+    elif args.dataset in ["sddoia", "clipsddoia"]:
+        if sddoia_full != "":
+            to_add = "_full"
+        validloader, class_dict, concept_dict = sddoia_tcav_setup()
 
+    for i, seed in enumerate(seeds):
         print("Doing seed", seed)
 
         current_model_path = f"{model_path}_{seed}.pth"
@@ -589,25 +619,6 @@ if __name__ == "__main__":
         model.load_state_dict(model_state_dict)
         model.eval()
 
-        is_clip = False
-        if "clip" in args.dataset:
-            is_clip = True
-
-        if args.dataset in ["shortmnist", "clipshortmnist"]:
-            validloader, class_dict, concept_dict = mnist_tcav_setup()
-        elif args.dataset in ["boia", "clipboia"]:
-            validloader, class_dict, concept_dict = boia_tcav_setup()
-        elif args.dataset in ["xor"]:
-            validloader, class_dict, concept_dict = xor_tcav_setup()
-        elif args.dataset in ["mnmath"]:
-            validloader, class_dict, concept_dict = mnmath_tcav_setup()
-        elif args.dataset in ["kandinsky", "minikandinsky", "clipkandinsky"]:
-            validloader, class_dict, concept_dict = kand_tcav_setup(is_clip)
-        elif args.dataset in ["sddoia", "clipsddoia"]:
-            if sddoia_full != "":
-                to_add = "_full"
-            validloader, class_dict, concept_dict = sddoia_tcav_setup()
-
         validate(
             model,
             args.dataset,
@@ -616,5 +627,6 @@ if __name__ == "__main__":
             class_dict,
             seed,
             args.model,
+            current_model_path,
             add=to_add,
         )
@@ -56,6 +56,22 @@ class ModelWrapper(object):
             gradients = self.gradients.cpu().detach().numpy()
         return gradients
 
+    def generate_batch_gradients(self, classes, layer_name):
+        """Per-sample gradients of the selected logits w.r.t. the layer, for
+        the whole batch with a single vector-Jacobian product (samples are
+        independent in eval mode)"""
+        activation = self.intermediate_activations[layer_name]
+        if self.is_boia:
+            # same logits as generate_gradients: one every output pair
+            weights = torch.zeros_like(self.output)
+            weights[:, 0::2] = 1
+        else:
+            weights = torch.nn.functional.one_hot(
+                classes, self.output.shape[1]
+            ).to(self.output.dtype)
+        (gradients,) = grad(self.output, activation, grad_outputs=weights)
+        return gradients.detach()
+
     def eval(self):
         self.model.eval()
 
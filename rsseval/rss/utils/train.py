@@ -5,11 +5,14 @@ import numpy as np
 import wandb
 import csv
 import os
+from argparse import Namespace
 from tqdm import tqdm
 
 from torchvision.utils import make_grid
 from utils.wandb_logger import *
-from utils.status import progress_bar
+from utils.logger import set_logger, close_logger, logger_from_args
+from utils.profiler import StepProfiler
+from utils.status import progress_bar, StepMetrics
 from datasets.utils.base_dataset import BaseDataset
 from models.mnistdpl import MnistDPL
 from utils.dpl_loss import ADDMNIST_DPL
@@ -20,6 +23,28 @@ from utils.metrics import (
     accuracy_binary,
 )
 from utils.generative import conditional_gen, recon_visaulization
+from utils.precision import (
+    amp_dtype,
+    make_grad_scaler,
+    maybe_compile,
+    forward_step,
+    check_parity,
+)
+from utils.losses import set_debug_checks
+from utils.distributed import (
+    is_main_process,
+    set_sampler_epoch,
+    full_loader,
+    wrap_model,
+    all_reduce_grads,
+    broadcast_tensors,
+)
+from utils.ensemble import (
+    stack_models,
+    unstack_models,
+    ensemble_optimizer,
+    ensemble_step,
+)
 from utils import fprint
 import matplotlib.pyplot as plt
 
@@ -204,6 +229,47 @@ def plot_actions_confusion_matrix(c_true, c_pred, title, save_path=None):
     return to_rtn
 
 
+def log_step_metrics(averages, i, epoch, max_iter, args):
+    """Logs the loss averages fetched from the device
+
+    Args:
+        averages (dict): averages of the loss values, None if there are none
+        i (int): iteration
+        epoch (int): epoch
+        max_iter (int): iterations per epoch
+        args: command line arguments
+
+    Returns:
+        None: This function does not return a value.
+    """
+    if averages is None:
+        return
+    loss = averages.pop("loss")
+    if not args.tuning:
+        wandb_log_step(i, epoch, loss, averages)
+    progress_bar(i, max_iter, epoch, loss)
+
+
+def best_model_path(args, seed):
+    """Path of the best checkpoint of a run, as loaded by evaluate.py
+
+    Args:
+        args: command line arguments
+        seed (int): seed of the run
+
+    Returns:
+        path (str): checkpoint path
+    """
+    to_add = ""
+    if args.model in ["kandcbm", "sddoiacbm", "boiacbm", "mnistcbm"]:
+        to_add = "_partial_sup"
+
+    if args.dataset in ["shortmnist"] and args.joint:
+        to_add += "_joint"
+
+    return f"best_model_{args.dataset}_{args.model}_{seed}{to_add}.pth"
+
+
 def save_embeddings(dataset: BaseDataset, device, name):
     dataset.return_embeddings = True
     dataset.args.batch_size = 1  # 1 as batch size
@@ -298,6 +364,148 @@ def save_predictions_to_csv(model, test_set, csv_name, dataset):
         writer.writerows(concatenated_tensor)
 
 
+def prepare_training(model, dataset, _loss, args, warmup=True):
+    """Training state shared by the training run and the hyper-parameter search:
+    optimizer warm-up, concept supervision, mixed precision and compiled modes
+
+    Args:
+        model (MnistDPL): network, with its optimizer
+        dataset (BaseDataset): dataset
+        _loss (ADDMNIST_DPL): loss function
+        args: parsed args
+        warmup (bool, default=True): default warm-up step of the optimizer
+
+    Returns:
+        step (Namespace): forward and loss functions, autocast dtype, gradient
+            scaler and concept supervision of the training steps
+    """
+    if warmup:
+        # default for warm-up
+        model.opt.zero_grad()
+        model.opt.step()
+
+    # load the small dataset containing concept supervision for Kandinsky
+    conc_sup = None
+    if args.model == "kandltn" and args.c_sup_ltn and args.dataset == "minikandinsky":
+        conc_sup = dataset.get_sup()
+
+    # mixed precision and compiled modes, both opt-in
+    dtype = amp_dtype(model.device, args.amp)
+    # in distributed mode the gradients are averaged over the ranks
+    forward, loss_fn = maybe_compile(wrap_model(model, args), _loss, args.compile)
+    return Namespace(
+        forward=forward,
+        loss_fn=loss_fn,
+        dtype=dtype,
+        scaler=make_grad_scaler(model.device, dtype),
+        conc_sup=conc_sup,
+        parity_checked=dtype is None and not args.compile,
+    )
+
+
+def train_epoch(model, loader, _loss, step, args, epoch, metrics=None, profiler=None):
+    """Trains the model for one epoch
+
+    Args:
+        model (MnistDPL): network
+        loader (DataLoader): training loader
+        _loss (ADDMNIST_DPL): loss function
+        step (Namespace): training state, see prepare_training
+        args: parsed args
+        epoch (int): epoch
+        metrics (StepMetrics, default=None): step metrics, logged every
+            log_every steps, not logged if None
+        profiler (StepProfiler, default=None): phase timers, none if None
+
+    Returns:
+        ys (torch.tensor): label predictions of the epoch
+        y_true (torch.tensor): labels of the epoch
+        cs (torch.tensor): concept predictions of the epoch
+        cs_true (torch.tensor): concepts of the epoch
+    """
+    profiler = StepProfiler() if profiler is None else profiler
+    model.train()
+    set_sampler_epoch(loader, epoch)
+
+    ys, y_true, cs, cs_true = None, None, None, None
+
+    for i, data in enumerate(profiler.iterate(loader)):
+        images, labels, concepts = data
+        with profiler.phase("to_device"):
+            images, labels, concepts = (
+                images.to(model.device),
+                labels.to(model.device),
+                concepts.to(model.device),
+            )
+
+        conc_preds = []
+        if step.conc_sup is not None:
+            # sample pos/neg images for square and red concepts and get predictions of the model
+            # this will be then used inside the LTN model
+            for c in step.conc_sup:
+                out = model.encoder.backbone(
+                    c[torch.randint(len(c), (args.batch_size,))]
+                )
+                shape, color = out[:, :3], out[:, 3:]
+                shape = torch.nn.Softmax(dim=-1)(shape)
+                color = torch.nn.Softmax(dim=-1)(color)
+                conc_preds.append(torch.cat([shape, color], dim=-1))
+            conc_preds = torch.stack(conc_preds, dim=0)
+
+        extra = {"conc_preds": conc_preds} if step.conc_sup is not None else None
+
+        if not step.parity_checked:
+            check_parity(
+                model,
+                _loss,
+                step.forward,
+                step.loss_fn,
+                (images, labels, concepts),
+                args,
+                step.dtype,
+                extra,
+            )
+            step.parity_checked = True
+
+        model.opt.zero_grad()
+        loss, losses, out_dict = forward_step(
+            step.forward,
+            step.loss_fn,
+            images,
+            labels,
+            concepts,
+            args,
+            step.dtype,
+            extra,
+        )
+
+        with profiler.phase("backward"):
+            step.scaler.scale(loss).backward()
+        with profiler.phase("optimizer"):
+            step.scaler.step(model.opt)
+            step.scaler.update()
+
+        if ys is None:
+            ys = out_dict["YS"].detach()
+            y_true = out_dict["LABELS"]
+            cs = out_dict["pCS"].detach()
+            cs_true = out_dict["CONCEPTS"]
+        else:
+            ys = torch.concatenate((ys, out_dict["YS"].detach()), dim=0)
+            y_true = torch.concatenate((y_true, out_dict["LABELS"]), dim=0)
+            cs = torch.concatenate((cs, out_dict["pCS"].detach()), dim=0)
+            cs_true = torch.concatenate((cs_true, out_dict["CONCEPTS"]), dim=0)
+
+        if metrics is not None:
+            metrics.update(loss, losses)
+            if i % args.log_every == 0:
+                log_step_metrics(metrics.flush(), i, epoch, len(loader), args)
+
+        profiler.step()
+
+    return ys, y_true, cs, cs_true
+
+
 def train(model: MnistDPL, dataset: BaseDataset, _loss: ADDMNIST_DPL, args):
     """TRAINING
 
@@ -317,14 +525,7 @@ def train(model: MnistDPL, dataset: BaseDataset, _loss: ADDMNIST_DPL, args):
     # best f1
     best_f1 = 0.0
 
-    to_add = ""
-    if args.model in ["kandcbm", "sddoiacbm", "boiacbm", "mnistcbm"]:
-        to_add = "_partial_sup"
-
-    if args.dataset in ["shortmnist"] and args.joint:
-        to_add += "_joint"
-
-    save_path = f"best_model_{args.dataset}_{args.model}_{args.seed}{to_add}.pth"
+    save_path = best_model_path(args, args.seed)
 
     # save embeddings variable
     save_embeddings_flag = False
@@ -347,7 +548,7 @@ def train(model: MnistDPL, dataset: BaseDataset, _loss: ADDMNIST_DPL, args):
     if args.warmup_steps > 0:
         w_scheduler = GradualWarmupScheduler(model.opt, 1.0, args.warmup_steps)
 
-    if not args.tuning and args.wandb is not None:
+    if not args.tuning and args.wandb is not None and is_main_process():
         fprint("\n---wandb on\n")
         wandb.init(
             project=args.project,
@@ -356,75 +557,34 @@ def train(model: MnistDPL, dataset: BaseDataset, _loss: ADDMNIST_DPL, args):
             config=args,
         )
 
+    # buffered logger of the run, on wandb, a local file or nothing (--logger)
+    set_logger(logger_from_args(args, f"{args.dataset}_{args.model}_{args.seed}"))
+
     fprint("\n--- Start of Training ---\n")
 
-    # default for warm-up
-    model.opt.zero_grad()
-    model.opt.step()
+    step = prepare_training(model, dataset, _loss, args)
 
-    # load the small dataset containing concept supervision for Kandinsky
-    conc_sup = None
-    if args.model == "kandltn" and args.c_sup_ltn and args.dataset == "minikandinsky":
-        conc_sup = dataset.get_sup()
+    # the loss values are accumulated on device and fetched every log_every steps
+    set_debug_checks(args.debug_checks)
+    metrics = StepMetrics()
 
-    for epoch in range(args.n_epochs):
-        model.train()
+    # phase timers and torch.profiler window, no-ops without --profile
+    profiler = StepProfiler(args.profile)
+    profiler.instrument(model)
+    step.forward = profiler.wrap(step.forward, "forward")
+    step.loss_fn = profiler.wrap(step.loss_fn, "loss")
+    profiler.start_trace(args.profile_trace_steps, args.profile_dir)
 
-        ys, y_true, cs, cs_true = None, None, None, None
+    for epoch in range(args.n_epochs):
+        ys, y_true, cs, cs_true = train_epoch(
+            model, train_loader, _loss, step, args, epoch, metrics, profiler
+        )
 
-        for i, data in enumerate(train_loader):
-            images, labels, concepts = data
-            images, labels, concepts = (
-                images.to(model.device),
-                labels.to(model.device),
-                concepts.to(model.device),
+        for averages in metrics.finish():
+            log_step_metrics(
+                averages, len(train_loader) - 1, epoch, len(train_loader), args
             )
 
-            conc_preds = []
-            if conc_sup is not None:
-                # sample pos/neg images for square and red concepts and get predictions of the model
-                # this will be then used inside the LTN model
-                for c in conc_sup:
-                    out = model.encoder.backbone(
-                        c[torch.randint(len(c), (args.batch_size,))]
-                    )
-                    shape, color = out[:, :3], out[:, 3:]
-                    shape = torch.nn.Softmax(dim=-1)(shape)
-                    color = torch.nn.Softmax(dim=-1)(color)
-                    conc_preds.append(torch.cat([shape, color], dim=-1))
-                conc_preds = torch.stack(conc_preds, dim=0)
-
-            out_dict = model(images)
-            out_dict.update({"LABELS": labels, "CONCEPTS": concepts})
-
-            # out_dict.update({"INPUTS": images, "LABELS": labels, "CONCEPTS": concepts})
-
-            if conc_sup is not None:
-                out_dict.update({"conc_preds": conc_preds})
-
-            model.opt.zero_grad()
-            loss, losses = _loss(out_dict, args)
-
-            loss.backward()
-            model.opt.step()
-
-            if ys is None:
-                ys = out_dict["YS"]
-                y_true = out_dict["LABELS"]
-                cs = out_dict["pCS"]
-                cs_true = out_dict["CONCEPTS"]
-            else:
-                ys = torch.concatenate((ys, out_dict["YS"]), dim=0)
-                y_true = torch.concatenate((y_true, out_dict["LABELS"]), dim=0)
-                cs = torch.concatenate((cs, out_dict["pCS"]), dim=0)
-                cs_true = torch.concatenate((cs_true, out_dict["CONCEPTS"]), dim=0)
-
-            if not args.tuning and args.wandb is not None:
-                wandb_log_step(i, epoch, loss.item(), losses)
-
-            if i % 10 == 0:
-                progress_bar(i, len(train_loader) - 9, epoch, loss.item())
-
         if args.task == "mnmath":
             y_pred = (ys > 0.5).to(torch.long)
         else:
@@ -464,7 +624,8 @@ def train(model: MnistDPL, dataset: BaseDataset, _loss: ADDMNIST_DPL, args):
             )
 
         model.eval()
-        tloss, cacc, yacc, f1 = evaluate_metrics(model, val_loader, args)
+        with profiler.phase("metrics"):
+            tloss, cacc, yacc, f1 = evaluate_metrics(model, val_loader, args)
 
         # update at end of the epoch
         if epoch < args.warmup_steps:
@@ -475,9 +636,7 @@ def train(model: MnistDPL, dataset: BaseDataset, _loss: ADDMNIST_DPL, args):
                 _loss.update_grade(epoch)
 
         if args.tuning:
-            wandb.log({"accuracy": yacc})
-            wandb.log({"f1": f1})
-            wandb.log({"cacc": cacc})
+            wandb_log({"accuracy": yacc, "f1": f1, "cacc": cacc})
 
         ### LOGGING ###
         fprint("  ACC C", cacc, "  ACC Y", yacc, "F1 Y", f1)
@@ -488,10 +647,11 @@ def train(model: MnistDPL, dataset: BaseDataset, _loss: ADDMNIST_DPL, args):
             best_f1 = f1
 
             # Save the best model
-            torch.save(model.state_dict(), save_path)
+            if is_main_process():
+                torch.save(model.state_dict(), save_path)
             print(f"Saved best model with F1 score: {best_f1}")
 
-        if not args.tuning and args.wandb is not None:
+        if not args.tuning:
             wandb_log_epoch(
                 epoch=epoch,
                 acc=yacc,
@@ -500,6 +660,8 @@ def train(model: MnistDPL, dataset: BaseDataset, _loss: ADDMNIST_DPL, args):
                 lr=float(scheduler.get_last_lr()[0]),
             )
 
+    profiler.finish(args.profile_dir)
+
     if args.dataset in ["clipshortmnist", "shortmnist"]:
         pass
     elif not args.tuning:
@@ -513,6 +675,11 @@ def train(model: MnistDPL, dataset: BaseDataset, _loss: ADDMNIST_DPL, args):
                 evaluate_metrics(model, test_loader, args, last=True)
             )
 
+        # the evaluation is gathered on all the ranks, rank 0 reports it
+        if not is_main_process():
+            close_logger()
+            return
+
         if "patterns" not in args.task:
             yac, yf1 = evaluate_mix(y_true, y_pred)
             cac, cf1 = evaluate_mix(c_true, c_pred)
@@ -639,15 +806,22 @@ def train(model: MnistDPL, dataset: BaseDataset, _loss: ADDMNIST_DPL, args):
         # move model to cpu
         model.device = "cpu"
         model.to(model.device)
-        save_predictions_to_csv(model, test_loader, csv_name, args.dataset)
+        save_predictions_to_csv(model, full_loader(test_loader), csv_name, args.dataset)
 
-        if not args.tuning and args.wandb is not None:
-            K = max(max(y_pred), max(y_true))
+        if "patterns" not in args.task:
+            wandb_log(
+                {
+                    "test-y-acc": yac * 100,
+                    "test-y-f1": yf1 * 100,
+                    "test-c-acc": cac * 100,
+                    "test-c-f1": cf1 * 100,
+                }
+            )
 
-            wandb.log({"test-y-acc": yac * 100, "test-y-f1": yf1 * 100})
-            wandb.log({"test-c-acc": cac * 100, "test-c-f1": cf1 * 100})
+        if args.wandb is not None:
+            K = max(max(y_pred), max(y_true))
 
-            wandb.log(
+            wandb_log(
                 {
                     "cf-labels": wandb.plot.confusion_matrix(
                         None, y_true, y_pred, class_names=[str(i) for i in range(K + 1)]
@@ -655,7 +829,7 @@ def train(model: MnistDPL, dataset: BaseDataset, _loss: ADDMNIST_DPL, args):
                 }
             )
             K = max(np.max(c_pred), np.max(c_true))
-            wandb.log(
+            wandb_log(
                 {
                     "cf-concepts": wandb.plot.confusion_matrix(
                         None, c_true, c_pred, class_names=[str(i) for i in range(K + 1)]
@@ -669,10 +843,133 @@ def train(model: MnistDPL, dataset: BaseDataset, _loss: ADDMNIST_DPL, args):
                     nrow=8,
                 )
                 images = wandb.Image(list_images, caption="Generated samples")
-                wandb.log({"Conditional Gen": images})
+                wandb_log({"Conditional Gen": images})
 
                 list_images = make_grid(recon_visaulization(out_dict), nrow=8)
                 images = wandb.Image(list_images, caption="Reconstructed samples")
-                wandb.log({"Reconstruction": images})
+                wandb_log({"Reconstruction": images})
 
+            # the pending records are written before closing the run
+            close_logger()
             wandb.finish()
+
+    close_logger()
+
+
+def train_ensemble(models, dataset: BaseDataset, _loss, args):
+    """TRAINING of the copies of a model, one per seed of --ensemble_seeds, in a
+    single vectorized loop: the copies share the batches, while parameters and
+    optimizer states stay independent. The best checkpoint of each seed is saved
+    as in train. Under torchrun the stacked gradients are averaged over the ranks
+    and the buffers are those of rank 0, as with DistributedDataParallel
+
+    Args:
+        models (list): copies of the network, see utils.ensemble.init_models
+        dataset (BaseDataset): dataset
+        _loss: loss function
+        args: parsed args
+
+    Returns:
+        None: This function does not return a value.
+    """
+    seeds = args.ensemble_seeds
+    base = models[0]
+    device = base.device
+    for model in models:
+        model.to(device)
+
+    train_loader, val_loader, test_loader = dataset.get_data_loaders()
+    dataset.print_stats()
+
+    params, buffers = stack_models(models, device)
+    opt = ensemble_optimizer(base, params)
+    scheduler = torch.optim.lr_scheduler.ExponentialLR(opt, args.exp_decay)
+    w_scheduler = None
+    if args.warmup_steps > 0:
+        w_scheduler = GradualWarmupScheduler(opt, 1.0, args.warmup_steps)
+
+    if not args.tuning and args.wandb is not None and is_main_process():
+        fprint("\n---wandb on\n")
+        wandb.init(
+            project=args.project,
+            entity=args.wandb,
+            name=str(args.dataset) + "_" + str(args.model) + "_ensemble",
+            config=args,
+        )
+    set_logger(logger_from_args(args, f"{args.dataset}_{args.model}_ensemble"))
+
+    # the checks on the loss values are data-dependent control flow, not allowed under vmap
+    set_debug_checks(False)
+
+    best_f1 = [0.0] * len(models)
+
+    fprint(f"\n--- Start of Training ({len(models)} seeds) ---\n")
+
+    for epoch in range(args.n_epochs):
+        base.train()
+        set_sampler_epoch(train_loader, epoch)
+        epoch_loss = torch.zeros(len(models), device=device)
+
+        for i, data in enumerate(train_loader):
+            images, labels, concepts = data
+            images, labels, concepts = (
+                images.to(device),
+                labels.to(device),
+                concepts.to(device),
+            )
+
+            opt.zero_grad(set_to_none=True)
+            loss, _ = ensemble_step(
+                base, params, buffers, _loss, images, labels, concepts, args
+            )
+            # the copies do not interact: the gradient of the sum is the gradient of each loss
+            loss.sum().backward()
+            all_reduce_grads(params.values())
+            opt.step()
+
+            epoch_loss += loss.detach()
+            if i % args.log_every == 0:
+                progress_bar(i, len(train_loader), epoch, loss.mean().item())
+
+        epoch_loss = (epoch_loss / max(len(train_loader), 1)).tolist()
+
+        # evaluation and checkpoints of each seed on its own copy
+        broadcast_tensors(buffers.values())
+        unstack_models(models, params, buffers)
+        for k, (seed, model) in enumerate(zip(seeds, models)):
+            model.eval()
+            tloss, cacc, yacc, f1 = evaluate_metrics(model, val_loader, args)
+            fprint(
+                f"  seed {seed}: train loss {epoch_loss[k]:.4f}",
+                "  ACC C", cacc, "  ACC Y", yacc, "F1 Y", f1,
+            )
+
+            if not args.tuning:
+                wandb_log_epoch_prefix(
+                    f"seed-{seed}",
+                    epoch=epoch,
+                    acc=yacc,
+                    cacc=cacc,
+                    tloss=tloss,
+                    lr=float(scheduler.get_last_lr()[0]),
+                )
+
+            if f1 > best_f1[k]:
+                best_f1[k] = f1
+                if is_main_process():
+                    torch.save(model.state_dict(), best_model_path(args, seed))
+
+        # update at end of the epoch
+        if epoch < args.warmup_steps:
+            w_scheduler.step()
+        else:
+            scheduler.step()
+            if hasattr(_loss, "grade"):
+                _loss.update_grade(epoch)
+
+    for seed, f1 in zip(seeds, best_f1):
+        fprint(f"Best F1 of seed {seed}: {f1}, saved to {best_model_path(args, seed)}")
+
+    close_logger()
+    if args.wandb is not None and not args.tuning and is_main_process():
+        wandb.finish()
@@ -1,6 +1,10 @@
 # Module which logs stuff on wandb
+#
+# The records go through the asynchronous logger of the run (utils.logger),
+# whose backend is wandb, a local file or nothing
 
 import wandb
+from utils.logger import get_logger
 
 
 def wandb_log_step(i: int, epoch: int, loss, losses=None):
@@ -14,9 +18,10 @@ def wandb_log_step(i: int, epoch: int, loss, losses=None):
     Returns:
         None: This function does not return a value.
     """
-    wandb.log({"loss": loss, "epoch": epoch, "step": i})
+    record = {"loss": loss, "epoch": epoch, "step": i}
     if losses is not None:
-        wandb.log(losses)
+        record.update(losses)
+    get_logger().log(record)
 
 
 def wandb_log_epoch(**kwargs):
@@ -31,13 +36,11 @@ def wandb_log_epoch(**kwargs):
     epoch = kwargs["epoch"]
     acc = kwargs["acc"]
     c_acc = kwargs["cacc"]
-    wandb.log({"acc": acc, "c-acc": c_acc, "epoch": epoch})
-
     lr = kwargs["lr"]
-    wandb.log({"lr": lr})
-
     tloss = kwargs["tloss"]
-    wandb.log({"test-loss": tloss})
+    get_logger().log(
+        {"acc": acc, "c-acc": c_acc, "epoch": epoch, "lr": lr, "test-loss": tloss}
+    )
 
 
 def wand_log_end(t_acc, t_c_acc):
@@ -49,7 +52,7 @@ def wand_log_end(t_acc, t_c_acc):
         None: This function does not return a value.
     """
     # log score metrics
-    wandb.log({"test-acc": t_acc, "test-c_acc": t_c_acc})
+    get_logger().log({"test-acc": t_acc, "test-c_acc": t_c_acc})
 
 
 def wandb_log_step_prefix(prefix, i, epoch, loss, losses=None):
@@ -65,9 +68,10 @@ def wandb_log_step_prefix(prefix, i, epoch, loss, losses=None):
     Returns:
         None: This function does not return a value.
     """
-    wandb.log({f"{prefix}_loss": loss, f"{prefix}_epoch": epoch, f"{prefix}_step": i})
+    record = {f"{prefix}_loss": loss, f"{prefix}_epoch": epoch, f"{prefix}_step": i}
     if losses is not None:
-        wandb.log(losses)
+        record.update(losses)
+    get_logger().log(record)
 
 
 def wandb_log_epoch_prefix(prefix, **kwargs):
@@ -87,12 +91,26 @@ def wandb_log_epoch_prefix(prefix, **kwargs):
     epoch = kwargs["epoch"]
     acc = kwargs["acc"]
     c_acc = kwargs["cacc"]
-    wandb.log(
-        {f"{prefix}_acc": acc, f"{prefix}_c-acc": c_acc, f"{prefix}_epoch": epoch}
+    lr = kwargs["lr"]
+    tloss = kwargs["tloss"]
+    get_logger().log(
+        {
+            f"{prefix}_acc": acc,
+            f"{prefix}_c-acc": c_acc,
+            f"{prefix}_epoch": epoch,
+            f"{prefix}_lr": lr,
+            f"{prefix}_test-loss": tloss,
+        }
     )
 
-    lr = kwargs["lr"]
-    wandb.log({f"{prefix}_lr": lr})
 
-    tloss = kwargs["tloss"]
-    wandb.log({f"{prefix}_test-loss": tloss})
+def wandb_log(record: dict):
+    """Logs a dictionary of metrics (or wandb objects, on the wandb backend)
+
+    Args:
+        record (dict): metrics
+
+    Returns:
+        None: This function does not return a value.
+    """
+    get_logger().log(record)
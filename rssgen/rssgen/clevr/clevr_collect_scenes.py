@@ -5,7 +5,9 @@
 # LICENSE file in the root directory of this source tree. An additional grant
 # of patent rights can be found in the PATENTS file in the same directory.
 
-import argparse, json, os
+import argparse, heapq, json, os, re
+from collections import deque
+from multiprocessing import Pool
 
 """
 During rendering, each CLEVR scene file is dumped to disk as a separate JSON
@@ -13,6 +15,13 @@ file; this is convenient for distributing rendering across multiple machines.
 This script collects all CLEVR scene files stored in a directory and combines
 them into a single JSON file. This script also adds the version number, date,
 and license to the output file.
+
+The scenes are parsed in parallel and streamed to the output in the order of
+their image index. The files are read in the order of the index in their name;
+a scene which comes out of order waits in a small buffer (--reorder_buffer) until
+it can be written, so that only a few scenes are in memory at once. With
+--format jsonl the output has the info on its first line and then one scene
+per line, which can be read back scene by scene.
 """
 
 parser = argparse.ArgumentParser()
@@ -21,39 +30,149 @@ parser.add_argument("--output_file", default="../../out/CLEVR_misc_scenes.json")
 parser.add_argument("--version", default="1.0")
 parser.add_argument("--date", default="7/8/2017")
 parser.add_argument("--license", default="Creative Commons Attribution (CC-BY 4.0")
+parser.add_argument(
+    "--format",
+    default="json",
+    choices=["json", "jsonl"],
+    help="A single JSON object, or the info and then one scene per line",
+)
+parser.add_argument(
+    "--num_workers",
+    default=os.cpu_count(),
+    type=int,
+    help="Number of processes parsing the scene files, 0 parses them inline",
+)
+parser.add_argument(
+    "--chunksize",
+    default=64,
+    type=int,
+    help="Number of scene files sent at once to a worker, at most "
+    "2 * num_workers chunks are parsed ahead of the output",
+)
+
+parser.add_argument(
+    "--reorder_buffer",
+    default=4096,
+    type=int,
+    help="Number of scenes held to restore the order of the image index when "
+    "the file names are not in that order, 0 holds all of them",
+)
+
+# index at the end of the scene files of the renderer, e.g. CLEVR_train_000042.json
+SCENE_INDEX = re.compile(r"(\d+)\.json$")
+
+
+def scene_files(input_dir):
+    """Scene files of the folder, in the order of the index in their name"""
+    filenames = [f for f in os.listdir(input_dir) if f.endswith(".json")]
+
+    def key(filename):
+        match = SCENE_INDEX.search(filename)
+        return (int(match.group(1)) if match else -1, filename)
+
+    return [os.path.join(input_dir, f) for f in sorted(filenames, key=key)]
+
+
+def read_scene(path):
+    """Parses a scene file, returns it serialized on one line with its split
+    and its image index"""
+    with open(path, "r") as f:
+        scene = json.load(f)
+    return json.dumps(scene), scene["split"], scene["image_index"]
+
+
+def read_scenes(paths):
+    """Parses a chunk of scene files, see read_scene"""
+    return [read_scene(path) for path in paths]
+
+
+def iter_scenes(paths, num_workers, chunksize):
+    """Scenes of the files, in order, parsed by num_workers processes. The
+    files are sent in chunks of chunksize, with at most 2 * num_workers chunks
+    in flight, so that the parsed scenes waiting to be written stay bounded"""
+    if num_workers == 0:
+        yield from map(read_scene, paths)
+        return
+
+    chunks = (paths[i : i + chunksize] for i in range(0, len(paths), chunksize))
+    pending = deque()
+    with Pool(num_workers) as pool:
+        for chunk in chunks:
+            pending.append(pool.apply_async(read_scenes, (chunk,)))
+            if len(pending) >= 2 * num_workers:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def sort_scenes(scenes, buffer_size):
+    """Yields the (scene, split, image_index) of scenes in the order of the
+    image index, holding at most buffer_size scenes (all of them if 0): the
+    input is expected to be almost sorted, e.g. sorted by file name. Scenes
+    with the same index keep their input order.
+
+    Raises:
+        ValueError: if a scene is more than buffer_size positions out of order
+    """
+    heap, last_index = [], None
+
+    def pop():
+        nonlocal last_index
+        index, _, scene, split = heapq.heappop(heap)
+        if last_index is not None and index < last_index:
+            raise ValueError(
+                f"Scene {index} is more than {buffer_size} files out of order, "
+                "increase --reorder_buffer (0 holds all the scenes)"
+            )
+        last_index = index
+        return scene, split, index
+
+    for n, (scene, split, index) in enumerate(scenes):
+        heapq.heappush(heap, (index, n, scene, split))
+        if 0 < buffer_size < len(heap):
+            yield pop()
+    while heap:
+        yield pop()
 
 
 def main(args):
     """Collect the scenes in a single one"""
-    input_files = os.listdir(args.input_dir)
-    scenes = []
+    paths = scene_files(args.input_dir)
+
+    # the split of the first scene, the others are checked while streaming
     split = None
-    for filename in os.listdir(args.input_dir):
-        if not filename.endswith(".json"):
-            continue
-        path = os.path.join(args.input_dir, filename)
-        with open(path, "r") as f:
-            scene = json.load(f)
-        scenes.append(scene)
-        if split is not None:
-            msg = "Input directory contains scenes from multiple splits"
-            assert scene["split"] == split, msg
-        else:
-            split = scene["split"]
-    scenes.sort(key=lambda s: s["image_index"])
-    for s in scenes:
-        print(s["image_filename"])
-    output = {
-        "info": {
-            "date": args.date,
-            "version": args.version,
-            "split": split,
-            "license": args.license,
-        },
-        "scenes": scenes,
+    if len(paths) > 0:
+        with open(paths[0], "r") as f:
+            split = json.load(f)["split"]
+    info = {
+        "date": args.date,
+        "version": args.version,
+        "split": split,
+        "license": args.license,
     }
+
     with open(args.output_file, "w") as f:
-        json.dump(output, f)
+        if args.format == "json":
+            f.write('{"info": %s, "scenes": [' % json.dumps(info))
+        else:
+            f.write(json.dumps({"info": info}) + "\n")
+
+        scenes = sort_scenes(
+            iter_scenes(paths, args.num_workers, args.chunksize), args.reorder_buffer
+        )
+        for n, (scene, scene_split, _) in enumerate(scenes):
+            msg = "Input directory contains scenes from multiple splits"
+            assert scene_split == split, msg
+
+            if args.format == "json":
+                f.write(scene if n == 0 else ", " + scene)
+            else:
+                f.write(scene + "\n")
+
+        if args.format == "json":
+            f.write("]}")
+
+    print(f"Collected {len(paths)} scenes in {args.output_file}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,196 @@
+# Module which contains the layout solver of the CLEVR scenes and the spatial
+# relationships of their objects
+#
+# The layout of a scene, the (x, y, r, theta) of its objects on the ground
+# plane, does not depend on Blender: it is solved here and the renderer only
+# instantiates it. Each object is placed by drawing a batch of candidate
+# positions at once and keeping the first one which respects the minimum
+# distance and the directional margins from the objects already placed; when
+# an object has no valid candidate the layout is restarted, which costs no
+# Blender call.
+import math
+import numpy as np
+
+# cardinal directions constraining the margins
+MARGIN_DIRECTIONS = ("left", "right", "front", "behind")
+
+
+class LayoutError(RuntimeError):
+    """No valid layout found within the allowed restarts"""
+
+
+def _direction_matrix(directions):
+    """(2, 4) ground-plane components of the cardinal directions
+
+    Args:
+        directions (dict): directions of the scene struct, name to (x, y, z)
+
+    Returns:
+        matrix (np.ndarray): x and y components of the margin directions
+    """
+    for name in MARGIN_DIRECTIONS:
+        assert directions[name][2] == 0
+    return np.array([directions[name][:2] for name in MARGIN_DIRECTIONS]).T
+
+
+def valid_positions(candidates, r, placed, directions, min_dist, margin):
+    """Which candidate positions of an object of radius r are further than
+    min_dist from the placed objects, and not within margin of any of them
+    along the four cardinal directions
+
+    Args:
+        candidates (np.ndarray): (K, 2) candidate x, y
+        r (float): radius of the object
+        placed (np.ndarray): (n, 3) x, y, radius of the placed objects
+        directions (np.ndarray): (2, 4) cardinal directions, see _direction_matrix
+        min_dist (float): minimum distance between the objects
+        margin (float): minimum margin along the cardinal directions
+
+    Returns:
+        valid (np.ndarray): (K,) whether the candidates are valid
+    """
+    if len(placed) == 0:
+        return np.ones(len(candidates), dtype=bool)
+
+    # (K, n, 2) offsets from the placed objects
+    diff = candidates[:, None, :] - placed[None, :, :2]
+    dist = np.sqrt((diff**2).sum(-1))
+    dists_good = (dist - r - placed[None, :, 2] >= min_dist).all(1)
+
+    # (K, n, 4) projections on the cardinal directions
+    proj = diff @ directions
+    margins_good = ~((proj > 0) & (proj < margin)).any(axis=(1, 2))
+    return dists_good & margins_good
+
+
+def solve_layout(
+    radii,
+    directions,
+    min_dist,
+    margin,
+    rng,
+    footprints=None,
+    extent=3.0,
+    max_retries=50,
+    max_restarts=1000,
+):
+    """Solves the layout of a scene
+
+    Args:
+        radii (list): radius of each object when it is placed
+        directions (dict): directions of the scene struct, name to (x, y, z)
+        min_dist (float): minimum distance between the objects
+        margin (float): minimum margin along the cardinal directions
+        rng (np.random.Generator): random generator
+        footprints (list, default=None): radius that each object keeps once
+            placed (the cubes are shrunk), the radii by default
+        extent (float, default=3.0): positions are drawn in [-extent, extent]^2
+        max_retries (int, default=50): candidate positions drawn for an object
+            before restarting the layout
+        max_restarts (int, default=1000): restarts before giving up
+
+    Returns:
+        layout (list): (x, y, r, theta) of the objects, r being the footprint
+
+    Raises:
+        LayoutError: if no valid layout is found
+    """
+    footprints = radii if footprints is None else footprints
+    directions = _direction_matrix(directions)
+
+    for _ in range(max_restarts):
+        placed = np.empty((0, 3))
+        for r, footprint in zip(radii, footprints):
+            candidates = rng.uniform(-extent, extent, size=(max_retries, 2))
+            valid = valid_positions(candidates, r, placed, directions, min_dist, margin)
+            if not valid.any():
+                break
+            x, y = candidates[np.argmax(valid)]
+            placed = np.vstack([placed, [x, y, footprint]])
+        else:
+            thetas = rng.uniform(0.0, 360.0, size=len(radii))
+            return [
+                (float(x), float(y), float(r), float(theta))
+                for (x, y, r), theta in zip(placed, thetas)
+            ]
+
+    raise LayoutError(
+        f"no layout of {len(radii)} objects found in {max_restarts} restarts"
+    )
+
+
+def solve_layouts(n_layouts, radii, directions, min_dist, margin, rng, **kwargs):
+    """Solves n_layouts layouts of the same objects, see solve_layout
+
+    Args:
+        n_layouts (int): number of layouts
+        radii (list): radius of each object when it is placed
+        directions (dict): directions of the scene struct, name to (x, y, z)
+        min_dist (float): minimum distance between the objects
+        margin (float): minimum margin along the cardinal directions
+        rng (np.random.Generator): random generator
+        kwargs: other arguments of solve_layout
+
+    Returns:
+        layouts (list): the layouts
+    """
+    return [
+        solve_layout(radii, directions, min_dist, margin, rng, **kwargs)
+        for _ in range(n_layouts)
+    ]
+
+
+def check_layout(layout, radii, directions, min_dist, margin):
+    """Whether a layout respects the constraints, in the order of placement
+
+    Args:
+        layout (list): (x, y, r, theta) of the objects
+        radii (list): radius of each object when it is placed
+        directions (dict): directions of the scene struct, name to (x, y, z)
+        min_dist (float): minimum distance between the objects
+        margin (float): minimum margin along the cardinal directions
+
+    Returns:
+        valid (bool): whether the layout is valid
+    """
+    directions = _direction_matrix(directions)
+    placed = np.array([obj[:3] for obj in layout], dtype=float).reshape(-1, 3)
+    return all(
+        valid_positions(placed[i : i + 1, :2], r, placed[:i], directions, min_dist, margin)[0]
+        for i, r in enumerate(radii)
+    )
+
+
+def cube_footprint(r):
+    """Radius of a cube of size r, which is shrunk to fit the size"""
+    return r / math.sqrt(2)
+
+
+def compute_relationships(coords, directions, eps=0.2):
+    """Spatial relationships between all the pairs of objects: j is in
+    output[name][i] if the offset of object j from object i has a dot product
+    larger than eps with the direction name
+
+    Args:
+        coords (np.ndarray): (n, 3) coordinates of the objects
+        directions (dict): directions of the scene struct, name to (x, y, z)
+        eps (float, default=0.2): threshold of the dot products
+
+    Returns:
+        relationships (dict): name to the list of the sorted related indices of
+            each object
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+    names = [name for name in directions if name not in ("above", "below")]
+    if len(names) == 0:
+        return {}
+    matrix = np.array([directions[name] for name in names], dtype=float).T
+
+    # (n, n, n_directions) projections of the offsets coords[j] - coords[i]
+    related = (coords[None, :, :] - coords[:, None, :]) @ matrix > eps
+    related[np.arange(len(coords)), np.arange(len(coords))] = False
+
+    return {
+        name: [np.flatnonzero(row).tolist() for row in related[:, :, k]]
+        for k, name in enumerate(names)
+    }
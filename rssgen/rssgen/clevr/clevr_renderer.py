@@ -22,6 +22,7 @@ from rssgen.utils import log, set_log_level
 from rssgen.parsers import clever_parser
 import sympy as sp
 from clevr_utils import stdout_redirected
+from clevr_layout import solve_layout, cube_footprint, compute_relationships
 
 """
 Renders random scenes using Blender, each with with a random number of objects;
@@ -1426,10 +1427,9 @@ def add_random_objects(scene_struct, num_objects, args, camera, world_to_generat
         with open(args.shape_color_combos_json, "r") as f:
             shape_color_combos = list(json.load(f).items())
 
-    positions = []
-    objects = []
-    blender_objects = []
-
+    # Choose the attributes of the objects first: their sizes and shapes give the
+    # footprints of the layout
+    specs = []
     for i in range(num_objects):
         # Choose a random size
         if world_to_generate is None:
@@ -1439,49 +1439,6 @@ def add_random_objects(scene_struct, num_objects, args, camera, world_to_generat
             size_name = world_to_generate[i][SIZE_IDX]
             r = size_kv_mapping[size_name]
 
-        # Try to place the object, ensuring that we don't intersect any existing
-        # objects and that we are more than the desired margin away from all existing
-        # objects along all cardinal directions.
-        num_tries = 0
-        while True:
-            # If we try and fail to place an object too many times, then delete all
-            # the objects in the scene and start over.
-            num_tries += 1
-            if num_tries > args.max_retries:
-                for obj in blender_objects:
-                    clevr_utils.delete_object(obj)
-                log("warning", "failed to place the object!")
-                return add_random_objects(
-                    scene_struct, num_objects, args, camera, world_to_generate
-                )
-
-            x = random.uniform(-3, 3)
-            y = random.uniform(-3, 3)
-            # Check to make sure the new object is further than min_dist from all
-            # other objects, and further than margin along the four cardinal directions
-            dists_good = True
-            margins_good = True
-            for xx, yy, rr in positions:
-                dx, dy = x - xx, y - yy
-                dist = math.sqrt(dx * dx + dy * dy)
-                if dist - r - rr < args.min_dist:
-                    dists_good = False
-                    break
-                for direction_name in ["left", "right", "front", "behind"]:
-                    direction_vec = scene_struct["directions"][direction_name]
-                    assert direction_vec[2] == 0
-                    margin = dx * direction_vec[0] + dy * direction_vec[1]
-                    if 0 < margin < args.margin:
-                        log("warning", margin, args.margin, direction_name)
-                        log("warning", "BROKEN MARGIN!")
-                        margins_good = False
-                        break
-                if not margins_good:
-                    break
-
-            if dists_good and margins_good:
-                break
-
         # Choose random color and shape
         if shape_color_combos is None:
             obj_name, obj_name_out = random.choice(object_mapping)
@@ -1500,19 +1457,6 @@ def add_random_objects(scene_struct, num_objects, args, camera, world_to_generat
             obj_name_out = world_to_generate[i][SHAPE_IDX]
             obj_name = object_kv_mapping[obj_name_out]
 
-        # For cube, adjust the size a bit
-        if obj_name == "Cube":
-            r /= math.sqrt(2)
-
-        # Choose random orientation for the object.
-        theta = 360.0 * random.random()
-
-        # Actually add the object to the scene
-        clevr_utils.add_object(args.shape_dir, obj_name, r, (x, y), theta=theta)
-        obj = bpy.context.object
-        blender_objects.append(obj)
-        positions.append((x, y, r))
-
         # Attach a random material
         if world_to_generate is None:
             # random material
@@ -1522,49 +1466,81 @@ def add_random_objects(scene_struct, num_objects, args, camera, world_to_generat
             mat_name_out = world_to_generate[i][MATERIAL_IDX]
             mat_name = material_kv_mapping[mat_name_out]
 
-        clevr_utils.add_material(mat_name, Color=rgba)
-
-        # Record data about the object in the scene data structure
-        pixel_coords = clevr_utils.get_camera_coords(camera, obj.location)
-
-        # Get 2D pixel coordinates for all 8 points in the bounding box
-        scene = bpy.context.scene
-        cam_ob = scene.camera
-        me_ob = bpy.context.object
-
-        bound_box = camera_view_bounds_2d(bpy.context.scene, cam_ob, me_ob)
-
-        objects.append(
-            {
-                "shape": obj_name_out,
-                "size": size_name,
-                "material": mat_name_out,
-                "3d_coords": tuple(obj.location),
-                "rotation": theta,
-                "pixel_coords": pixel_coords,
-                "color": color_name,
-                "x": bound_box.x,
-                "y": bound_box.y,
-                "width": bound_box.width,
-                "height": bound_box.height,
-            }
+        specs.append(
+            (size_name, r, obj_name, obj_name_out, color_name, rgba, mat_name, mat_name_out)
         )
 
-    if args.no_occlusion:
-        # Check that all objects are at least partially visible in the rendered image
-        all_visible = check_visibility(blender_objects, args.min_pixels_per_object)
-
-        if not all_visible:
-            # If any of the objects are fully occluded then start over; delete all
-            # objects from the scene and place them all again.
-            log("warning", "Some objects are occluded; replacing objects")
-            for obj in blender_objects:
-                clevr_utils.delete_object(obj)
-            return add_random_objects(
-                scene_struct, num_objects, args, camera, world_to_generate
+    radii = [spec[1] for spec in specs]
+    # For cube, adjust the size a bit
+    footprints = [
+        cube_footprint(spec[1]) if spec[2] == "Cube" else spec[1] for spec in specs
+    ]
+    rng = np.random.default_rng(random.getrandbits(32))
+
+    while True:
+        # The objects are further than min_dist from each other, and further than
+        # margin along the four cardinal directions; the layout is solved without
+        # touching the blender scene
+        layout = solve_layout(
+            radii,
+            scene_struct["directions"],
+            args.min_dist,
+            args.margin,
+            rng,
+            footprints=footprints,
+            max_retries=args.max_retries,
+        )
+
+        objects = []
+        blender_objects = []
+        for spec, (x, y, r, theta) in zip(specs, layout):
+            size_name, _, obj_name, obj_name_out, color_name, rgba = spec[:6]
+            mat_name, mat_name_out = spec[6:]
+
+            # Actually add the object to the scene
+            clevr_utils.add_object(args.shape_dir, obj_name, r, (x, y), theta=theta)
+            obj = bpy.context.object
+            blender_objects.append(obj)
+
+            clevr_utils.add_material(mat_name, Color=rgba)
+
+            # Record data about the object in the scene data structure
+            pixel_coords = clevr_utils.get_camera_coords(camera, obj.location)
+
+            # Get 2D pixel coordinates for all 8 points in the bounding box
+            scene = bpy.context.scene
+            cam_ob = scene.camera
+            me_ob = bpy.context.object
+
+            bound_box = camera_view_bounds_2d(bpy.context.scene, cam_ob, me_ob)
+
+            objects.append(
+                {
+                    "shape": obj_name_out,
+                    "size": size_name,
+                    "material": mat_name_out,
+                    "3d_coords": tuple(obj.location),
+                    "rotation": theta,
+                    "pixel_coords": pixel_coords,
+                    "color": color_name,
+                    "x": bound_box.x,
+                    "y": bound_box.y,
+                    "width": bound_box.width,
+                    "height": bound_box.height,
+                }
             )
 
-    return objects, blender_objects
+        # Check that all objects are at least partially visible in the rendered image
+        if not args.no_occlusion or check_visibility(
+            blender_objects, args.min_pixels_per_object
+        ):
+            return objects, blender_objects
+
+        # If any of the objects are fully occluded then start over; delete all
+        # objects from the scene and place them all again.
+        log("warning", "Some objects are occluded; replacing objects")
+        for obj in blender_objects:
+            clevr_utils.delete_object(obj)
 
 
 def compute_all_relationships(scene_struct, eps=0.2):
@@ -1576,24 +1552,8 @@ def compute_all_relationships(scene_struct, eps=0.2):
     relationship rel with object i. For example if j is in output['left'][i] then
     object j is left of object i.
     """
-    all_relationships = {}
-    for name, direction_vec in scene_struct["directions"].items():
-        if name == "above" or name == "below":
-            continue
-        all_relationships[name] = []
-        for i, obj1 in enumerate(scene_struct["objects"]):
-            coords1 = obj1["3d_coords"]
-            related = set()
-            for j, obj2 in enumerate(scene_struct["objects"]):
-                if obj1 == obj2:
-                    continue
-                coords2 = obj2["3d_coords"]
-                diff = [coords2[k] - coords1[k] for k in [0, 1, 2]]
-                dot = sum(diff[k] * direction_vec[k] for k in [0, 1, 2])
-                if dot > eps:
-                    related.add(j)
-            all_relationships[name].append(sorted(list(related)))
-    return all_relationships
+    coords = [obj["3d_coords"] for obj in scene_struct["objects"]]
+    return compute_relationships(coords, scene_struct["directions"], eps)
 
 
 def check_visibility(blender_objects, min_pixels_per_object):
@@ -0,0 +1,366 @@
+"""Parallel, streaming compression of the generated datasets.
+
+The files of a folder are compressed in independent blocks by a pool of
+threads (zlib and bz2 release the GIL), with a bounded number of blocks in
+flight, so that compressing a split uses all the cores and holds only a few
+blocks in memory:
+
+- tar.gz and bz2: a tar stream of the files, cut at file boundaries into
+  blocks of about block_size bytes, each compressed as its own gzip or bzip2
+  stream. The concatenated streams are a regular .tar.gz / .tar.bz2 archive.
+- gzip: one gzip member per file, with the name of the file in its header.
+- zip: a regular zip archive, the files are read in parallel.
+
+Next to the archive, a manifest (<archive>.manifest.json) records the block and
+the offset of every file, together with its size and CRC32, which allow reading
+a single file back (read_member) and verifying the archive (verify_archive).
+"""
+
+import bz2
+import gzip
+import io
+import json
+import os
+import tarfile
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from tqdm import tqdm
+
+from rssgen.utils import log
+
+COMPRESSION_TYPES = ("zip", "gzip", "tar.gz", "bz2")
+BLOCK_SIZE = 4 * 2**20
+
+
+def manifest_path(archive_path):
+    """Path of the manifest of an archive"""
+    return f"{archive_path}.manifest.json"
+
+
+def _num_workers(num_workers):
+    return num_workers if num_workers else os.cpu_count() or 1
+
+
+def _ordered_map(executor, func, items, window):
+    """executor.map with at most window items in flight, in order"""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _compress_stream(compression_type, data, level):
+    if compression_type == "bz2":
+        return bz2.compress(data, compresslevel=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _decompress_stream(compression_type, data):
+    if compression_type == "bz2":
+        return bz2.decompress(data)
+    return gzip.decompress(data)
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _tar_header(name, size):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = 0o644
+    return info.tobuf(tarfile.DEFAULT_FORMAT, "utf-8", "surrogateescape")
+
+
+def _tar_blocks(files, block_size):
+    """Groups the (path, name, size) files in blocks of about block_size
+    bytes of tar stream"""
+    block, size = [], 0
+    for file in files:
+        block.append(file)
+        size += file[2]
+        if size >= block_size:
+            yield block
+            block, size = [], 0
+    if block:
+        yield block
+
+
+def _compress_tar_block(compression_type, level, block):
+    """Tar stream of the files of a block, compressed, and the entries of the
+    files in the manifest"""
+    buffer = io.BytesIO()
+    members = []
+    for path, name, _ in block:
+        data = _read(path)
+        buffer.write(_tar_header(name, len(data)))
+        members.append(
+            {
+                "name": name,
+                "offset": buffer.tell(),
+                "size": len(data),
+                "crc32": zlib.crc32(data),
+            }
+        )
+        buffer.write(data)
+        buffer.write(b"\0" * (-len(data) % tarfile.BLOCKSIZE))
+    return _compress_stream(compression_type, buffer.getvalue(), level), members
+
+
+def _compress_gzip_member(level, file):
+    """One file as a gzip member, with its name in the header"""
+    path, name, _ = file
+    data = _read(path)
+    buffer = io.BytesIO()
+    with gzip.GzipFile(
+        filename=name, mode="wb", fileobj=buffer, compresslevel=level, mtime=0
+    ) as f:
+        f.write(data)
+    member = {"name": name, "offset": 0, "size": len(data), "crc32": zlib.crc32(data)}
+    return buffer.getvalue(), [member]
+
+
+def _read_zip_member(file):
+    path, name, _ = file
+    return name, _read(path)
+
+
+def compress_folder(
+    folder,
+    archive_path,
+    compression_type,
+    files=None,
+    num_workers=None,
+    block_size=BLOCK_SIZE,
+    level=9,
+):
+    """Compresses the files of a folder in an archive and writes its manifest
+
+    Args:
+        folder (str): folder to compress
+        archive_path (str): path of the archive
+        compression_type (str): one of COMPRESSION_TYPES
+        files (list, default=None): names of the files to compress, all the
+            files of the folder by default
+        num_workers (int, default=None): compressing threads, one per core by default
+        block_size (int, default=BLOCK_SIZE): uncompressed size of the tar blocks
+        level (int, default=9): compression level
+
+    Returns:
+        manifest (dict): manifest of the archive
+    """
+    if compression_type not in COMPRESSION_TYPES:
+        raise ValueError(f"Unsupported compression type: {compression_type}")
+
+    if files is None:
+        files = sorted(e.name for e in os.scandir(folder) if e.is_file())
+    files = [
+        (os.path.join(folder, name), name, os.path.getsize(os.path.join(folder, name)))
+        for name in files
+    ]
+
+    num_workers = _num_workers(num_workers)
+    manifest = {"format": compression_type, "blocks": [], "members": []}
+    progress = tqdm(total=len(files), desc="Compressing")
+
+    with ThreadPoolExecutor(num_workers) as executor:
+        if compression_type == "zip":
+            with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+                for name, data in _ordered_map(
+                    executor, _read_zip_member, files, 2 * num_workers
+                ):
+                    zipf.writestr(name, data, compresslevel=level)
+                    manifest["members"].append(
+                        {"name": name, "size": len(data), "crc32": zlib.crc32(data)}
+                    )
+                    progress.update()
+
+        else:
+            if compression_type == "gzip":
+                blocks = files
+                compress = partial(_compress_gzip_member, level)
+            else:
+                blocks = _tar_blocks(files, block_size)
+                compress = partial(_compress_tar_block, compression_type, level)
+
+            with open(archive_path, "wb") as f:
+                for data, members in _ordered_map(
+                    executor, compress, blocks, 2 * num_workers
+                ):
+                    for member in members:
+                        member["block"] = len(manifest["blocks"])
+                    manifest["blocks"].append({"offset": f.tell(), "length": len(data)})
+                    manifest["members"].extend(members)
+                    f.write(data)
+                    progress.update(len(members))
+
+                if compression_type != "gzip":
+                    # end of the tar archive
+                    f.write(
+                        _compress_stream(
+                            compression_type, b"\0" * (2 * tarfile.BLOCKSIZE), level
+                        )
+                    )
+
+    progress.close()
+    with open(manifest_path(archive_path), "w") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def load_manifest(archive_path):
+    """Manifest of an archive"""
+    with open(manifest_path(archive_path), "r") as f:
+        return json.load(f)
+
+
+def _read_block(archive_path, manifest, block):
+    """Uncompressed content of a block of an archive"""
+    block = manifest["blocks"][block]
+    with open(archive_path, "rb") as f:
+        f.seek(block["offset"])
+        return _decompress_stream(manifest["format"], f.read(block["length"]))
+
+
+def read_member(archive_path, name, manifest=None):
+    """Reads a single file of an archive, decompressing only its block
+
+    Args:
+        archive_path (str): path of the archive
+        name (str): name of the file
+        manifest (dict, default=None): manifest of the archive, loaded if None
+
+    Returns:
+        data (bytes): content of the file
+    """
+    manifest = load_manifest(archive_path) if manifest is None else manifest
+    if manifest["format"] == "zip":
+        with zipfile.ZipFile(archive_path) as zipf:
+            return zipf.read(name)
+
+    member = next(m for m in manifest["members"] if m["name"] == name)
+    data = _read_block(archive_path, manifest, member["block"])
+    return data[member["offset"] : member["offset"] + member["size"]]
+
+
+def verify_archive(archive_path, num_workers=None):
+    """Checks the size and the CRC32 of every file of an archive against its
+    manifest, decompressing the blocks in parallel
+
+    Args:
+        archive_path (str): path of the archive
+        num_workers (int, default=None): threads, one per core by default
+
+    Returns:
+        corrupted (list): names of the files which do not match the manifest
+    """
+    manifest = load_manifest(archive_path)
+
+    if manifest["format"] == "zip":
+        with zipfile.ZipFile(archive_path) as zipf:
+            infos = {info.filename: info for info in zipf.infolist()}
+        return [
+            m["name"]
+            for m in manifest["members"]
+            if m["name"] not in infos
+            or infos[m["name"]].CRC != m["crc32"]
+            or infos[m["name"]].file_size != m["size"]
+        ]
+
+    by_block = [[] for _ in manifest["blocks"]]
+    for member in manifest["members"]:
+        by_block[member["block"]].append(member)
+
+    def check(block):
+        try:
+            data = _read_block(archive_path, manifest, block)
+        except (OSError, EOFError, zlib.error):
+            return [m["name"] for m in by_block[block]]
+        return [
+            m["name"]
+            for m in by_block[block]
+            if zlib.crc32(data[m["offset"] : m["offset"] + m["size"]]) != m["crc32"]
+        ]
+
+    num_workers = _num_workers(num_workers)
+    with ThreadPoolExecutor(num_workers) as executor:
+        return [
+            name
+            for names in _ordered_map(
+                executor, check, range(len(by_block)), 2 * num_workers
+            )
+            for name in names
+        ]
+
+
+def compress_dataset(
+    folders,
+    output_dir,
+    compression_type,
+    keep_only_compressed=False,
+    num_workers=None,
+):
+    """Compresses each folder in output_dir/<folder name>.<compression_type>;
+    the original files are deleted only if their archive is verified
+
+    Args:
+        folders (list): folders to compress
+        output_dir (str): folder of the archives
+        compression_type (str): one of COMPRESSION_TYPES
+        keep_only_compressed (bool, default=False): delete the original files
+        num_workers (int, default=None): compressing threads, one per core by default
+
+    Returns:
+        None: This function does not return a value.
+    """
+    if compression_type not in COMPRESSION_TYPES:
+        log("info", f"Unsupported compression type: {compression_type}")
+        return
+
+    for folder in folders:
+        log("info", f"Compressing files in {folder} using {compression_type}...")
+
+        files_to_compress = sorted(
+            e.name
+            for e in os.scandir(folder)
+            if e.is_file() and not e.name.endswith(f".{compression_type}")
+        )
+        if not files_to_compress:
+            log("info", "No files to compress.")
+            continue
+
+        archive_path = os.path.join(
+            output_dir, f"{os.path.basename(os.path.normpath(folder))}.{compression_type}"
+        )
+        compress_folder(
+            folder,
+            archive_path,
+            compression_type,
+            files=files_to_compress,
+            num_workers=num_workers,
+        )
+        log("info", f"Compression for {folder} complete.")
+
+        # Delete the original files if the user wants
+        if keep_only_compressed:
+            corrupted = verify_archive(archive_path, num_workers)
+            if corrupted:
+                log(
+                    "error",
+                    f"{len(corrupted)} files of {archive_path} do not match the "
+                    "originals, which are kept",
+                )
+                continue
+
+            log("info", f"Deleting uncompressed {folder} samples..")
+            for file in tqdm(files_to_compress, desc="Deleting"):
+                os.remove(os.path.join(folder, file))
+            log("info", f"Done!")
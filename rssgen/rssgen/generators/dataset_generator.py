@@ -1,8 +1,8 @@
 import os
 import matplotlib.pyplot as plt
 import joblib
-from tqdm import tqdm
 from rssgen.utils import log
+from rssgen.compression import compress_dataset
 
 from PIL import Image
 
@@ -249,9 +249,11 @@ class GenericSyntheticDatasetGenerator:
                 image = synthetic_image["image"]
                 color = synthetic_image["cmap"]
 
-                # Save image
-                image_path = os.path.join(folder, f"{i}.png")
-                self._save_img(image, color, image_path)
+                # Save image, unless the generator is index-only: the meta
+                # records the indices of its MNIST digits
+                if image is not None:
+                    image_path = os.path.join(folder, f"{i}.png")
+                    self._save_img(image, color, image_path)
 
                 # Save metadata as joblib file
                 metadata = {"label": label, "meta": meta}
@@ -262,63 +264,9 @@ class GenericSyntheticDatasetGenerator:
             self.compress_dataset(compression_type, keep_only_compressed)
 
     def compress_dataset(self, compression_type, keep_only_compressed=False):
-        import gzip
-        import zipfile
-        import tarfile
-
-        for folder in [self.train_path, self.val_path, self.test_path]:
-            log("info", f"Compressing files in {folder} using {compression_type}...")
-
-            files_to_compress = [
-                f for f in os.listdir(folder) if not f.endswith(f".{compression_type}")
-            ]
-
-            if not files_to_compress:
-                log("info", "No files to compress.")
-                return
-
-            compressed_file_path = os.path.join(
-                self.output_path, f"{folder.split('/')[-1]}.{compression_type}"
-            )
-
-            if compression_type == "zip":
-                with zipfile.ZipFile(
-                    compressed_file_path, "w", zipfile.ZIP_DEFLATED
-                ) as zipf:
-                    for file in tqdm(files_to_compress, desc="Compressing"):
-                        file_path = os.path.join(folder, file)
-                        zipf.write(file_path, os.path.basename(file_path))
-
-            elif compression_type == "gzip":
-                with open(compressed_file_path, "wb") as gzipped_file:
-                    with gzip.GzipFile(fileobj=gzipped_file, mode="wb") as zipf:
-                        for file in tqdm(files_to_compress, desc="Compressing"):
-                            file_path = os.path.join(folder, file)
-                            with open(file_path, "rb") as f:
-                                zipf.write(f.read())
-
-            elif compression_type == "tar.gz":
-                with tarfile.open(compressed_file_path, "w:gz") as tarf:
-                    for file in tqdm(files_to_compress, desc="Compressing"):
-                        file_path = os.path.join(folder, file)
-                        tarf.add(file_path, arcname=os.path.basename(file_path))
-
-            elif compression_type == "bz2":
-                with tarfile.open(compressed_file_path, "w:bz2") as tarf:
-                    for file in tqdm(files_to_compress, desc="Compressing"):
-                        file_path = os.path.join(folder, file)
-                        tarf.add(file_path, arcname=os.path.basename(file_path))
-
-            else:
-                log("info", f"Unsupported compression type: {compression_type}")
-                return
-
-            log("info", f"Compression for {folder} complete.")
-
-            # Delete the original files if the user wants
-            if keep_only_compressed:
-                log("info", f"Deleting uncompressed {folder} samples..")
-                for file in tqdm(files_to_compress, desc="Deleting"):
-                    file_path = os.path.join(folder, file)
-                    os.remove(file_path)
-                log("info", f"Done!")
+        compress_dataset(
+            [self.train_path, self.val_path, self.test_path],
+            self.output_path,
+            compression_type,
+            keep_only_compressed,
+        )
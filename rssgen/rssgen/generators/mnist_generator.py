@@ -28,6 +28,7 @@ class SyntheticMNISTGenerator(GenericSyntheticDatasetGenerator):
         multiple_labels,
         ood_prop,
         mnist_path="data/MNIST/raw",
+        index_only=False,
         **kwargs,
     ):
         super().__init__(output_path, val_prop, test_prop, ood_prop)
@@ -41,6 +42,7 @@ class SyntheticMNISTGenerator(GenericSyntheticDatasetGenerator):
             self.n_equations = len(logic)
         self.symbols = symbols
         self.multiple_labels = multiple_labels
+        self.index_only = index_only
 
         # MNIST DATA
         self.mnist_path = mnist_path
@@ -48,16 +50,26 @@ class SyntheticMNISTGenerator(GenericSyntheticDatasetGenerator):
         self.mnist_data = MNIST(self.mnist_path)
         self.mnist_data.gz = True
 
+        # the digits keep their index in the MNIST files (source), which is
+        # what the metas record
         (
             self.train_mnist_images,
             self.train_mnist_labels,
         ) = self.mnist_data.load_training()
-        self.train_mnist_images, self.train_mnist_labels = self.filter_mnist_by_digits(
+        (
+            self.train_mnist_images,
+            self.train_mnist_labels,
+            self.train_mnist_sources,
+        ) = self.filter_mnist_by_digits(
             self.train_mnist_images, self.train_mnist_labels, self.digits
         )
 
         self.test_mnist_images, self.test_mnist_labels = self.mnist_data.load_testing()
-        self.test_mnist_images, self.test_mnist_labels = self.filter_mnist_by_digits(
+        (
+            self.test_mnist_images,
+            self.test_mnist_labels,
+            self.test_mnist_sources,
+        ) = self.filter_mnist_by_digits(
             self.test_mnist_images, self.test_mnist_labels, self.digits
         )
 
@@ -83,16 +95,19 @@ class SyntheticMNISTGenerator(GenericSyntheticDatasetGenerator):
         """Return all the combinations (counting the system of equations)"""
         return list(product(digits, repeat=num_digits * self.n_equations))
 
-    def filter_mnist_by_digits(self, images, labels, digits):
-        """Filter MNSIT by digit"""
+    def filter_mnist_by_digits(self, images, labels, digits, sources=None):
+        """Filter MNSIT by digit, keeping the index of the images in the MNIST files"""
         # Convert images and labels to numpy arrays
         images_array = np.array(images)
         labels_array = np.array(labels)
+        if sources is None:
+            sources = np.arange(len(labels_array))
 
         # Filter images and labels based on specified digits
         mask = np.isin(labels_array, digits)
         filtered_images = images_array[mask]
         filtered_labels = labels_array[mask]
+        filtered_sources = np.asarray(sources)[mask]
 
         # Shuffle the data
         indices = np.arange(len(filtered_labels))
@@ -100,10 +115,11 @@ class SyntheticMNISTGenerator(GenericSyntheticDatasetGenerator):
 
         filtered_images = filtered_images[indices]
         filtered_labels = filtered_labels[indices]
+        filtered_sources = filtered_sources[indices]
 
-        return filtered_images, filtered_labels
+        return filtered_images, filtered_labels, filtered_sources
 
-    def get_filtered_data(self, name, images, labels, digit):
+    def get_filtered_data(self, name, images, labels, digit, sources=None):
         """Filter data"""
         if name == "train":
             if digit in self.train_filtered_dictionary:
@@ -113,25 +129,23 @@ class SyntheticMNISTGenerator(GenericSyntheticDatasetGenerator):
             if digit in self.test_filtered_dictionary:
                 return self.test_filtered_dictionary[digit]
 
-        filtered_images, filtered_labels = self.filter_mnist_by_digits(
-            images, labels, digit
-        )
+        filtered = self.filter_mnist_by_digits(images, labels, digit, sources)
 
         if name == "train":
-            self.train_filtered_dictionary[digit] = [filtered_images, filtered_labels]
+            self.train_filtered_dictionary[digit] = filtered
 
         if name == "test":
-            self.test_filtered_dictionary[digit] = [filtered_images, filtered_labels]
+            self.test_filtered_dictionary[digit] = filtered
 
-        return filtered_images, filtered_labels
+        return filtered
 
-    def get_random_specific_mnist_digit(self, name, images, labels, digit):
-        """Get a specific MNIST digit"""
-        filtered_images, filtered_labels = self.get_filtered_data(
-            name, images, labels, digit
+    def get_random_specific_mnist_digit(self, name, images, labels, digit, sources=None):
+        """Get a specific MNIST digit, with its index in the MNIST files"""
+        filtered_images, filtered_labels, filtered_sources = self.get_filtered_data(
+            name, images, labels, digit, sources
         )
         idx = np.random.randint(0, len(filtered_images))
-        return filtered_images[idx], filtered_labels[idx]
+        return filtered_images[idx], filtered_labels[idx], filtered_sources[idx]
 
     def generate_synthetic_data(self, *args, train=True, world_to_generate=None):
         """Generate synthetic MNISTAdd and MNISTMath data"""
@@ -139,15 +153,16 @@ class SyntheticMNISTGenerator(GenericSyntheticDatasetGenerator):
         background = None
 
         # get images and labels
-        mnist_images, mnist_labels = (
-            (self.train_mnist_images, self.train_mnist_labels)
+        mnist_images, mnist_labels, mnist_sources = (
+            (self.train_mnist_images, self.train_mnist_labels, self.train_mnist_sources)
             if train
-            else (self.test_mnist_images, self.test_mnist_labels)
+            else (self.test_mnist_images, self.test_mnist_labels, self.test_mnist_sources)
         )
         train_name = "train" if train else "test"
 
-        # container of the concept annotation
+        # container of the concept annotation and of the indices of the digits
         concepts = []
+        sources = []
 
         # loop over the equations it has to generate
         for t in range(self.n_equations):
@@ -158,19 +173,26 @@ class SyntheticMNISTGenerator(GenericSyntheticDatasetGenerator):
                 idx = np.random.randint(0, len(mnist_images))
                 digit = mnist_images[idx]
                 a_concept = mnist_labels[idx]
+                source = mnist_sources[idx]
 
                 # if the world is passed, then override the random digit
                 if world_to_generate is not None:
-                    digit, a_concept = self.get_random_specific_mnist_digit(
+                    digit, a_concept, source = self.get_random_specific_mnist_digit(
                         train_name,
                         mnist_images,
                         mnist_labels,
                         world_to_generate[t * self.n_equations + j],
+                        mnist_sources,
                     )
 
                 # save digit and concept
                 digit = np.array(digit).reshape(28, 28)
                 c_list.append(a_concept)
+                sources.append(int(source))
+
+                # index-only: the image is composed from MNIST when it is read
+                if self.index_only:
+                    continue
 
                 if background is None:
                     background = digit
@@ -197,10 +219,12 @@ class SyntheticMNISTGenerator(GenericSyntheticDatasetGenerator):
         else:
             labels = self.evaluate_logic_expression(concepts, self.logic, self.symbols)
 
-        synthetic_image["image"] = np.clip(background, 0, 255).astype(np.uint8)
+        if not self.index_only:
+            synthetic_image["image"] = np.clip(background, 0, 255).astype(np.uint8)
         synthetic_image["cmap"] = "gray"
 
-        return synthetic_image, labels, {"concepts": concepts}
+        meta = {"concepts": concepts, "mnist_indices": sources, "mnist_split": train_name}
+        return synthetic_image, labels, meta
 
     def download_file(self, url, destination):
         """Download MNIST zip file"""
@@ -22,6 +22,7 @@ class SyntheticXORGenerator(GenericSyntheticDatasetGenerator):
         ood_prop,
         use_mnist=True,
         mnist_path="data/MNIST/raw",
+        index_only=False,
         **kwargs
     ):
         super().__init__(output_path, val_prop, test_prop, ood_prop)
@@ -29,28 +30,31 @@ class SyntheticXORGenerator(GenericSyntheticDatasetGenerator):
         self.logic = logic
         self.symbols = symbols
         self.use_mnist = use_mnist
+        self.index_only = index_only
         self.mnist = None
 
         if self.use_mnist:
             self.mnist = MNISTUtils(mnist_path)
 
     def _get_mnist_digit(self, digit_value):
-        """Return MNIST digit"""
-        image, _ = self.mnist.get_random_specific_mnist_digit(
+        """Return MNIST digit and its index in the MNIST training files"""
+        image, _, source = self.mnist.get_random_specific_mnist_digit(
             "train",
             self.mnist.train_mnist_images,
             self.mnist.train_mnist_labels,
             digit_value,
+            self.mnist.train_mnist_sources,
         )
         image = np.array(image).reshape(28, 28)
-        return image
+        return image, int(source)
 
     def generate_synthetic_data(self, *args, world_to_generate=None):
         """Generate the synthetic data"""
         synthetic_image = {"image": None, "color": None}
 
-        # container of the labels
+        # container of the labels and of the indices of the MNIST digits
         concepts = []
+        sources = []
         image = np.zeros((self.num_digits), dtype=int)
 
         if self.use_mnist:
@@ -66,7 +70,9 @@ class SyntheticXORGenerator(GenericSyntheticDatasetGenerator):
             concepts.append(digit)
             if self.use_mnist:
                 start = j * 28
-                image[:, start : start + 28] = self._get_mnist_digit(digit)
+                digit_image, source = self._get_mnist_digit(digit)
+                image[:, start : start + 28] = digit_image
+                sources.append(source)
             else:
                 image[j] = digit
 
@@ -76,11 +82,17 @@ class SyntheticXORGenerator(GenericSyntheticDatasetGenerator):
         if not self.use_mnist:
             image = image.reshape(1, self.num_digits)
 
-        synthetic_image["image"] = image
+        meta = {"concepts": concepts}
+        if self.use_mnist:
+            meta.update({"mnist_indices": sources, "mnist_split": "train"})
+
+        # index-only: the image is composed from MNIST when it is read
+        if not (self.use_mnist and self.index_only):
+            synthetic_image["image"] = image
         synthetic_image["cmap"] = "gray"
 
         label = bool(label)
-        return synthetic_image, label, {"concepts": concepts}
+        return synthetic_image, label, meta
 
     def _generate_binary_combinations(self, n):
         """Generate all the binary combinations"""
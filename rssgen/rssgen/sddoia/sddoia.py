@@ -838,44 +838,9 @@ def boia_concepts_filtered_by_gen(g, boia_concepts_values):
 
 
 def ensure_consistency(boia_concepts):
-    """Ensure consistency among concept"""
-    if boia_concepts["left_green_light"] != boia_concepts["right_green_light"]:
-        boia_concepts["right_green_light"] = boia_concepts["left_green_light"]
-    if boia_concepts["left_green_light"] != boia_concepts["green_light"]:
-        boia_concepts["left_green_light"] = boia_concepts["green_light"]
-        boia_concepts["right_green_light"] = boia_concepts["green_light"]
-    if boia_concepts["left_obstacle"]:
-        boia_concepts["left_follow"] = False
-    if boia_concepts["right_obstacle"]:
-        boia_concepts["right_follow"] = False
-    if boia_concepts["follow"]:
-        boia_concepts["other_obstacle"] = False
-    if boia_concepts["right_solid_line"]:
-        boia_concepts["right_follow"] = False
-    if boia_concepts["left_solid_line"]:
-        boia_concepts["left_follow"] = False
-
-    if not boia_concepts["left_lane"]:
-        boia_concepts["left_obstacle"] = False
-        boia_concepts["left_solid_line"] = False
-        boia_concepts["left_green_light"] = False
-        boia_concepts["left_follow"] = False
-        boia_concepts["left_solid_line"] = False
-        boia_concepts["no_left_lane"] = True
-    else:
-        boia_concepts["no_left_lane"] = False
-
-    if not boia_concepts["right_lane"]:
-        boia_concepts["right_obstacle"] = False
-        boia_concepts["right_solid_line"] = False
-        boia_concepts["right_green_light"] = False
-        boia_concepts["right_follow"] = False
-        boia_concepts["right_solid_line"] = False
-        boia_concepts["no_right_lane"] = True
-    else:
-        boia_concepts["no_right_lane"] = False
-
-    return boia_concepts
+    """Ensure consistency among concept (see ensure_consistency_packed)"""
+    packed = ensure_consistency_packed(pack_concepts(boia_concepts))
+    return unpack_concepts(int(packed), boia_concepts)
 
 
 def get_full_boia_concepts(g):
@@ -943,6 +908,20 @@ def get_full_boia_concepts(g):
     return boia_concepts_values, y
 
 
+def render_sample(args, world, idx, split, folder, output_scene, scene, y, instance):
+    """Job of the scheduler: renders a sample, seeded by its index so that a
+    re-rendered sample is the same"""
+    set_random_seed(args.seed + idx)
+    return generate_world(
+        args, world, idx, split, folder, output_scene, scene, y, instance
+    )
+
+
+def status_journal_path(status_log):
+    """Journal of the rendered samples, next to the status log"""
+    return os.path.splitext(status_log)[0] + "_journal.jsonl"
+
+
 def choose_scene(config):
     if config["left_lane"] and config["right_lane"]:
         return BOIA_FULL
@@ -1786,25 +1765,14 @@ if __name__ == "__main__":
     status_dict = {}
     set_random_seed(args.seed)
 
-    # Load the status log
+    # Load the status log, which holds the sampled configurations
     if args.load_status_dict:
         status_dict = load_status_log(args.status_log)
-        if not check_all_done(status_dict):
-            print("Not all done, continuing...")
-        else:
-            print("All done, exiting...")
-            exit(0)
-
         train_configs = status_dict["train_confs"]
         val_configs = status_dict["val_confs"]
         test_configs = status_dict["test_confs"]
         ood_configs = status_dict["ood_confs"]
 
-        start_idx_train = status_dict["train_done"]
-        start_idx_val = status_dict["val_done"]
-        start_idx_test = status_dict["test_done"]
-        start_idx_ood = status_dict["ood_done"]
-
     else:
         train_configs, val_configs, test_configs, ood_configs = configurations_split(
             args, args.n_config, args.n_samples
@@ -1816,109 +1784,69 @@ if __name__ == "__main__":
         status_dict["test_confs"] = test_configs
         status_dict["ood_confs"] = ood_configs
 
-        start_idx_train = [0 for _ in range(len(train_configs["conf"]))]
-        start_idx_val = [0 for _ in range(len(val_configs["conf"]))]
-        start_idx_test = [0 for _ in range(len(test_configs["conf"]))]
-        start_idx_ood = [0 for _ in range(len(ood_configs["conf"]))]
-
-        status_dict["train_done"] = start_idx_train
-        status_dict["val_done"] = start_idx_val
-        status_dict["test_done"] = start_idx_test
-        status_dict["ood_done"] = start_idx_ood
-
         # Save the status log
         save_status_log(status_dict, args.status_log)
 
-    # all scenes
-    all_scene_paths = []
+    # the rendered samples are appended to the journal: a restarted run
+    # (load_status_dict) skips them
+    journal = ProgressJournal(status_journal_path(args.status_log))
+    if not args.load_status_dict and len(journal) > 0:
+        print("New configurations: discarding the journal of the previous run")
+        os.remove(journal.path)
+        journal = ProgressJournal(journal.path)
+
+    scheduler = JobScheduler(
+        render_sample,
+        args.num_parallel_threads,
+        journal=journal,
+        max_retries=args.max_retries,
+        heartbeat_timeout=args.heartbeat_timeout,
+        job_timeout=args.job_timeout,
+        # the workers inherit the Blender session
+        start_method="fork",
+    )
 
+    # one job per sample, numbered in the order of the splits and configurations
     idx = 0
-    for config, folder in zip(
+    for config, split in zip(
         [train_configs, val_configs, test_configs, ood_configs],
-        [
-            f"{args.output_image_dir}/train",
-            f"{args.output_image_dir}/val",
-            f"{args.output_image_dir}/test",
-            f"{args.output_image_dir}/ood",
-        ],
+        ["train", "val", "test", "ood"],
     ):
-        for c_idx, (world, n_sample_per_config, scene, y, instance) in enumerate(
-            zip(
-                config["conf"],
-                config["num"],
-                config["scene"],
-                config["y"],
-                config["instance"],
-            )
+        folder = f"{args.output_image_dir}/{split}"
+        for world, n_sample_per_config, scene, y, instance in zip(
+            config["conf"],
+            config["num"],
+            config["scene"],
+            config["y"],
+            config["instance"],
         ):
-            # get the starting index
-            if folder == f"{args.output_image_dir}/train":
-                start_idx = start_idx_train[c_idx]
-            elif folder == f"{args.output_image_dir}/val":
-                start_idx = start_idx_val[c_idx]
-            elif folder == f"{args.output_image_dir}/test":
-                start_idx = start_idx_test[c_idx]
-            else:
-                start_idx = start_idx_ood[c_idx]
-
-            idx += start_idx
-
-            scenes_paths = []
-
-            print("To be generated", n_sample_per_config)
-
-            # regardless, regenerate all the samples for that config
-            n_iterations = n_sample_per_config // args.num_parallel_threads
-            n_proc_iter = args.num_parallel_threads
-
-            # starting from the start
-            n_i = 0
-            auxiliary_counter = 0
-
-            for i in range(0, n_iterations + 1):
-                if i == n_iterations:
-                    n_proc_iter = n_sample_per_config % args.num_parallel_threads
-
-                expected_samples = n_proc_iter
-                for j in range(n_proc_iter):
-                    # going to the right amount of samples
-                    if (n_i + start_idx) > auxiliary_counter:
-                        auxiliary_counter += 1
-                        expected_samples -= 1
-                        continue
-
-                    res = generate_world(
-                        args,
-                        world,
-                        idx + n_i,
-                        folder.split("/")[-1],
-                        folder,
-                        f"{args.output_scene_dir}/{args.filename_prefix}_{idx + n_i}.json",
-                        scene,
-                        y,
-                        instance,
-                    )
-                    n_i += 1
-                    auxiliary_counter += 1
-                    scenes_paths.append(res)
-
-                idx += len(scenes_paths)
-
-                # update the status dict
-                status_dict[f"{folder.split('/')[-1]}_done"][c_idx] += len(scenes_paths)
-
-                save_status_log(status_dict, args.status_log)
+            for _ in range(n_sample_per_config):
+                scheduler.submit(
+                    str(idx),
+                    args,
+                    world,
+                    idx,
+                    split,
+                    folder,
+                    f"{args.output_scene_dir}/{args.filename_prefix}_{idx}.json",
+                    scene,
+                    y,
+                    instance,
+                )
+                idx += 1
 
-                scenes_paths.sort()
-                all_scene_paths.extend(scenes_paths)
+    print("To be generated", idx - len(journal), "of", idx)
+    results = scheduler.run()
 
     # Check everything went fine
-    if not check_all_done(status_dict):
+    if len(results) < idx:
         print("Not all the images have been generated, please check the logs")
         print(
             "In any case, re-run the script with load_status_dict set to True to generate all data"
         )
 
+    all_scene_paths = [results[str(i)] for i in range(idx) if str(i) in results]
+
     # all scenes
     all_scenes = []
     for scene_path in all_scene_paths:
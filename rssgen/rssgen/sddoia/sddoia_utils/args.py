@@ -143,9 +143,11 @@ def configure_parser(parser) -> None:
     )
     parser.add_argument(
         "--num_parallel_threads",
-        default=4,
+        default=0,
         type=int,
-        help="The number of threads to be run in parallel to generate the images",
+        help="The number of worker processes rendering the images in parallel. "
+        + "The default 0 renders in the main process, one sample after the other; "
+        + "with more, the workers are forked from the Blender process",
     )
 
     # Internal settings
@@ -166,6 +168,24 @@ def configure_parser(parser) -> None:
         default="../../mini_boia_out_2/status_log.json",
         help="Status log file to keep track of the generated images and the chosen combinations",
     )
+    parser.add_argument(
+        "--max_retries",
+        default=2,
+        type=int,
+        help="Number of times a sample whose rendering failed or whose worker died is rendered again",
+    )
+    parser.add_argument(
+        "--heartbeat_timeout",
+        default=1800.0,
+        type=float,
+        help="Seconds without heartbeat after which a rendering worker is considered frozen and replaced",
+    )
+    parser.add_argument(
+        "--job_timeout",
+        default=3600.0,
+        type=float,
+        help="Seconds after which a sample still rendering is considered hung: its worker is replaced and the sample rendered again, 0 disables it",
+    )
     parser.add_argument(
         "--seed",
         default=0,
@@ -1,7 +1,13 @@
 # Module which contains the rules for SDDOIA
 # SDDOIAK is the default logic
 # oodSDDoiaK is the ood logic, in case specified
-
+#
+# The sympy formulas are the reference. The generator evaluates their compiled
+# version: a configuration of the 20 concepts is packed in an integer (bit i is
+# the i-th concept of CONCEPTS) and the rules are bitwise operations over numpy
+# arrays of packed configurations, so that they apply to many at once.
+import os
+import numpy as np
 from sympy import symbols, Not, Or, Eq, Implies, And, Piecewise, sympify
 
 
@@ -77,7 +83,7 @@ right_obstacle = symbols("right_obstacle")
 right_solid_line = symbols("right_solid_line")
 
 
-def apply_sddoiaK(values):
+def apply_sddoiaK_sympy(values):
     (stop, move_forward, turn_left, turn_right), clear, mf, stop = sddoiaK(
         red_light,
         green_light,
@@ -164,7 +170,7 @@ def oodSDDoiaK(
     return [stop, move_forward, turn_left, turn_right]
 
 
-def ood_knowledge(values):
+def ood_knowledge_sympy(values):
     (stop, move_forward, turn_left, turn_right) = oodSDDoiaK(
         red_light,
         green_light,
@@ -197,3 +203,184 @@ def ood_knowledge(values):
     ]
 
     return result
+
+
+# COMPILED RULES
+
+# order of the arguments of the rules, bit i of a packed configuration
+CONCEPTS = [
+    "red_light",
+    "green_light",
+    "car",
+    "person",
+    "rider",
+    "other_obstacle",
+    "follow",
+    "stop_sign",
+    "left_lane",
+    "left_green_light",
+    "left_follow",
+    "no_left_lane",
+    "left_obstacle",
+    "left_solid_line",
+    "right_lane",
+    "right_green_light",
+    "right_follow",
+    "no_right_lane",
+    "right_obstacle",
+    "right_solid_line",
+]
+BIT = {concept: 1 << i for i, concept in enumerate(CONCEPTS)}
+N_CONFIGURATIONS = 1 << len(CONCEPTS)
+
+# bits of the packed labels: stop, move_forward, turn_left, turn_right and clear
+LABEL_BITS = 5
+
+
+def mask(*concepts):
+    """Bit mask of the concepts"""
+    return sum(BIT[c] for c in concepts)
+
+
+def pack_concepts(values):
+    """Packs the truth values of the concepts (a dict, other keys are ignored)"""
+    return sum(BIT[c] for c in CONCEPTS if values[c])
+
+
+def unpack_concepts(packed, values=None):
+    """Truth values of a packed configuration, written in values if given"""
+    values = {} if values is None else values
+    for c in CONCEPTS:
+        values[c] = bool(packed & BIT[c])
+    return values
+
+
+def _any(x, *concepts):
+    return (x & mask(*concepts)) != 0
+
+
+def _set(x, bits, cond):
+    """Sets the bits where cond holds, clears them elsewhere"""
+    return np.where(cond, x | bits, x & ~bits)
+
+
+def _clear(x, bits, cond):
+    """Clears the bits where cond holds"""
+    return np.where(cond, x & ~bits, x)
+
+
+def ensure_consistency_packed(x):
+    """Consistent configurations: the traffic lights of the lanes are the
+    one of the road, there is nothing to follow in a lane with an obstacle or
+    a solid line, nor an obstacle ahead when following, and a missing lane
+    has no concept but no_*_lane
+
+    Args:
+        x (np.ndarray): packed configurations
+
+    Returns:
+        x (np.ndarray): consistent packed configurations
+    """
+    x = np.asarray(x, dtype=np.int64)
+    x = _set(x, mask("left_green_light", "right_green_light"), _any(x, "green_light"))
+    x = _clear(x, BIT["left_follow"], _any(x, "left_obstacle", "left_solid_line"))
+    x = _clear(x, BIT["right_follow"], _any(x, "right_obstacle", "right_solid_line"))
+    x = _clear(x, BIT["other_obstacle"], _any(x, "follow"))
+
+    for side in ["left", "right"]:
+        missing = ~_any(x, f"{side}_lane")
+        x = _clear(
+            x,
+            mask(
+                f"{side}_obstacle",
+                f"{side}_solid_line",
+                f"{side}_green_light",
+                f"{side}_follow",
+            ),
+            missing,
+        )
+        x = _set(x, BIT[f"no_{side}_lane"], missing)
+    return x
+
+
+def sddoia_labels(x):
+    """Compiled sddoiaK over packed configurations
+
+    Args:
+        x (np.ndarray): packed configurations
+
+    Returns:
+        labels (np.ndarray): (..., 4) stop, move_forward, turn_left, turn_right
+        clear (np.ndarray): whether the road is clear
+    """
+    x = np.asarray(x, dtype=np.int64)
+    red_light = _any(x, "red_light") & ~_any(x, "green_light")
+    obstacle = _any(x, "car", "person", "rider", "other_obstacle")
+    road_clear = ~obstacle
+    move_forward_cond = _any(x, "green_light", "follow") | road_clear
+    stop = red_light | _any(x, "stop_sign") | obstacle
+    move_forward = move_forward_cond & ~stop
+
+    turn_left = _any(x, "left_lane", "left_green_light", "left_follow") & ~_any(
+        x, "no_left_lane", "left_obstacle", "left_solid_line"
+    )
+    turn_right = _any(x, "right_lane", "right_green_light", "right_follow") & ~_any(
+        x, "no_right_lane", "right_obstacle", "right_solid_line"
+    )
+    labels = np.stack([stop, move_forward, turn_left, turn_right], axis=-1)
+    return labels.astype(np.uint8), road_clear
+
+
+def ood_labels(x):
+    """Compiled oodSDDoiaK (ambulance rules) over packed configurations
+
+    Args:
+        x (np.ndarray): packed configurations
+
+    Returns:
+        labels (np.ndarray): (..., 4) stop, move_forward, turn_left, turn_right
+    """
+    x = np.asarray(x, dtype=np.int64)
+    stop = _any(x, "car", "person", "rider", "other_obstacle")
+    turn_left = _any(x, "left_lane") & ~_any(x, "no_left_lane", "left_obstacle")
+    turn_right = _any(x, "right_lane") & ~_any(x, "no_right_lane", "right_obstacle")
+    labels = np.stack([stop, ~stop, turn_left, turn_right], axis=-1)
+    return labels.astype(np.uint8)
+
+
+def label_table(ood=False, cache_path=None):
+    """Labels of all the 2^20 configurations, indexed by the packed
+    configuration: bits 0-3 are the labels, bit 4 is clear (always 0 for the
+    ood rules). Stored in cache_path if given, loaded from it if it exists
+
+    Args:
+        ood (bool, default=False): ood (ambulance) rules
+        cache_path (str, default=None): .npy file of the table
+
+    Returns:
+        table (np.ndarray): (2^20,) uint8 packed labels
+    """
+    if cache_path is not None and os.path.exists(cache_path):
+        return np.load(cache_path)
+
+    x = np.arange(N_CONFIGURATIONS, dtype=np.int64)
+    if ood:
+        labels, clear = ood_labels(x), np.zeros(N_CONFIGURATIONS, dtype=bool)
+    else:
+        labels, clear = sddoia_labels(x)
+    weights = 1 << np.arange(LABEL_BITS, dtype=np.uint8)
+    table = (np.concatenate([labels, clear[:, None]], axis=1) * weights).sum(1)
+    table = table.astype(np.uint8)
+
+    if cache_path is not None:
+        np.save(cache_path, table)
+    return table
+
+
+def apply_sddoiaK(values):
+    labels, clear = sddoia_labels(pack_concepts(values))
+    return [int(l) for l in labels], bool(clear)
+
+
+def ood_knowledge(values):
+    return [int(l) for l in ood_labels(pack_concepts(values))]
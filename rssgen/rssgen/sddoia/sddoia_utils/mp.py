@@ -1,163 +1,293 @@
 import multiprocessing as mp
 import signal
-import sys
 import os
+import json
 import time
-import ctypes
-import itertools
-
-
-class CustomPool:
-    """Custom process pool for multiprocessing"""
-
-    def __init__(self, max_processes):
-        self.max_processes = max_processes
-        self.processes = []
-        self.manager = mp.Manager()
-        self.job_queue = []
-        self.results = self.manager.Queue()
-        self.finished = mp.Array(ctypes.c_bool, max_processes)
-        self.busy = mp.Array(ctypes.c_bool, max_processes)
-        self.finished_lock = mp.Lock()
-        self.id_counter = itertools.count()
-        self.available_pids = self.manager.Queue()
-
-        # initialize available pids
-        for i in range(max_processes):
-            self.available_pids.put(i)
-            self.finished[i] = True
-            self.busy[i] = False
-
-        self.terminate_flag = False
-        self.last_activity_time = time.time()
-        signal.signal(signal.SIGINT, self.terminate_on_interrupt)
-
-    def get_results(self):
-        results_list = []
-        while not self.results.empty():
-            results_list.append(self.results.get())
-        return results_list
-
-    def get_next_pid(self):
-        if self.available_pids:
-            return self.available_pids.get()
-        return None
-
-    def apply_async(self, func, args):
-        self.job_queue.append((func, args))
-        self.start_process_if_available()
-
-    def start_process_if_available(self):
-        while len(self.processes) < self.max_processes and self.job_queue:
-            with self.finished_lock:
-                func, args = self.job_queue.pop(0)
-                pid = self.get_next_pid()
-
-            if pid is not None:
-                process = mp.Process(
-                    target=self.wrapper_func,
-                    args=(
-                        self.results,
-                        self.finished,
-                        self.busy,
-                        self.finished_lock,
-                        func,
-                        args,
-                        pid,
-                    ),
-                )
-                process.start()
-                self.processes.append((process, (func, args), pid))
-            else:
-                print("No available processes")
-                break
+import threading
+import traceback
+from collections import deque
+from multiprocessing.connection import wait
+
+
+class ProgressJournal:
+    """Append-only journal of the completed jobs: one JSON line per job, with
+    its key and its result. A restarted run reads it back and skips the jobs
+    already done, nothing is ever rewritten"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # line truncated by a crash while it was written
+                        continue
+                    self.done[entry["key"]] = entry["result"]
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def record(self, key, result=None):
+        """Append a completed job, durably"""
+        self.done[key] = result
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"key": key, "result": result}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _worker_main(func, wid, conn, heartbeats, heartbeat_interval):
+    """Worker loop: runs the jobs received on conn until None and sends back
+    their results, while a thread beats the heartbeat of the worker"""
+    # the scheduler handles CTRL-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(heartbeat_interval):
+            heartbeats[wid] = time.time()
+
+    threading.Thread(target=beat, daemon=True).start()
+
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        key, args = job
+        heartbeats[wid] = time.time()
+        try:
+            conn.send(("done", key, func(*args)))
+        except Exception:
+            conn.send(("error", key, traceback.format_exc()))
+        heartbeats[wid] = time.time()
+
+    stop.set()
+
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.job = None
+        self.started = None
+
+
+class JobScheduler:
+    """Runs func over jobs in worker processes.
+
+    Each worker has its own pipe and nothing is shared but the heartbeats, so
+    that a worker killed at any point cannot block the others. It runs one job
+    at a time, sent by the scheduler, so that the job of a worker which dies,
+    stops beating its heartbeat for heartbeat_timeout seconds (a stopped or
+    frozen process) or runs a job for more than job_timeout seconds (a hung
+    job, the heartbeat thread keeps beating) is known: the worker is replaced
+    and the job is queued again, up to max_retries times. Jobs are identified by a key; the completed ones are
+    appended to the journal, if any, and skipped when submitted again. With
+    num_workers=0 the jobs run in the calling process.
+    """
 
-    def wrapper_func(self, results, finished, busy, finished_lock, func, args, pid):
+    def __init__(
+        self,
+        func,
+        num_workers,
+        journal=None,
+        max_retries=2,
+        heartbeat_interval=5.0,
+        heartbeat_timeout=1800.0,
+        job_timeout=None,
+        start_method=None,
+    ):
+        self.func = func
+        self.num_workers = num_workers
+        self.journal = journal
+        self.max_retries = max_retries
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.job_timeout = job_timeout
+        self.ctx = mp.get_context(start_method)
+
+        self.pending = deque()
+        self.jobs = {}
+        self.attempts = {}
+        self.results = {}
+        self.failed = {}
+        self.workers = {}
+
+    def submit(self, key, *args):
+        """Queue a job, unless it is already completed (or queued)"""
+        if self.journal is not None and key in self.journal:
+            self.results[key] = self.journal.done[key]
+            return
+        if key in self.jobs:
+            return
+        self.jobs[key] = args
+        self.attempts[key] = 0
+        self.pending.append(key)
+
+    def run(self):
+        """Run all the queued jobs
+
+        Returns:
+            results (dict): results of the completed jobs, by key
+        """
+        if self.num_workers == 0:
+            self._run_inline()
+            return self.results
+
+        # unlocked: a worker killed while beating would hold the lock forever
+        self.heartbeats = self.ctx.Array("d", self.num_workers, lock=False)
         try:
-            # Initialization
-            with finished_lock:
-                finished[pid] = False
-                busy[pid] = True
-                print("Pid", pid, "started")
-
-            result = func(*args)
-            results.put(result)
-
-            with finished_lock:
-                finished[pid] = True
-                busy[pid] = False
-                print("Pid", pid, "finished")
-
-        except Exception as e:
-            print(f"Process terminated unexpectedly: {e}")
-            self.terminate()
-
-    def wait_for_termination(self):
-        while self.processes:
-            current_time = time.time()
-            elapsed_time = current_time - self.last_activity_time
-
-            if (
-                elapsed_time > 30
-            ):  # If it's been more than 60 seconds without any activity
-                print(
-                    "Too much time without activity. Stopping everything [press CTR-C]. Try to run the code with the load_status_dict parameter"
-                )
-                os._exit(1)
-
-            for process_tuple in self.processes[:]:
-                process, job, pid = process_tuple
-                process.join(timeout=0.1)
-
-                if not process.is_alive():
-                    self.processes.remove(process_tuple)
-                    with self.finished_lock:
-                        print("Pid", pid, "is dead")
-                        if not self.finished[pid]:
-                            print(pid, "hasn't finished")
-                            if job not in self.job_queue:
-                                self.job_queue.append(
-                                    job
-                                )  # Reassign job if not in queue
-                                print("Reassigning job of pid", pid)
-                        self.last_activity_time = time.time()
-                        self.finished[pid] = False
-                        self.busy[pid] = False
-                        self.available_pids.put(pid)
-                        print("Pid is now available", pid)
-
-                    if self.job_queue:
-                        self.start_process_if_available()  # Respawn dead process
-                else:
-                    with self.finished_lock:
-                        print(
-                            "Pid is",
-                            pid,
-                            "JOB QUEUE",
-                            self.job_queue,
-                            self.busy[pid],
-                            self.finished[pid],
-                        )
-                        print("Job", job)
-                        if not self.busy[pid]:
-                            print("Pid", pid, "has nothing to do, terminating...")
-                            self.last_activity_time = time.time()
-                            process.terminate()
-            time.sleep(0.1)
-
-    def terminate(self):
-        self.terminate_flag = True
-        for process, _ in self.processes:
-            process.terminate()
-        self.processes = []  # Clear processes list
-
-    def terminate_on_interrupt(self, signum, frame):
-        self.terminate()
-        sys.exit(1)
+            for slot in range(min(self.num_workers, len(self.pending))):
+                self._spawn(slot)
+
+            while self.pending or self._running():
+                self._dispatch()
+                # wakes up on a result, on the death of a worker or to check
+                # the heartbeats
+                conns = {w.conn: slot for slot, w in self.workers.items()}
+                sentinels = [w.process.sentinel for w in self.workers.values()]
+                for ready in wait(list(conns) + sentinels, self.heartbeat_interval):
+                    if ready in conns:
+                        self._receive(conns[ready])
+                self._check_workers()
+        finally:
+            self._shutdown()
+
+        return self.results
+
+    def _run_inline(self):
+        while self.pending:
+            key = self.pending.popleft()
+            try:
+                self._complete(key, self.func(*self.jobs[key]))
+            except Exception:
+                print(f"Job {key} failed:\n{traceback.format_exc()}")
+                self._retry(key, traceback.format_exc())
+
+    def _spawn(self, slot):
+        conn, worker_conn = self.ctx.Pipe()
+        self.heartbeats[slot] = time.time()
+        process = self.ctx.Process(
+            target=_worker_main,
+            args=(
+                self.func,
+                slot,
+                worker_conn,
+                self.heartbeats,
+                self.heartbeat_interval,
+            ),
+            daemon=True,
+        )
+        process.start()
+        worker_conn.close()
+        self.workers[slot] = _Worker(process, conn)
+
+    def _running(self):
+        return any(w.job is not None for w in self.workers.values())
+
+    def _dispatch(self):
+        for slot, worker in self.workers.items():
+            if worker.job is None and self.pending:
+                key = self.pending.popleft()
+                worker.job = key
+                worker.started = time.time()
+                self.attempts[key] += 1
+                self.heartbeats[slot] = time.time()
+                worker.conn.send((key, self.jobs[key]))
+
+    def _receive(self, slot):
+        worker = self.workers[slot]
+        try:
+            kind, key, payload = worker.conn.recv()
+        except (EOFError, OSError):
+            # the worker died, _check_workers replaces it
+            return
+        worker.job = None
+
+        if kind == "done":
+            self._complete(key, payload)
+        else:
+            print(f"Job {key} failed:\n{payload}")
+            self._retry(key, payload)
+
+    def _complete(self, key, result):
+        # a job re-queued after a kill may complete twice
+        if key in self.results:
+            return
+        self.results[key] = result
+        self.failed.pop(key, None)
+        if key in self.pending:
+            self.pending.remove(key)
+        if self.journal is not None:
+            self.journal.record(key, result)
+
+    def _retry(self, key, reason):
+        if key in self.results:
+            return
+        # the workers count the attempts when the job is sent
+        if self.num_workers == 0:
+            self.attempts[key] += 1
+        if self.attempts[key] > self.max_retries:
+            print(f"Job {key} failed {self.attempts[key]} times, giving up")
+            self.failed[key] = reason
+        elif key not in self.pending:
+            self.pending.append(key)
+
+    def _check_workers(self):
+        now = time.time()
+        for slot, worker in list(self.workers.items()):
+            alive = worker.process.is_alive()
+            silent = now - self.heartbeats[slot] > self.heartbeat_timeout
+            timed_out = (
+                self.job_timeout
+                and worker.job is not None
+                and now - worker.started > self.job_timeout
+            )
+            if alive and not silent and not timed_out:
+                continue
+
+            if not alive:
+                reason = "died"
+            elif timed_out:
+                reason = f"ran job {worker.job} for more than {self.job_timeout}s"
+            else:
+                reason = "stopped beating its heartbeat"
+            print(f"Worker {slot} {reason}, replacing it")
+            if alive:
+                # SIGKILL, which also ends a stopped process
+                worker.process.kill()
+            worker.process.join()
+            worker.conn.close()
+
+            if worker.job is not None:
+                self._retry(worker.job, f"worker {reason}")
+            del self.workers[slot]
+            if self.pending or self._running():
+                self._spawn(slot)
+
+    def _shutdown(self):
+        for worker in self.workers.values():
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        for worker in self.workers.values():
+            worker.process.join(timeout=self.heartbeat_interval)
+            if worker.process.is_alive():
+                worker.process.kill()
+            worker.conn.close()
+        self.workers = {}
 
     def __enter__(self):
-        self.last_activity_time = time.time()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.terminate()
+        self._shutdown()